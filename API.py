@@ -1,52 +1,92 @@
 import asyncio
-import gc
+import hashlib
+import hmac
+import importlib.util
 import json
 import os
 import shutil
-import sys
-import time
 import uuid
 from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
 
 import matplotlib
-from fastapi import BackgroundTasks, FastAPI, HTTPException, Query, Response
+from fastapi import FastAPI, HTTPException, Query, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from shapely.geometry import box, mapping
 from starlette.requests import Request
 from starlette.status import HTTP_504_GATEWAY_TIMEOUT
 
-from src.virtughan.engine import VirtughanProcessor
-from src.virtughan.extract import ExtractProcessor
-from src.virtughan.tile import TileProcessor
-from src.virtughan.utils import search_stac_api_async
-
-app = FastAPI()
-
-matplotlib.use("Agg")
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+from src.virtughan.animation import ANIMATION_FORMATS, available_formats
+from src.virtughan.archive import directory_files, stream_zip
+from src.virtughan.colormap import parse_rescale, prebuild_luts
+from src.virtughan.extract import EXTRACT_FORMATS
+from src.virtughan.jobs import (
+    FINISHED_STATUSES,
+    JOB_COMPLETED,
+    JobLimitError,
+    JobQueue,
+)
+from src.virtughan.metrics import REGISTRY, recording, span
+from src.virtughan.profiling import PROFILE_MODES, profiled
+from src.virtughan.progress import read_events, tail_log
+from src.virtughan.pyramid import MBTilesStore
+from src.virtughan.reducers import REDUCERS
+from src.virtughan.temporal import (
+    TEMPORAL_STATS,
+    parse_baseline,
+    parse_temporal_stats,
 )
+from src.virtughan.tile import TILE_FORMATS, TileProcessor, negotiate_tile_format
+from src.virtughan.utils import search_stac_api_async
 
 EXPIRY_DURATION_HOURS = int(os.getenv("EXPIRY_DURATION_HOURS", 1))
 EXPIRY_DURATION = timedelta(hours=EXPIRY_DURATION_HOURS)
 REQUEST_TIMEOUT = int(os.getenv("REQUEST_TIMEOUT", 120))
+EVENTS_POLL_INTERVAL = float(os.getenv("EVENTS_POLL_INTERVAL", 0.5))
+EVENTS_HEARTBEAT = int(os.getenv("EVENTS_HEARTBEAT", 15))
 STATIC_EXPORT_DIR = os.getenv("STATIC_EXPORT_DIR", "static/export")
 STATIC_DIR = os.getenv("STATIC_DIR", "static")
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", "jobs.db")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2))
+JOB_MAX_PER_CLIENT = int(os.getenv("JOB_MAX_PER_CLIENT", 2))
+TILE_PYRAMID_DIR = os.getenv("TILE_PYRAMID_DIR", "pyramids")
+TILE_PYRAMID_CACHE_TIME = int(os.getenv("TILE_PYRAMID_CACHE_TIME", 24 * 60 * 60))
+# profiling is only allowed to callers sending this token in X-Profile-Token
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN")
+# tiles are computed on the shared event loop, where cProfile would also see
+# every other request and clash with a concurrent profiled tile
+TILE_PROFILE_MODES = ("sample",)
+
+job_queue = JobQueue(
+    JOBS_DB_PATH, workers=JOB_WORKERS, max_jobs_per_client=JOB_MAX_PER_CLIENT
+)
+tile_processor = TileProcessor.from_env()
+pyramids = {}
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    job_queue.start()
+    prebuild_luts()
     asyncio.create_task(cleanup_expired_folders())
     yield
+    job_queue.stop()
+
+
+app = FastAPI(lifespan=lifespan)
+
+matplotlib.use("Agg")
+
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
 
 
 @app.middleware("http")
@@ -96,13 +136,10 @@ async def list_files(uid: str):
 
 @app.get("/logs")
 async def get_logs(uid: str):
-    log_file = f"{STATIC_EXPORT_DIR}/{uid}/runtime.log"
-    if os.path.exists(log_file):
-        with open(log_file, "r") as file:
-            logs = file.readlines()[-30:]
-        return Response("\n".join(logs), media_type="text/plain")
-    else:
+    logs = tail_log(f"{STATIC_EXPORT_DIR}/{uid}", lines=30)
+    if logs is None:
         return JSONResponse(content={"error": "Log file not found"}, status_code=404)
+    return Response("\n".join(logs), media_type="text/plain")
 
 
 @app.get("/sentinel2-bands")
@@ -128,7 +165,7 @@ async def get_sentinel2_bands(
 
 @app.get("/export")
 async def compute_aoi_over_time(
-    background_tasks: BackgroundTasks,
+    request: Request,
     bbox: str = Query(
         ..., description="Bounding box in the format 'west,south,east,north'"
     ),
@@ -160,10 +197,65 @@ async def compute_aoi_over_time(
     smart_filter: bool = Query(
         False, description="Should smart filter be applied ? (default: False)"
     ),
+    rescale: str = Query(
+        None,
+        description="Range mapped to the colormap as 'min,max' (default: -1,1 for normalized differences, else the 2nd to 98th percentiles of the area)",
+    ),
+    pyramid: bool = Query(
+        False,
+        description="Also write tile pyramids of the results, served by /jobs/{uid}/tiles (default: False)",
+    ),
+    temporal_stats: str = Query(
+        None,
+        description=f"Comma separated per pixel statistics over time written as the bands of temporal_stats.tif, from {', '.join(TEMPORAL_STATS)} (default: None)",
+    ),
+    baseline: str = Query(
+        None,
+        description="Baseline period of the anomaly statistic as 'start,end' dates in YYYY-MM-DD format (default: None)",
+    ),
+    render: bool = Query(
+        True,
+        description="Render the colormap, trend plot, annotated frames and GIF, disable to only write the rasters (default: True)",
+    ),
+    animation: str = Query(
+        "gif",
+        description=f"Comma separated formats of the timeseries animation, from {', '.join(ANIMATION_FORMATS)}, mp4 and webm need ffmpeg (default: gif)",
+    ),
+    priority: int = Query(
+        0, description="Job priority, higher runs first (default: 0)"
+    ),
+    profile: str = Query(
+        None,
+        description=f"Profile the job with {', '.join(PROFILE_MODES)}, the profile and a memory report are written to static/export/<uid>, needs the X-Profile-Token header (default: None)",
+    ),
 ):
-    if timeseries is False and operation is None:
+    profile_error = _check_profile(request, profile)
+    if profile_error:
+        return profile_error
+    animation = [fmt.strip() for fmt in animation.split(",") if fmt.strip()]
+    unavailable = [fmt for fmt in animation if fmt not in available_formats()]
+    if unavailable:
+        return JSONResponse(
+            content={
+                "error": f"Animation format {', '.join(unavailable)} not available. Choose from {', '.join(available_formats())}"
+            },
+            status_code=400,
+        )
+    try:
+        temporal_stats = parse_temporal_stats(temporal_stats)
+        baseline = parse_baseline(baseline)
+    except ValueError as e:
+        return JSONResponse(content={"error": str(e)}, status_code=400)
+    if temporal_stats and "anomaly" in temporal_stats and not baseline:
+        return JSONResponse(
+            content={"error": "Baseline is required for the anomaly statistic"},
+            status_code=400,
+        )
+    if timeseries is False and operation is None and not temporal_stats:
         return JSONResponse(
-            content={"error": "Operation is required if timeseries is disabled"},
+            content={
+                "error": "Operation or temporal stats are required if timeseries is disabled"
+            },
             status_code=400,
         )
     if band1 is None:
@@ -184,26 +276,29 @@ async def compute_aoi_over_time(
             status_code=400,
         )
 
+    note = None
     if band2 and band1 != band2:
         band1_gsd = sentinel2_assets[band1].get("gsd")
         band2_gsd = sentinel2_assets[band2].get("gsd")
 
-        if band1_gsd != band2_gsd:
-            return JSONResponse(
-                content={
-                    "error": f"Band resolution mismatch: '{band1}' has {band1_gsd}m resolution while '{band2}' has {band2_gsd}m resolution"
-                },
-                status_code=400,
+        if band1_gsd and band2_gsd and band1_gsd != band2_gsd:
+            # the engine reads the finer band on the grid of the coarser one
+            (finer_gsd, finer), (coarser_gsd, coarser) = sorted(
+                [(band1_gsd, band1), (band2_gsd, band2)]
             )
+            note = f"Band '{finer}' ({finer_gsd}m) is resampled to the {coarser_gsd}m grid of '{coarser}'"
 
-    valid_operations = ["mean", "median", "max", "min", "std", "sum", "var"]
-    if operation and operation not in valid_operations:
+    if operation and operation not in REDUCERS:
         return JSONResponse(
             content={
-                "error": f"Invalid operation {operation}. Choose from 'mean', 'median', 'max', 'min', 'std', 'sum', 'var'"
+                "error": f"Invalid operation {operation}. Choose from {', '.join(REDUCERS)}"
             },
             status_code=400,
         )
+    try:
+        rescale = parse_rescale(rescale)
+    except ValueError as e:
+        return JSONResponse(content={"error": str(e)}, status_code=400)
     bbox = list(map(float, bbox.split(",")))
 
     uid = datetime.now().strftime("%Y%m%d%H%M%S") + "_" + str(uuid.uuid4())[:6]
@@ -213,73 +308,44 @@ async def compute_aoi_over_time(
         shutil.rmtree(output_dir)
     os.makedirs(output_dir, exist_ok=True)
 
-    background_tasks.add_task(
-        run_computation,
-        bbox,
-        start_date,
-        end_date,
-        cloud_cover,
-        formula,
-        band1,
-        band2,
-        operation,
-        timeseries,
-        output_dir,
-        smart_filter,
-    )
-    return JSONResponse(
-        content={
-            "message": f"Processing started in background: {output_dir}",
-            "uid": uid,
-        },
-        status_code=201,
-    )
-
-
-async def run_computation(
-    bbox,
-    start_date,
-    end_date,
-    cloud_cover,
-    formula,
-    band1,
-    band2,
-    operation,
-    timeseries,
-    output_dir,
-    smart_filter,
-):
-    log_file = f"{output_dir}/runtime.log"
-    if os.path.exists(log_file):
-        os.remove(log_file)
-    with open(log_file, "a") as f:
-        sys.stdout = f
-
-        print("Starting processing...")
-        try:
-            processor = VirtughanProcessor(
-                bbox=bbox,
-                start_date=start_date,
-                end_date=end_date,
-                cloud_cover=cloud_cover,
-                formula=formula,
-                band1=band1,
-                band2=band2,
-                operation=operation,
-                timeseries=timeseries,
-                output_dir=output_dir,
-                log_file=f,
-                smart_filter=smart_filter,
-            )
-            processor.compute()
-            print(f"Processing completed. Results saved in {output_dir}")
-
-        except Exception as e:
-            # raise e
-            print(f"Error processing : {e}")
+    try:
+        job_queue.submit(
+            "export",
+            {
+                "bbox": bbox,
+                "start_date": start_date,
+                "end_date": end_date,
+                "cloud_cover": cloud_cover,
+                "formula": formula,
+                "band1": band1,
+                "band2": band2,
+                "operation": operation,
+                "timeseries": timeseries,
+                "smart_filter": smart_filter,
+                "rescale": rescale,
+                "pyramid": pyramid,
+                "temporal_stats": temporal_stats,
+                "baseline": baseline,
+                "render": render,
+                "animation": animation,
+                "profile": profile,
+            },
+            output_dir,
+            client=_client_id(request),
+            priority=priority,
+            uid=uid,
+        )
+    except JobLimitError as e:
+        shutil.rmtree(output_dir)
+        return JSONResponse(content={"error": str(e)}, status_code=429)
 
-        finally:
-            gc.collect()
+    content = {
+        "message": f"Processing queued: {output_dir}",
+        "uid": uid,
+    }
+    if note:
+        content["note"] = note
+    return JSONResponse(content=content, status_code=201)
 
 
 @app.get("/search")
@@ -310,6 +376,7 @@ async def search_images(
 
 @app.get("/tile/{z}/{x}/{y}")
 async def get_tile(
+    request: Request,
     z: int,
     x: int,
     y: int,
@@ -334,7 +401,32 @@ async def get_tile(
     timeseries: bool = Query(
         False, description="Should timeseries be analyzed (default: False)"
     ),
+    rescale: str = Query(
+        None,
+        description="Range mapped to the colormap as 'min,max' (default: -1,1 for normalized differences, else the 2nd to 98th percentiles of the area)",
+    ),
+    pyramid: str = Query(
+        None,
+        description="Name of a seeded MBTiles pyramid in TILE_PYRAMID_DIR to serve the tile from instead of computing it",
+    ),
+    profile: str = Query(
+        None,
+        description=f"Profile the request with {', '.join(TILE_PROFILE_MODES)}, the profile and a memory report are written to static/export/<uid>, needs the X-Profile-Token header (default: None)",
+    ),
 ):
+    profile_error = _check_profile(request, profile, TILE_PROFILE_MODES)
+    if profile_error:
+        return profile_error
+    if pyramid:
+        pyramid_path = os.path.join(
+            TILE_PYRAMID_DIR, f"{os.path.basename(pyramid)}.mbtiles"
+        )
+        if not os.path.exists(pyramid_path):
+            return JSONResponse(
+                content={"error": f"Pyramid {pyramid} not found"}, status_code=404
+            )
+        return await _pyramid_tile_response(request, pyramid_path, z, x, y)
+
     if z < 10 or z > 23:
         return JSONResponse(
             content={"error": "Zoom level must be between 10 and 23"},
@@ -351,31 +443,64 @@ async def get_tile(
         end_date = datetime.now().strftime("%Y-%m-%d")
 
     try:
-        start_time = time.time()
-        tile_processor = TileProcessor()
-        image_bytes, feature = await tile_processor.cached_generate_tile(
-            x,
-            y,
-            z,
-            start_date,
-            end_date,
-            cloud_cover,
-            band1,
-            band2,
-            formula,
-            colormap_str,
-            operation=operation,
-            latest=(timeseries is False),
+        rescale = parse_rescale(rescale)
+    except ValueError as e:
+        return JSONResponse(content={"error": str(e)}, status_code=400)
+
+    output_format = negotiate_tile_format(request.headers.get("accept"))
+    profile_uid = profile_dir = None
+    if profile:
+        profile_uid = (
+            datetime.now().strftime("%Y%m%d%H%M%S") + "_" + str(uuid.uuid4())[:8]
         )
-        computation_time = time.time() - start_time
+        profile_dir = f"{STATIC_EXPORT_DIR}/{profile_uid}"
+    try:
+        with profiled(profile_dir, profile), recording() as recorder:
+            with span("tile.request"):
+                image_bytes, feature = await tile_processor.cached_generate_tile(
+                    x,
+                    y,
+                    z,
+                    start_date,
+                    end_date,
+                    cloud_cover,
+                    band1,
+                    band2,
+                    formula,
+                    colormap_str,
+                    operation=operation,
+                    latest=(timeseries is False),
+                    output_format=output_format,
+                    rescale=rescale,
+                )
 
+        etag = f'"{hashlib.sha1(image_bytes).hexdigest()}"'
+        partial = feature.get("partial", False)
+        max_age = (
+            tile_processor.partial_cache_time
+            if partial
+            else tile_processor.cache_ttl(timeseries is False)
+        )
         headers = {
-            "X-Computation-Time": str(computation_time),
+            "Server-Timing": recorder.server_timing(),
+            "Timing-Allow-Origin": "*",
             "X-Image-Date": feature["properties"]["datetime"],
             "X-Cloud-Cover": str(feature["properties"]["eo:cloud_cover"]),
+            "X-Tile-Partial": str(partial).lower(),
+            "ETag": etag,
+            "Cache-Control": f"public, max-age={max_age}",
+            "Vary": "Accept",
         }
-
-        return Response(content=image_bytes, media_type="image/png", headers=headers)
+        if profile_uid:
+            headers["X-Profile"] = profile_uid
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers=headers)
+
+        return Response(
+            content=image_bytes,
+            media_type=TILE_FORMATS[output_format],
+            headers=headers,
+        )
     except Exception as ex:
         # raise ex
         return JSONResponse(
@@ -385,7 +510,7 @@ async def get_tile(
 
 @app.get("/image-download")
 async def extract_raw_bands_as_image(
-    background_tasks: BackgroundTasks,
+    request: Request,
     bbox: str = Query(
         ..., description="Bounding box in the format 'west,south,east,north'"
     ),
@@ -405,7 +530,33 @@ async def extract_raw_bands_as_image(
     smart_filter: bool = Query(
         False, description="Should smart filter be applied ? (default: False)"
     ),
+    output_format: str = Query(
+        "tiff",
+        description="Output layout: tiff (float GeoTIFF per scene), cog (COG per scene in the band data type), stack (one multi-temporal GeoTIFF) or zarr (one Zarr cube) (default: tiff)",
+    ),
+    priority: int = Query(
+        0, description="Job priority, higher runs first (default: 0)"
+    ),
+    profile: str = Query(
+        None,
+        description=f"Profile the job with {', '.join(PROFILE_MODES)}, the profile and a memory report are written to static/export/<uid>, needs the X-Profile-Token header (default: None)",
+    ),
 ):
+    profile_error = _check_profile(request, profile)
+    if profile_error:
+        return profile_error
+    if output_format not in EXTRACT_FORMATS:
+        return JSONResponse(
+            content={
+                "error": f"Invalid output format {output_format}. Choose from {', '.join(EXTRACT_FORMATS)}"
+            },
+            status_code=400,
+        )
+    if output_format == "zarr" and importlib.util.find_spec("zarr") is None:
+        return JSONResponse(
+            content={"error": "Zarr output is not available on this server"},
+            status_code=400,
+        )
     uid = datetime.now().strftime("%Y%m%d%H%M%S") + "_" + str(uuid.uuid4())[:8]
 
     output_dir = f"{STATIC_EXPORT_DIR}/{uid}"
@@ -415,52 +566,190 @@ async def extract_raw_bands_as_image(
         shutil.rmtree(output_dir)
     os.makedirs(output_dir, exist_ok=True)
 
-    background_tasks.add_task(
-        run_image_download,
-        bbox,
-        start_date,
-        end_date,
-        cloud_cover,
-        bands_list.split(","),
-        output_dir,
-        smart_filter,
-    )
+    try:
+        job_queue.submit(
+            "image-download",
+            {
+                "bbox": bbox,
+                "start_date": start_date,
+                "end_date": end_date,
+                "cloud_cover": cloud_cover,
+                "bands_list": bands_list.split(","),
+                "smart_filter": smart_filter,
+                "output_format": output_format,
+                "profile": profile,
+            },
+            output_dir,
+            client=_client_id(request),
+            priority=priority,
+            uid=uid,
+        )
+    except JobLimitError as e:
+        shutil.rmtree(output_dir)
+        return JSONResponse(content={"error": str(e)}, status_code=429)
+
     return {
-        "message": f"Raw band extraction started in background: {output_dir}",
+        "message": f"Raw band extraction queued: {output_dir}",
         "uid": uid,
     }
 
 
-async def run_image_download(
-    bbox, start_date, end_date, cloud_cover, bands_list, output_dir, smart_filter
-):
-    log_file = f"{output_dir}/runtime.log"
-    if os.path.exists(log_file):
-        os.remove(log_file)
-    with open(log_file, "a") as f:
-        sys.stdout = f
-
-        print("Starting raw band extraction...")
-        try:
-            processor = ExtractProcessor(
-                bbox=bbox,
-                start_date=start_date,
-                end_date=end_date,
-                cloud_cover=cloud_cover,
-                bands_list=bands_list,
-                output_dir=output_dir,
-                log_file=f,
-                zip_output=True,
-                smart_filter=smart_filter,
+@app.get("/metrics")
+async def get_metrics():
+    return Response(
+        REGISTRY.prometheus(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+@app.get("/jobs/{uid}")
+async def get_job_status(uid: str):
+    status = job_queue.status(uid)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return JSONResponse(content=status)
+
+
+@app.post("/jobs/{uid}/cancel")
+async def cancel_job(uid: str):
+    if job_queue.status(uid) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if not job_queue.cancel(uid):
+        return JSONResponse(
+            content={"error": "Job is not queued or running"}, status_code=409
+        )
+    return JSONResponse(content={"message": "Cancellation requested", "uid": uid})
+
+
+@app.get("/jobs/{uid}/archive")
+async def download_job_archive(uid: str):
+    job = job_queue.store.get(uid)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] != JOB_COMPLETED:
+        return JSONResponse(
+            content={"error": f"Job is {job['status']}, not completed"},
+            status_code=409,
+        )
+    if not os.path.isdir(job["output_dir"]):
+        raise HTTPException(status_code=404, detail="Job outputs expired")
+    # zipped on the fly while it is sent, the archive is never written to disk
+    files = await asyncio.to_thread(directory_files, job["output_dir"])
+    return StreamingResponse(
+        stream_zip(files),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{uid}.zip"'},
+    )
+
+
+@app.get("/jobs/{uid}/tiles/{name}/{z}/{x}/{y}")
+async def get_job_tile(request: Request, uid: str, name: str, z: int, x: int, y: int):
+    pyramid_path = os.path.join(
+        STATIC_EXPORT_DIR,
+        os.path.basename(uid),
+        "pyramids",
+        f"{os.path.basename(name)}.mbtiles",
+    )
+    if not os.path.exists(pyramid_path):
+        return JSONResponse(
+            content={"error": f"Pyramid {name} not found for job {uid}"},
+            status_code=404,
+        )
+    return await _pyramid_tile_response(request, pyramid_path, z, x, y)
+
+
+@app.get("/jobs/{uid}/events")
+async def stream_job_events(request: Request, uid: str):
+    job = await asyncio.to_thread(job_queue.store.get, uid)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    last_event_id = request.headers.get("last-event-id")
+    offset = int(last_event_id) if last_event_id and last_event_id.isdigit() else 0
+
+    async def event_stream(offset):
+        idle = 0.0
+        while not await request.is_disconnected():
+            events, offset = await asyncio.to_thread(
+                read_events, job["output_dir"], offset
             )
-            processor.extract()
-            print(f"Raw band extraction completed. Results saved in {output_dir}")
+            for event_offset, event in events:
+                yield f"id: {event_offset}\nevent: {event['type']}\ndata: {json.dumps(event)}\n\n"
+                if event["type"] == "job_finished":
+                    return
+            if events:
+                idle = 0.0
+                continue
+            status = await asyncio.to_thread(job_queue.status, uid)
+            if status is None or status["status"] in FINISHED_STATUSES:
+                # the worker was cancelled or died before writing its final event
+                events, offset = await asyncio.to_thread(
+                    read_events, job["output_dir"], offset
+                )
+                if not events:
+                    finished = {
+                        "type": "job_finished",
+                        "status": status["status"] if status else None,
+                        "error": status["error"] if status else None,
+                    }
+                    yield f"event: job_finished\ndata: {json.dumps(finished)}\n\n"
+                    return
+                continue
+            idle += EVENTS_POLL_INTERVAL
+            if idle >= EVENTS_HEARTBEAT:
+                idle = 0.0
+                yield ": heartbeat\n\n"
+            await asyncio.sleep(EVENTS_POLL_INTERVAL)
+
+    return StreamingResponse(
+        event_stream(offset),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def _pyramid_tile_response(request: Request, path, z, x, y):
+    store = pyramids.get(path)
+    if store is None:
+        store = pyramids[path] = MBTilesStore(path, readonly=True)
+    image_bytes = await asyncio.to_thread(store.get, z, x, y)
+    if image_bytes is None:
+        return Response(status_code=404)
+    output_format = (await asyncio.to_thread(store.metadata)).get("format", "png")
+    etag = f'"{hashlib.sha1(image_bytes).hexdigest()}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={TILE_PYRAMID_CACHE_TIME}",
+    }
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(
+        content=image_bytes,
+        media_type=TILE_FORMATS.get(output_format, "application/octet-stream"),
+        headers=headers,
+    )
+
+
+def _client_id(request: Request):
+    # behind a proxy, run uvicorn with --proxy-headers so this is the real client
+    return request.client.host if request.client else None
 
-        except Exception as e:
-            print(f"Error during raw band extraction: {e}")
 
-        finally:
-            gc.collect()
+def _check_profile(request: Request, profile, modes=PROFILE_MODES):
+    if profile is None:
+        return None
+    if profile not in modes:
+        return JSONResponse(
+            content={
+                "error": f"Invalid profile mode {profile}. Choose from {', '.join(modes)}"
+            },
+            status_code=400,
+        )
+    token = request.headers.get("x-profile-token", "")
+    if not PROFILE_TOKEN or not hmac.compare_digest(token, PROFILE_TOKEN):
+        return JSONResponse(
+            content={"error": "Profiling is not allowed for this caller"},
+            status_code=403,
+        )
+    return None
 
 
 async def cleanup_expired_folders():
@@ -474,6 +763,10 @@ async def cleanup_expired_folders():
                     folder_name.split("_")[0], "%Y%m%d%H%M%S"
                 )
                 if now - folder_creation_time > EXPIRY_DURATION:
+                    for pyramid_path in list(pyramids):
+                        if pyramid_path.startswith(folder_path + os.sep):
+                            pyramids.pop(pyramid_path).close()
                     shutil.rmtree(folder_path)
                     print(f"Deleted expired folder: {folder_path}")
+        job_queue.store.purge((now - EXPIRY_DURATION).timestamp())
         await asyncio.sleep(1 * 60 * 60)  # Run the cleanup task every 1 hours
@@ -0,0 +1,165 @@
+import asyncio
+import copy
+import json
+
+import mercantile
+
+from virtughan.engine import VirtughanProcessor
+from virtughan.extract import ExtractProcessor
+from virtughan.tile import TileProcessor
+from virtughan.utils import (
+    filter_intersected_features,
+    filter_latest_image_per_grid,
+    remove_overlapping_sentinel2_tiles,
+    search_stac_api,
+    smart_filter_images,
+)
+
+NDVI = "(band2-band1)/(band2+band1)"
+
+
+def engine_aggregate(config):
+    VirtughanProcessor(
+        config["bbox"],
+        config["start_date"],
+        config["end_date"],
+        config["cloud_cover"],
+        NDVI,
+        "red",
+        "nir",
+        "median",
+        False,
+        config["output_dir"],
+        workers=config["workers"],
+    ).compute()
+
+
+def engine_timeseries(config):
+    VirtughanProcessor(
+        config["bbox"],
+        config["start_date"],
+        config["end_date"],
+        config["cloud_cover"],
+        NDVI,
+        "red",
+        "nir",
+        "median",
+        True,
+        config["output_dir"],
+        workers=config["workers"],
+    ).compute()
+
+
+def engine_mixed_resolution(config):
+    VirtughanProcessor(
+        config["bbox"],
+        config["start_date"],
+        config["end_date"],
+        config["cloud_cover"],
+        "(band1-band2)/(band1+band2)",
+        "nir",
+        "swir16",
+        "median",
+        False,
+        config["output_dir"],
+        workers=config["workers"],
+    ).compute()
+
+
+def extract_tiff(config):
+    ExtractProcessor(
+        config["bbox"],
+        config["start_date"],
+        config["end_date"],
+        config["cloud_cover"],
+        ["red", "green", "blue", "nir"],
+        config["output_dir"],
+        workers=config["workers"],
+        zip_output=True,
+    ).extract()
+
+
+def extract_cog_mixed_resolution(config):
+    ExtractProcessor(
+        config["bbox"],
+        config["start_date"],
+        config["end_date"],
+        config["cloud_cover"],
+        ["red", "swir16", "coastal"],
+        config["output_dir"],
+        workers=config["workers"],
+        zip_output=True,
+        output_format="cog",
+    ).extract()
+
+
+def _benchmark_tiles(config, zoom):
+    return list(mercantile.tiles(*config["bbox"], zooms=[zoom]))
+
+
+async def _render_tiles(config, zoom, latest):
+    tile_processor = TileProcessor()
+    tiles = _benchmark_tiles(config, zoom)
+    await asyncio.gather(
+        *(
+            tile_processor.cached_generate_tile(
+                tile.x,
+                tile.y,
+                tile.z,
+                config["start_date"],
+                config["end_date"],
+                config["cloud_cover"],
+                "red",
+                "nir",
+                NDVI,
+                latest=latest,
+            )
+            for tile in tiles
+        )
+    )
+
+
+def tile_latest(config):
+    asyncio.run(_render_tiles(config, 14, latest=True))
+
+
+def tile_timeseries(config):
+    asyncio.run(_render_tiles(config, 13, latest=False))
+
+
+def stac_search(config):
+    search_stac_api(
+        config["bbox"], config["start_date"], config["end_date"], config["cloud_cover"]
+    )
+
+
+def filters(config, copies=200):
+    with open(config["items_path"]) as file:
+        items = json.load(file)
+    # many zones and grids, as in a search over a large area
+    features = []
+    for index in range(copies):
+        for item in items:
+            feature = copy.deepcopy(item)
+            parts = feature["id"].split("_")
+            parts[1] = f"{40 + index % 8}R{chr(65 + index % 26)}{chr(65 + index // 26)}"
+            feature["id"] = "_".join(parts)
+            features.append(feature)
+    for _ in range(5):
+        intersected = filter_intersected_features(features, config["bbox"])
+        filter_latest_image_per_grid(intersected)
+        remaining = remove_overlapping_sentinel2_tiles(intersected)
+        smart_filter_images(remaining, config["start_date"], config["end_date"])
+
+
+BENCHMARKS = {
+    "engine_aggregate": engine_aggregate,
+    "engine_timeseries": engine_timeseries,
+    "engine_mixed_resolution": engine_mixed_resolution,
+    "extract_tiff": extract_tiff,
+    "extract_cog_mixed_resolution": extract_cog_mixed_resolution,
+    "tile_latest": tile_latest,
+    "tile_timeseries": tile_timeseries,
+    "stac_search": stac_search,
+    "filters": filters,
+}
@@ -0,0 +1,245 @@
+import json
+import os
+import tempfile
+from datetime import date, timedelta
+
+import numpy as np
+import rasterio
+from affine import Affine
+from pyproj import Transformer
+from rasterio.crs import CRS
+from rasterio.shutil import copy as copy_dataset
+from rasterio.windows import Window
+
+# resolution in meters of the synthetic bands, a subset of the Sentinel-2 L2A assets
+BANDS = {
+    "blue": 10,
+    "green": 10,
+    "red": 10,
+    "nir": 10,
+    "swir16": 20,
+    "coastal": 60,
+}
+# mean reflectance of each band, scaled like Sentinel-2 L2A
+BAND_LEVELS = {
+    "blue": 600,
+    "green": 900,
+    "red": 800,
+    "nir": 3000,
+    "swir16": 2000,
+    "coastal": 500,
+}
+CRS_UTM = CRS.from_epsg(32644)
+# both tiles cover the bbox of BENCHMARK_BBOX, the full one is a whole Sentinel-2 tile
+PROFILES = {
+    "small": {"origin": (770040, 3144000), "size": 2040},
+    "full": {"origin": (699960, 3200040), "size": 10980},
+}
+BENCHMARK_BBOX = [83.84765625, 28.22697003891833, 83.935546875, 28.304380682962773]
+FIXTURE_VERSION = 1
+
+
+def scene_dates(scenes, start=date(2024, 12, 1), revisit=5):
+    """
+    Get the acquisition dates of the synthetic scenes, one per revisit.
+
+    Parameters:
+    scenes (int): Number of scenes.
+    start (datetime.date): Date of the first scene.
+    revisit (int): Days between scenes.
+
+    Returns:
+    list: Dates of the scenes.
+    """
+    return [start + timedelta(days=revisit * index) for index in range(scenes)]
+
+
+def synthetic_band(band, scene, window, resolution, seed=0):
+    """
+    Compute a block of a synthetic band: smooth terrain-like patterns, a
+    seasonal change between scenes and a little noise.
+
+    Parameters:
+    band (str): Name of the band.
+    scene (int): Index of the scene.
+    window (rasterio.windows.Window): Block of the band to compute.
+    resolution (int): Resolution of the band in meters.
+    seed (int): Seed of the noise.
+
+    Returns:
+    numpy.ndarray: uint16 block, 0 being nodata.
+    """
+    rows = (np.arange(window.height) + window.row_off)[:, np.newaxis] * resolution
+    columns = (np.arange(window.width) + window.col_off)[np.newaxis, :] * resolution
+    pattern = (
+        np.sin(columns / 1700.0 + scene * 0.3) * np.cos(rows / 2300.0)
+        + 0.5 * np.sin((columns + rows) / 640.0)
+    ).astype(np.float32)
+    level = BAND_LEVELS[band] * (1 + 0.2 * np.sin(scene / 3.0))
+    rng = np.random.default_rng((seed, scene, window.row_off, window.col_off))
+    noise = rng.normal(0, 20, pattern.shape).astype(np.float32)
+    values = level * (1 + 0.4 * pattern) + noise
+    return np.clip(values, 1, 10000).astype(np.uint16)
+
+
+def write_band(path, band, scene, origin, size, resolution, seed=0):
+    """
+    Write a synthetic band as a Sentinel-2 like COG: deflate, 1024 pixel
+    blocks and averaged overviews, in UTM.
+
+    Parameters:
+    path (str): Path to the COG.
+    band (str): Name of the band.
+    scene (int): Index of the scene.
+    origin (tuple): Upper left corner of the tile in UTM meters.
+    size (int): Width and height of the tile in 10 m pixels.
+    resolution (int): Resolution of the band in meters.
+    seed (int): Seed of the noise.
+    """
+    pixels = size * 10 // resolution
+    profile = dict(
+        driver="GTiff",
+        width=pixels,
+        height=pixels,
+        count=1,
+        dtype="uint16",
+        crs=CRS_UTM,
+        transform=Affine(resolution, 0, origin[0], 0, -resolution, origin[1]),
+        nodata=0,
+        tiled=True,
+        blockxsize=1024,
+        blockysize=1024,
+    )
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(path)) as tmp:
+        tmp_path = os.path.join(tmp, "band.tif")
+        with rasterio.open(tmp_path, "w", **profile) as dst:
+            for row_off in range(0, pixels, 1024):
+                window = Window(0, row_off, pixels, min(1024, pixels - row_off))
+                dst.write(
+                    synthetic_band(band, scene, window, resolution, seed),
+                    1,
+                    window=window,
+                )
+        copy_dataset(
+            tmp_path,
+            path,
+            driver="COG",
+            compress="DEFLATE",
+            predictor=2,
+            blocksize=1024,
+            overview_resampling="AVERAGE",
+        )
+
+
+def tile_footprint(origin, size):
+    """
+    Get the lon / lat footprint of a tile.
+
+    Parameters:
+    origin (tuple): Upper left corner of the tile in UTM meters.
+    size (int): Width and height of the tile in 10 m pixels.
+
+    Returns:
+    dict: GeoJSON polygon.
+    """
+    transformer = Transformer.from_crs(CRS_UTM, "epsg:4326", always_xy=True)
+    left, top = origin
+    right, bottom = left + size * 10, top - size * 10
+    corners = [(left, top), (right, top), (right, bottom), (left, bottom), (left, top)]
+    return {
+        "type": "Polygon",
+        "coordinates": [[list(transformer.transform(x, y)) for x, y in corners]],
+    }
+
+
+def make_items(scenes, origin, size, seed=0):
+    """
+    Build the STAC items of the synthetic scenes, with asset hrefs relative to the fixture directory.
+
+    Parameters:
+    scenes (int): Number of scenes.
+    origin (tuple): Upper left corner of the tile in UTM meters.
+    size (int): Width and height of the tile in 10 m pixels.
+    seed (int): Seed of the cloud covers.
+
+    Returns:
+    list: STAC items, newest first like the Earth Search API.
+    """
+    rng = np.random.default_rng(seed)
+    geometry = tile_footprint(origin, size)
+    coordinates = np.array(geometry["coordinates"][0])
+    items = []
+    for index, day in enumerate(scene_dates(scenes)):
+        scene_id = f"S2{'AB'[index % 2]}_44RPR_{day:%Y%m%d}_0_L2A"
+        items.append(
+            {
+                "type": "Feature",
+                "stac_version": "1.0.0",
+                "id": scene_id,
+                "collection": "sentinel-2-l2a",
+                "geometry": geometry,
+                "bbox": [*coordinates.min(axis=0), *coordinates.max(axis=0)],
+                "properties": {
+                    "datetime": f"{day:%Y-%m-%d}T05:05:00.000000Z",
+                    "eo:cloud_cover": round(float(rng.uniform(0, 60)), 2),
+                    "proj:epsg": CRS_UTM.to_epsg(),
+                },
+                "assets": {
+                    band: {
+                        "href": f"{scene_id}/{band}.tif",
+                        "type": "image/tiff; application=geotiff; profile=cloud-optimized",
+                    }
+                    for band in BANDS
+                },
+                "links": [],
+            }
+        )
+    return items[::-1]
+
+
+def generate_fixtures(directory, profile="small", scenes=12, seed=0, log=print):
+    """
+    Generate the synthetic scenes and their STAC items, unless the directory
+    already holds the same fixtures.
+
+    Parameters:
+    directory (str): Directory of the fixtures.
+    profile (str): Tile profile, one of PROFILES.
+    scenes (int): Number of scenes.
+    seed (int): Seed of the synthetic data.
+    log (callable): Function logging the progress.
+
+    Returns:
+    list: STAC items of the scenes, with hrefs relative to directory.
+    """
+    origin, size = PROFILES[profile]["origin"], PROFILES[profile]["size"]
+    manifest = {
+        "version": FIXTURE_VERSION,
+        "profile": profile,
+        "origin": list(origin),
+        "size": size,
+        "scenes": scenes,
+        "seed": seed,
+        "bands": BANDS,
+    }
+    manifest_path = os.path.join(directory, "fixtures.json")
+    items_path = os.path.join(directory, "items.json")
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as file:
+            if json.load(file) == manifest:
+                with open(items_path) as file:
+                    return json.load(file)
+
+    os.makedirs(directory, exist_ok=True)
+    items = make_items(scenes, origin, size, seed)
+    for index, item in enumerate(items[::-1]):
+        log(f"Writing scene {index + 1}/{scenes}: {item['id']}")
+        for band, resolution in BANDS.items():
+            path = os.path.join(directory, item["assets"][band]["href"])
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            write_band(path, band, index, origin, size, resolution, seed)
+    with open(items_path, "w") as file:
+        json.dump(items, file)
+    with open(manifest_path, "w") as file:
+        json.dump(manifest, file)
+    return items
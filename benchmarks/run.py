@@ -0,0 +1,316 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+from datetime import datetime, timezone
+
+from .fixtures import BENCHMARK_BBOX, PROFILES, generate_fixtures, scene_dates
+from .server import BenchmarkServer
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BENCHMARKS_DIR, ".data")
+RESULTS_DIR = os.path.join(BENCHMARKS_DIR, "results")
+METRICS = (
+    "wall_time",
+    "peak_rss_mb",
+    "bytes_read",
+    "requests",
+    "not_found",
+    "stac_requests",
+)
+
+
+def git_revision():
+    """
+    Get the commit the benchmarks run on.
+
+    Returns:
+    dict: Commit hash, subject and whether the tree has uncommitted changes.
+    """
+
+    def git(*args):
+        return subprocess.run(
+            ["git", *args],
+            cwd=BENCHMARKS_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+
+    try:
+        return {
+            "commit": git("rev-parse", "HEAD"),
+            "subject": git("log", "-1", "--format=%s"),
+            "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+        }
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": "unknown", "subject": "", "dirty": True}
+
+
+def environment():
+    """
+    Describe the machine and libraries the benchmarks run with.
+
+    Returns:
+    dict: Versions of Python, GDAL and the main libraries, platform and CPU count.
+    """
+    import numpy
+    import rasterio
+    import rio_tiler
+
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": numpy.__version__,
+        "rasterio": rasterio.__version__,
+        "gdal": rasterio.__gdal_version__,
+        "rio_tiler": rio_tiler.__version__,
+    }
+
+
+def _run_child(name, config, results):
+    # the benchmark runs in its own process: a fresh GDAL cache and peak RSS, and
+    # the server thread of the parent is not starved by GDAL holding the GIL
+    from virtughan import gdal_env, utils
+    from virtughan.profiling import peak_rss_mb
+
+    from .cases import BENCHMARKS
+
+    utils.configure_stac(url=config["stac_url"])
+    gdal_env.configure_io(config["io_profile"])
+    # progress bars and logs are bound to the console streams, silence them at the source
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, sys.stdout.fileno())
+    os.dup2(devnull, sys.stderr.fileno())
+    error = None
+    start = time.perf_counter()
+    try:
+        BENCHMARKS[name](config)
+    except Exception:
+        error = traceback.format_exc()
+    wall_time = time.perf_counter() - start
+    results.put({"wall_time": wall_time, "peak_rss_mb": peak_rss_mb(), "error": error})
+
+
+def run_benchmark(name, config, server, repeat=3, timeout=1800):
+    """
+    Run a benchmark several times, each in a new process.
+
+    Parameters:
+    name (str): Name of the benchmark, from cases.BENCHMARKS.
+    config (dict): Parameters of the benchmark.
+    server (BenchmarkServer): Server counting the requests of the benchmark.
+    repeat (int): Number of runs.
+    timeout (float): Seconds after which a run is stopped.
+
+    Returns:
+    dict: Runs and median of each metric.
+    """
+    context = multiprocessing.get_context("spawn")
+    runs = []
+    for _ in range(repeat):
+        server.reset()
+        with tempfile.TemporaryDirectory() as output_dir:
+            results = context.Queue()
+            process = context.Process(
+                target=_run_child,
+                args=(name, {**config, "output_dir": output_dir}, results),
+            )
+            process.start()
+            try:
+                run = results.get(timeout=timeout)
+            except queue.Empty:
+                process.kill()
+                run = {"wall_time": None, "peak_rss_mb": None, "error": "timeout"}
+            process.join()
+        counters = server.snapshot()
+        run.update(
+            requests=counters["requests"],
+            bytes_read=counters["bytes_read"],
+            stac_requests=counters["stac_requests"],
+            not_found=counters["not_found"],
+        )
+        runs.append(run)
+        if run["error"]:
+            break
+    summary = {"runs": runs, "error": runs[-1]["error"]}
+    if not summary["error"]:
+        for metric in METRICS:
+            summary[metric] = statistics.median(run[metric] for run in runs)
+        summary["wall_time_min"] = min(run["wall_time"] for run in runs)
+    return summary
+
+
+def format_table(benchmarks):
+    """
+    Format benchmark results as a text table.
+
+    Parameters:
+    benchmarks (dict): Results by benchmark name.
+
+    Returns:
+    str: Table with one benchmark per line.
+    """
+    lines = [
+        f"{'benchmark':<30} {'wall s':>9} {'min s':>9} {'rss MiB':>9} {'read MiB':>9} {'requests':>9} {'404':>5} {'stac':>5}"
+    ]
+    for name, result in benchmarks.items():
+        if result["error"]:
+            lines.append(
+                f"{name:<30} failed: {result['error'].strip().splitlines()[-1]}"
+            )
+            continue
+        lines.append(
+            f"{name:<30} {result['wall_time']:>9.3f} {result['wall_time_min']:>9.3f} "
+            f"{result['peak_rss_mb']:>9.1f} {result['bytes_read'] / (1 << 20):>9.2f} "
+            f"{result['requests']:>9.0f} {result['not_found']:>5.0f} {result['stac_requests']:>5.0f}"
+        )
+    return "\n".join(lines)
+
+
+def _io_profile_name(report):
+    return report["parameters"].get("io_profile", {}).get("name", "default")
+
+
+def compare(old_path, new_path):
+    """
+    Compare two result files, e.g. of two commits.
+
+    Parameters:
+    old_path (str): Path to the reference results.
+    new_path (str): Path to the new results.
+
+    Returns:
+    str: Table of the metrics of both files and their ratio, new / old.
+    """
+    with open(old_path) as file:
+        old = json.load(file)
+    with open(new_path) as file:
+        new = json.load(file)
+    lines = [
+        f"{old['revision']['commit'][:10]} ({_io_profile_name(old)}) -> "
+        f"{new['revision']['commit'][:10]} ({_io_profile_name(new)})",
+        f"{'benchmark':<30} {'metric':<13} {'old':>12} {'new':>12} {'ratio':>7}",
+    ]
+    for name, result in new["benchmarks"].items():
+        reference = old["benchmarks"].get(name)
+        if not reference or reference["error"] or result["error"]:
+            continue
+        for metric in METRICS:
+            if metric not in reference:
+                continue
+            before, after = reference[metric], result[metric]
+            ratio = f"{after / before:7.2f}" if before else f"{'-':>7}"
+            lines.append(
+                f"{name:<30} {metric:<13} {before:>12.3f} {after:>12.3f} {ratio}"
+            )
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    """
+    Run the benchmarks from the command line, e.g.
+
+    python -m benchmarks.run --profile small --repeat 3
+    python -m benchmarks.run --compare benchmarks/results/old.json benchmarks/results/new.json
+    """
+    from virtughan.gdal_env import IO_PROFILES, IOProfile
+
+    from .cases import BENCHMARKS
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark virtughan against synthetic Sentinel-2 COGs served locally."
+    )
+    parser.add_argument("--profile", default="small", choices=sorted(PROFILES))
+    parser.add_argument("--scenes", type=int, default=12)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0,
+        help="Milliseconds added to each COG request, to mimic object storage",
+    )
+    parser.add_argument(
+        "--io-profile",
+        choices=sorted(IO_PROFILES),
+        help="GDAL I/O profile of the reads, defaults to GDAL_IO_PROFILE or cog",
+    )
+    parser.add_argument("--only", nargs="+", choices=sorted(BENCHMARKS))
+    parser.add_argument("--data", default=DATA_DIR, help="Directory of the fixtures")
+    parser.add_argument(
+        "--output", default=RESULTS_DIR, help="Directory of the results"
+    )
+    parser.add_argument("--timeout", type=float, default=1800)
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"))
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        print(compare(*args.compare))
+        return 0
+
+    data_dir = os.path.join(args.data, f"{args.profile}-{args.scenes}")
+    items = generate_fixtures(data_dir, args.profile, args.scenes)
+    dates = scene_dates(args.scenes)
+    config = {
+        "bbox": BENCHMARK_BBOX,
+        "start_date": dates[0].isoformat(),
+        "end_date": dates[-1].isoformat(),
+        "cloud_cover": 30,
+        "workers": args.workers,
+        "items_path": os.path.join(data_dir, "items.json"),
+        "io_profile": (
+            IOProfile(args.io_profile) if args.io_profile else IOProfile.from_env()
+        ),
+    }
+    names = args.only or list(BENCHMARKS)
+
+    results = {}
+    with BenchmarkServer(data_dir, items, latency=args.latency / 1000) as server:
+        config["stac_url"] = server.stac_url
+        for name in names:
+            print(f"Running {name}...", flush=True)
+            results[name] = run_benchmark(
+                name, config, server, args.repeat, args.timeout
+            )
+
+    revision = git_revision()
+    report = {
+        "revision": revision,
+        "date": datetime.now(timezone.utc).isoformat(),
+        "environment": environment(),
+        "parameters": {
+            "profile": args.profile,
+            "scenes": args.scenes,
+            "repeat": args.repeat,
+            "workers": args.workers,
+            "latency_ms": args.latency,
+            "io_profile": config["io_profile"].describe(),
+            **{key: config[key] for key in ("bbox", "start_date", "end_date")},
+        },
+        "benchmarks": results,
+    }
+    os.makedirs(args.output, exist_ok=True)
+    output_path = os.path.join(
+        args.output,
+        f"{revision['commit'][:12]}{'-dirty' if revision['dirty'] else ''}"
+        f"-{args.profile}-{config['io_profile'].name}.json",
+    )
+    with open(output_path, "w") as file:
+        json.dump(report, file, indent=2)
+    print(format_table(results))
+    print(f"Saved results to {output_path}")
+    return 1 if any(result["error"] for result in results.values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
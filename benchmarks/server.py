@@ -0,0 +1,259 @@
+import json
+import os
+import re
+import threading
+import time
+from copy import deepcopy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from shapely.geometry import box, shape
+
+COG_PREFIX = "/cogs/"
+SEARCH_PATH = "/search"
+_RANGE = re.compile(r"(\d*)-(\d*)")
+
+
+def search_items(items, body):
+    """
+    Answer a STAC item search like the Earth Search API, for the subset of
+    the query language virtughan uses.
+
+    Parameters:
+    items (list): STAC items to search.
+    body (dict): Search request, with datetime, eo:cloud_cover query, bbox or intersects, limit, sortby and page.
+
+    Returns:
+    tuple: Items of the requested page and the total number of matches.
+    """
+    start, _, end = body.get("datetime", "/").partition("/")
+    cloud_cover = body.get("query", {}).get("eo:cloud_cover", {}).get("lt")
+    if "intersects" in body:
+        area = shape(body["intersects"])
+    elif "bbox" in body:
+        area = box(*body["bbox"])
+    else:
+        area = None
+    collections = body.get("collections")
+
+    matches = [
+        item
+        for item in items
+        if (not collections or item["collection"] in collections)
+        and (not start or item["properties"]["datetime"] >= start)
+        and (not end or item["properties"]["datetime"] <= end)
+        and (cloud_cover is None or item["properties"]["eo:cloud_cover"] < cloud_cover)
+        and (area is None or shape(item["geometry"]).intersects(area))
+    ]
+    matches.sort(key=lambda item: item["properties"]["datetime"], reverse=True)
+    limit = int(body.get("limit", 10))
+    page = int(body.get("page", 1))
+    return matches[(page - 1) * limit : page * limit], len(matches)
+
+
+class BenchmarkServer(ThreadingHTTPServer):
+    """
+    Local stand-in for the STAC API and the COG bucket: answers item
+    searches from recorded items and serves COGs with HTTP range requests,
+    counting the requests and bytes of each.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, directory, items, host="127.0.0.1", port=0, latency=0.0):
+        """
+        Initialize the BenchmarkServer.
+
+        Parameters:
+        directory (str): Directory the COG hrefs of the items are relative to.
+        items (list): STAC items served by the search.
+        host (str): Address to listen on.
+        port (int): Port to listen on, 0 for any free port.
+        latency (float): Seconds added before each COG response, to mimic object storage.
+        """
+        super().__init__((host, port), _Handler)
+        self.directory = os.path.abspath(directory)
+        self.latency = latency
+        self.url = f"http://{host}:{self.server_address[1]}"
+        self.items = deepcopy(items)
+        for item in self.items:
+            for asset in item["assets"].values():
+                asset["href"] = f"{self.url}{COG_PREFIX}{asset['href']}"
+        self._lock = threading.Lock()
+        self._thread = None
+        self.reset()
+
+    @property
+    def stac_url(self):
+        return f"{self.url}{SEARCH_PATH}"
+
+    def reset(self):
+        """
+        Reset the counters.
+        """
+        with self._lock:
+            self.counters = {
+                "requests": 0,
+                "bytes_read": 0,
+                "stac_requests": 0,
+                "not_found": 0,
+            }
+
+    def count(self, **increments):
+        with self._lock:
+            for name, value in increments.items():
+                self.counters[name] += value
+
+    def snapshot(self):
+        """
+        Get the counters.
+
+        Returns:
+        dict: COG requests, bytes read from the COGs, STAC requests and requests of missing files.
+        """
+        with self._lock:
+            return dict(self.counters)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # keep connections alive as object storage does, GDAL reuses them
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        if self.path.split("?")[0] != SEARCH_PATH:
+            self._send(404, b"")
+            return
+        self.server.count(stac_requests=1)
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        features, matched = search_items(self.server.items, body)
+        page = int(body.get("page", 1))
+        links = []
+        if page * int(body.get("limit", 10)) < matched:
+            links.append(
+                {
+                    "rel": "next",
+                    "method": "POST",
+                    "href": self.server.stac_url,
+                    "body": {**body, "page": page + 1},
+                }
+            )
+        payload = {
+            "type": "FeatureCollection",
+            "features": features,
+            "links": links,
+            "numberMatched": matched,
+            "numberReturned": len(features),
+        }
+        self._send(200, json.dumps(payload).encode(), "application/geo+json")
+
+    def do_HEAD(self):
+        self._serve_file(head=True)
+
+    def do_GET(self):
+        self._serve_file(head=False)
+
+    def _serve_file(self, head):
+        self.server.count(requests=1)
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        relative = self.path.split("?")[0]
+        path = os.path.abspath(
+            os.path.join(self.server.directory, relative[len(COG_PREFIX) :])
+        )
+        if (
+            not relative.startswith(COG_PREFIX)
+            or not path.startswith(self.server.directory + os.sep)
+            or not os.path.isfile(path)
+        ):
+            # object storage does not list directories either
+            self.server.count(not_found=1)
+            self._send(404, b"")
+            return
+        size = os.path.getsize(path)
+        ranges = self._ranges(size)
+        if ranges is None:
+            self._send(416, b"", headers={"Content-Range": f"bytes */{size}"})
+            return
+        with open(path, "rb") as file:
+            if not ranges:
+                status, headers = 200, {}
+                content = b"" if head else file.read()
+                length = size
+            elif len(ranges) == 1:
+                start, end = ranges[0]
+                status = 206
+                headers = {"Content-Range": f"bytes {start}-{end}/{size}"}
+                file.seek(start)
+                content = b"" if head else file.read(end - start + 1)
+                length = end - start + 1
+            else:
+                status = 206
+                boundary = "benchmark-boundary"
+                parts = []
+                for start, end in ranges:
+                    file.seek(start)
+                    parts.append(
+                        f"--{boundary}\r\nContent-Type: image/tiff\r\n"
+                        f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n".encode()
+                        + file.read(end - start + 1)
+                        + b"\r\n"
+                    )
+                content = b"".join(parts) + f"--{boundary}--\r\n".encode()
+                length = len(content)
+                headers = {"Content-Type": f"multipart/byteranges; boundary={boundary}"}
+                if head:
+                    content = b""
+        if not head:
+            self.server.count(bytes_read=len(content))
+        headers.setdefault("Content-Type", "image/tiff")
+        headers["Accept-Ranges"] = "bytes"
+        self._send(status, content, headers=headers, length=length)
+
+    def _ranges(self, size):
+        header = self.headers.get("Range")
+        if not header or not header.startswith("bytes="):
+            return []
+        ranges = []
+        for spec in header[len("bytes=") :].split(","):
+            match = _RANGE.fullmatch(spec.strip())
+            if not match or not any(match.groups()):
+                return None
+            first, last = match.groups()
+            if first:
+                start, end = int(first), int(last) if last else size - 1
+            else:
+                start, end = max(0, size - int(last)), size - 1
+            if start >= size:
+                return None
+            ranges.append((start, min(end, size - 1)))
+        return ranges
+
+    def _send(self, status, content, content_type=None, headers=None, length=None):
+        self.send_response(status)
+        if content_type:
+            self.send_header("Content-Type", content_type)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header(
+            "Content-Length", str(len(content) if length is None else length)
+        )
+        self.end_headers()
+        if content:
+            self.wfile.write(content)
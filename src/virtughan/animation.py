@@ -0,0 +1,365 @@
+import os
+import shutil
+import struct
+import subprocess
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+from PIL import __version__ as PILLOW_VERSION
+
+from .colormap import get_lut
+
+ANIMATION_FORMATS = ("gif", "webp", "mp4", "webm")
+FFMPEG_CODECS = {
+    "mp4": ["-c:v", "libx264", "-preset", "veryfast", "-crf", "23"],
+    "webm": ["-c:v", "libvpx-vp9", "-b:v", "0", "-crf", "33"],
+}
+
+
+def ffmpeg_path():
+    """
+    Get the ffmpeg executable used for MP4 and WebM animations.
+
+    Returns:
+    str: Path to ffmpeg from the FFMPEG_BINARY environment variable or the PATH, None if unavailable.
+    """
+    return shutil.which(os.getenv("FFMPEG_BINARY", "ffmpeg"))
+
+
+def available_formats():
+    """
+    Get the animation formats that can be written in this environment.
+
+    Returns:
+    list: Formats from ANIMATION_FORMATS.
+    """
+    if ffmpeg_path():
+        return list(ANIMATION_FORMATS)
+    return [fmt for fmt in ANIMATION_FORMATS if fmt not in FFMPEG_CODECS]
+
+
+def colormap_palette(colormap_str):
+    """
+    Build a GIF palette for frames colored with a colormap: half of its
+    colors plus a gray ramp for the background and the titles.
+
+    Parameters:
+    colormap_str (str): Name of the matplotlib colormap.
+
+    Returns:
+    numpy.ndarray: 256 x 3 uint8 palette.
+    """
+    grays = np.repeat(np.linspace(0, 255, 128).astype(np.uint8)[:, np.newaxis], 3, 1)
+    return np.concatenate([get_lut(colormap_str)[::2, :3], grays])
+
+
+class AnimationLayoutError(RuntimeError):
+    """
+    Raised when a frame encoded by Pillow does not have the layout the
+    streaming GIF and WebP writers copy it from.
+    """
+
+    def __init__(self, output_format, detail):
+        super().__init__(
+            f"Unexpected {output_format.upper()} frame written by Pillow {PILLOW_VERSION}: {detail}"
+        )
+
+
+def _sub_blocks(data, offset):
+    """
+    Get the offset after the data sub-blocks of a GIF block starting at offset.
+    """
+    while offset < len(data) and data[offset]:
+        offset += data[offset] + 1
+    if offset >= len(data):
+        raise AnimationLayoutError("gif", "data sub-blocks run past the end")
+    return offset + 1
+
+
+class AnimationWriter:
+    """
+    Animation file written one frame at a time, so a timeseries of any
+    length is encoded with the memory of a single frame.
+
+    GIF frames are quantized to one palette shared by the whole animation,
+    WebP frames are stored in an animated WebP container and MP4 / WebM
+    frames are piped to ffmpeg.
+    """
+
+    def __init__(
+        self,
+        path,
+        output_format=None,
+        duration=1.0,
+        max_size=None,
+        palette=None,
+        loop=0,
+        quality=80,
+    ):
+        """
+        Initialize the AnimationWriter.
+
+        Parameters:
+        path (str): Path to the output file.
+        output_format (str): One of ANIMATION_FORMATS, defaults to the extension of path.
+        duration (float): Duration of each frame in seconds.
+        max_size (int): Largest width or height of a frame, larger frames are downscaled.
+        palette (numpy.ndarray): N x 3 uint8 GIF palette, defaults to a palette of the first frame.
+        loop (int): Number of times the animation repeats, 0 for forever.
+        quality (int): WebP quality from 0 to 100.
+        """
+        self.path = path
+        self.output_format = (
+            output_format or os.path.splitext(path)[1].lstrip(".")
+        ).lower()
+        if self.output_format not in ANIMATION_FORMATS:
+            raise ValueError(
+                f"Invalid animation format {self.output_format}. Choose from {', '.join(ANIMATION_FORMATS)}"
+            )
+        if self.output_format in FFMPEG_CODECS and not ffmpeg_path():
+            raise RuntimeError(f"ffmpeg is required to write {self.output_format}")
+        self.duration = duration
+        self.max_size = max_size
+        self.palette = palette
+        self.loop = loop
+        self.quality = quality
+        self.size = None
+        self.frames = 0
+        self._file = None
+        self._process = None
+
+    def write(self, frame):
+        """
+        Encode a frame.
+
+        Parameters:
+        frame (PIL.Image.Image or numpy.ndarray): RGB frame, resized to the size of the first frame if it differs.
+        """
+        if isinstance(frame, np.ndarray):
+            frame = Image.fromarray(frame)
+        frame = frame.convert("RGB")
+        if self.size is None:
+            if self.max_size and max(frame.size) > self.max_size:
+                scale = self.max_size / max(frame.size)
+                self.size = (
+                    max(1, round(frame.width * scale)),
+                    max(1, round(frame.height * scale)),
+                )
+            else:
+                self.size = frame.size
+            self._start()
+        if frame.size != self.size:
+            frame = frame.resize(self.size, Image.Resampling.BOX)
+        getattr(self, f"_write_{self.output_format}", self._write_ffmpeg)(frame)
+        self.frames += 1
+
+    def close(self):
+        """
+        Finish the animation file.
+        """
+        if self._process is not None:
+            self._process.stdin.close()
+            if self._process.wait():
+                raise RuntimeError(
+                    f"ffmpeg failed: {self._process.stderr.read().decode(errors='replace')[-1000:]}"
+                )
+            self._process.stderr.close()
+            self._process = None
+        if self._file is not None:
+            if self.output_format == "gif":
+                self._file.write(b";")
+            elif self.output_format == "webp":
+                # the RIFF size is only known once every frame is written
+                size = self._file.tell()
+                self._file.seek(4)
+                self._file.write(struct.pack("<I", size - 8))
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _start(self):
+        width, height = self.size
+        if self.output_format in FFMPEG_CODECS:
+            self._process = subprocess.Popen(
+                [
+                    ffmpeg_path(),
+                    "-y",
+                    "-loglevel",
+                    "error",
+                    "-f",
+                    "rawvideo",
+                    "-pix_fmt",
+                    "rgb24",
+                    "-s",
+                    f"{width}x{height}",
+                    "-framerate",
+                    str(1 / self.duration),
+                    "-i",
+                    "-",
+                    # yuv420p, the pixel format players support, needs even sizes
+                    "-vf",
+                    "pad=ceil(iw/2)*2:ceil(ih/2)*2:color=white",
+                    "-pix_fmt",
+                    "yuv420p",
+                    *FFMPEG_CODECS[self.output_format],
+                    self.path,
+                ],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+            )
+            return
+        self._file = open(self.path, "wb")
+        if self.output_format == "gif":
+            self._palette_image = None
+            if self.palette is not None:
+                self._set_palette(np.asarray(self.palette, dtype=np.uint8))
+        else:
+            self._file.write(b"RIFF\0\0\0\0WEBP")
+            # VP8X chunk with the animation flag, then the ANIM chunk
+            self._file.write(
+                b"VP8X"
+                + struct.pack("<I", 10)
+                + bytes([0x02, 0, 0, 0])
+                + (width - 1).to_bytes(3, "little")
+                + (height - 1).to_bytes(3, "little")
+            )
+            self._file.write(
+                b"ANIM"
+                + struct.pack("<I", 6)
+                + struct.pack("<IH", 0xFFFFFFFF, self.loop)
+            )
+
+    def _set_palette(self, palette):
+        palette = palette[:256]
+        self._palette_bytes = palette.tobytes().ljust(768, b"\0")
+        self._palette_image = Image.new("P", (1, 1))
+        self._palette_image.putpalette(self._palette_bytes)
+        width, height = self.size
+        self._file.write(b"GIF89a")
+        # global color table of 256 entries
+        self._file.write(struct.pack("<HHBBB", width, height, 0xF7, 0, 0))
+        self._file.write(self._palette_bytes)
+        self._file.write(
+            b"\x21\xff\x0bNETSCAPE2.0\x03\x01" + struct.pack("<H", self.loop) + b"\0"
+        )
+
+    def _write_gif(self, frame):
+        if self._palette_image is None:
+            palette = frame.quantize(256, method=Image.Quantize.MEDIANCUT).getpalette()
+            self._set_palette(np.array(palette, dtype=np.uint8).reshape(-1, 3))
+        indexed = frame.quantize(palette=self._palette_image, dither=Image.Dither.NONE)
+        buffer = BytesIO()
+        indexed.save(buffer, format="GIF", optimize=False)
+        data = buffer.getvalue()
+
+        # copy the image block of the single frame GIF written by Pillow
+        if data[:6] not in (b"GIF87a", b"GIF89a") or data[-1:] != b";":
+            raise AnimationLayoutError("gif", "missing GIF header or trailer")
+        offset = 13
+        packed = data[10]
+        if packed & 0x80:
+            table_size = 3 << ((packed & 7) + 1)
+            table = data[offset : offset + table_size]
+            offset += table_size
+        else:
+            table_size, table = 0, b""
+        while offset < len(data) and data[offset] == 0x21:
+            offset = _sub_blocks(data, offset + 2)
+        if offset + 10 > len(data) or data[offset] != 0x2C:
+            raise AnimationLayoutError(
+                "gif", "no image descriptor after the extensions"
+            )
+        descriptor = bytearray(data[offset : offset + 10])
+        if struct.unpack("<HHHH", descriptor[1:9]) != (0, 0, *self.size):
+            raise AnimationLayoutError("gif", "the image does not cover the frame")
+        offset += 10
+        # the image data, after an optional local table, ends right before the trailer
+        image_start = offset
+        if descriptor[9] & 0x80:
+            offset += 3 << ((descriptor[9] & 7) + 1)
+        if _sub_blocks(data, offset + 1) != len(data) - 1:
+            raise AnimationLayoutError("gif", "more than one image block")
+        if (
+            not descriptor[9] & 0x80
+            and table
+            and table != self._palette_bytes[: len(table)]
+        ):
+            # Pillow may trim the palette, keep its colors as a local table
+            descriptor[9] |= 0x80 | (packed & 7)
+            descriptor += table
+        delay = round(self.duration * 100)
+        self._file.write(b"\x21\xf9\x04\x04" + struct.pack("<H", delay) + b"\0\0")
+        self._file.write(descriptor)
+        self._file.write(data[image_start:-1])
+
+    def _write_webp(self, frame):
+        buffer = BytesIO()
+        frame.save(buffer, format="WEBP", quality=self.quality)
+        data = buffer.getvalue()
+        # keep the bitstream chunks of the single frame WebP written by Pillow
+        if data[:4] != b"RIFF" or data[8:12] != b"WEBP":
+            raise AnimationLayoutError("webp", "missing RIFF WEBP header")
+        chunks = b""
+        names = []
+        offset = 12
+        while offset < len(data):
+            if offset + 8 > len(data):
+                raise AnimationLayoutError("webp", "truncated chunk header")
+            name = data[offset : offset + 4]
+            size = struct.unpack("<I", data[offset + 4 : offset + 8])[0]
+            end = offset + 8 + size + (size & 1)
+            if end > len(data) + (size & 1):
+                raise AnimationLayoutError("webp", f"chunk {name!r} runs past the end")
+            if name == b"ANIM":
+                raise AnimationLayoutError("webp", "the frame is already animated")
+            if name in (b"VP8 ", b"VP8L", b"ALPH"):
+                chunks += data[offset:end].ljust(end - offset, b"\0")
+                names.append(name)
+            offset = end
+        if names not in ([b"VP8 "], [b"VP8L"], [b"ALPH", b"VP8 "]):
+            raise AnimationLayoutError(
+                "webp", f"unexpected bitstream chunks {names or 'none'}"
+            )
+        width, height = self.size
+        payload = (
+            (0).to_bytes(3, "little")
+            + (0).to_bytes(3, "little")
+            + (width - 1).to_bytes(3, "little")
+            + (height - 1).to_bytes(3, "little")
+            + round(self.duration * 1000).to_bytes(3, "little")
+            # no blending, the frames cover the whole canvas
+            + bytes([0x02])
+            + chunks
+        )
+        self._file.write(b"ANMF" + struct.pack("<I", len(payload)) + payload)
+        if len(payload) & 1:
+            self._file.write(b"\0")
+
+    def _write_ffmpeg(self, frame):
+        self._process.stdin.write(frame.tobytes())
+
+
+def write_animation(frames, path, output_format=None, **kwargs):
+    """
+    Write frames to an animation file.
+
+    Parameters:
+    frames (iterable): PIL images or RGB arrays, consumed one at a time.
+    path (str): Path to the output file.
+    output_format (str): One of ANIMATION_FORMATS, defaults to the extension of path.
+    **kwargs: Options of AnimationWriter, e.g. duration and max_size.
+
+    Returns:
+    int: Number of frames written.
+    """
+    with AnimationWriter(path, output_format, **kwargs) as writer:
+        for frame in frames:
+            writer.write(frame)
+    return writer.frames
@@ -0,0 +1,438 @@
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from .metrics import METRICS_FILE_NAME
+from .profiling import PROFILE_FILE_NAMES
+from .progress import EVENTS_FILE_NAME, LOG_FILE_NAME
+
+CHUNK_SIZE = 1 << 20
+# formats compressed internally, deflating them again only costs time
+COMPRESSED_EXTENSIONS = (
+    ".gif",
+    ".jpeg",
+    ".jpg",
+    ".mp4",
+    ".png",
+    ".webm",
+    ".webp",
+    ".zip",
+)
+# files of a job directory that are not outputs
+SKIPPED_FILES = (
+    LOG_FILE_NAME,
+    EVENTS_FILE_NAME,
+    METRICS_FILE_NAME,
+    *PROFILE_FILE_NAMES,
+)
+
+ZIP64_LIMIT = 0xFFFFFFFF
+# members up to this size are deflated without risk of outgrowing 4 GiB
+ZIP64_SAFE_SIZE = 0xF0000000
+_LOCAL_HEADER = struct.Struct("<4sHHHHHIIIHH")
+_CENTRAL_HEADER = struct.Struct("<4sBBHHHHHIIIHHHHHII")
+_END_RECORD = struct.Struct("<4sHHHHIIH")
+_ZIP64_END_RECORD = struct.Struct("<4sQHHIIQQQQ")
+_ZIP64_LOCATOR = struct.Struct("<4sIQI")
+_UTF8_FLAG = 0x800
+_DESCRIPTOR_FLAG = 0x08
+
+
+def _dos_time(timestamp):
+    year, month, day, hour, minute, second = time.localtime(timestamp)[:6]
+    year = max(year, 1980)
+    return (hour << 11) | (minute << 5) | (second // 2), (
+        ((year - 1980) << 9) | (month << 5) | day
+    )
+
+
+def _deflates_well(sample, ratio=0.95):
+    """
+    Check whether deflating data saves space, from a sample of it.
+    """
+    if not sample:
+        return False
+    return len(zlib.compress(sample, 1)) < len(sample) * ratio
+
+
+def should_deflate(name, sample=b""):
+    """
+    Decide whether an archive member is deflated or stored.
+
+    Parameters:
+    name (str): Name of the member.
+    sample (bytes): Sample of the content, probed when the extension does not tell.
+
+    Returns:
+    bool: True to deflate the member.
+    """
+    if name.lower().endswith(COMPRESSED_EXTENSIONS):
+        return False
+    return _deflates_well(sample)
+
+
+def _file_sample(path, size=1 << 16):
+    """
+    Read a sample of a file from its middle, past headers that always compress.
+    """
+    file_size = os.path.getsize(path)
+    with open(path, "rb") as file:
+        file.seek(max(0, file_size // 2 - size // 2))
+        return file.read(size)
+
+
+class ZipArchive:
+    """
+    ZIP archive written one member at a time, so outputs are added as they
+    are produced instead of being written to disk and zipped afterwards.
+
+    Members are deflated in the thread adding them, or by a pool of workers,
+    and only the writing of the compressed bytes is serialized, so large
+    outputs are deflated in parallel. Already compressed members, such as
+    COGs, are stored as is. ZIP64 records are written when the archive or a
+    member outgrows the 4 GiB limits of plain ZIP.
+    """
+
+    def __init__(self, file, workers=1, compresslevel=6):
+        """
+        Initialize the ZipArchive.
+
+        Parameters:
+        file (str or file): Path to the archive, or binary file object to write it to, which does not need to be seekable.
+        workers (int): Number of threads deflating members added with add, 1 to deflate in the calling thread.
+        compresslevel (int): Deflate level from 1 to 9.
+        """
+        self._own_file = isinstance(file, (str, os.PathLike))
+        self.path = os.fspath(file) if self._own_file else None
+        self._file = open(file, "wb") if self._own_file else file
+        self.compresslevel = compresslevel
+        self.workers = workers
+        self.offset = 0
+        self.entries = []
+        self._lock = threading.Lock()
+        self._names = set()
+        self._executor = (
+            ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+        )
+        self._pending = deque()
+
+    def add(self, name, data, compress=None, timestamp=None):
+        """
+        Add a member from bytes, deflated in the background when the archive has workers.
+
+        Parameters:
+        name (str): Name of the member.
+        data (bytes): Content of the member.
+        compress (bool): Whether to deflate the member, None to decide from its name and content.
+        timestamp (float): Modification time of the member, defaults to now.
+        """
+        with self._lock:
+            self._check_name(name)
+        if self._executor is None:
+            self._add(name, data, compress, timestamp)
+            return
+        # bound the members held in memory to twice the number of workers
+        while len(self._pending) >= 2 * self.workers:
+            self._pending.popleft().result()
+        self._pending.append(
+            self._executor.submit(self._add, name, data, compress, timestamp)
+        )
+
+    def _add(self, name, data, compress, timestamp):
+        data = bytes(data)
+        if compress is None:
+            compress = should_deflate(name, data[: 1 << 16])
+        crc = zlib.crc32(data)
+        if compress:
+            compressor = zlib.compressobj(self.compresslevel, zlib.DEFLATED, -15)
+            payload = compressor.compress(data) + compressor.flush()
+        else:
+            payload = data
+        with self._lock:
+            self._write_local_header(
+                name, compress, timestamp, crc, len(payload), len(data)
+            )
+            self._write(payload)
+
+    def add_file(self, path, name=None, compress=None, remove=False):
+        """
+        Add a member from a file, read in chunks.
+
+        Parameters:
+        path (str): Path to the file.
+        name (str): Name of the member, defaults to the file name.
+        compress (bool): Whether to deflate the member, None to decide from its name and content.
+        remove (bool): Whether to delete the file once it is archived.
+        """
+        name = name or os.path.basename(path)
+        if compress is None:
+            compress = should_deflate(name, _file_sample(path))
+        with self._lock:
+            for _ in self.stream_file(path, name, compress):
+                pass
+        if remove:
+            os.remove(path)
+
+    def stream_file(self, path, name, compress):
+        """
+        Write a member from a file chunk by chunk, with its sizes and checksum
+        in a data descriptor after the content.
+
+        Callers writing from several threads must hold the archive lock.
+
+        Parameters:
+        path (str): Path to the file.
+        name (str): Name of the member.
+        compress (bool): Whether to deflate the member.
+
+        Yields:
+        int: Offset in the archive after each chunk, for readers streaming the archive.
+        """
+        zip64 = os.path.getsize(path) > ZIP64_SAFE_SIZE
+        self._check_name(name)
+        self._write_local_header(
+            name,
+            compress,
+            os.path.getmtime(path),
+            0,
+            0,
+            0,
+            descriptor=True,
+            zip64=zip64,
+        )
+        entry = self.entries[-1]
+        compressor = (
+            zlib.compressobj(self.compresslevel, zlib.DEFLATED, -15)
+            if compress
+            else None
+        )
+        crc = size = compressed_size = 0
+        with open(path, "rb") as file:
+            while True:
+                chunk = file.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                crc = zlib.crc32(chunk, crc)
+                size += len(chunk)
+                if compressor is not None:
+                    chunk = compressor.compress(chunk)
+                compressed_size += len(chunk)
+                self._write(chunk)
+                yield self.offset
+        if compressor is not None:
+            tail = compressor.flush()
+            compressed_size += len(tail)
+            self._write(tail)
+        size_format = "<4sIQQ" if zip64 else "<4sIII"
+        self._write(struct.pack(size_format, b"PK\x07\x08", crc, compressed_size, size))
+        entry.update(crc=crc, compressed_size=compressed_size, size=size)
+        yield self.offset
+
+    def close(self):
+        """
+        Wait for the members being deflated and write the central directory.
+        """
+        if self._file is None:
+            return
+        try:
+            while self._pending:
+                self._pending.popleft().result()
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown()
+        with self._lock:
+            self._write_central_directory()
+            if self._own_file:
+                self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _write(self, data):
+        self._file.write(data)
+        self.offset += len(data)
+
+    def _check_name(self, name):
+        if name in self._names:
+            raise ValueError(f"Duplicate archive member {name}")
+        self._names.add(name)
+
+    def _write_local_header(
+        self,
+        name,
+        compress,
+        timestamp,
+        crc,
+        compressed_size,
+        size,
+        descriptor=False,
+        zip64=False,
+    ):
+        encoded = name.replace(os.sep, "/").encode("utf-8")
+        dos_time, dos_date = _dos_time(time.time() if timestamp is None else timestamp)
+        flags = _UTF8_FLAG | (_DESCRIPTOR_FLAG if descriptor else 0)
+        # members written with a data descriptor announce ZIP64 sizes up front
+        zip64 = zip64 or max(compressed_size, size) >= ZIP64_LIMIT
+        extra = struct.pack("<HHQQ", 1, 16, size, compressed_size) if zip64 else b""
+        self.entries.append(
+            {
+                "name": encoded,
+                "method": 8 if compress else 0,
+                "flags": flags,
+                "time": dos_time,
+                "date": dos_date,
+                "crc": crc,
+                "compressed_size": compressed_size,
+                "size": size,
+                "offset": self.offset,
+                "zip64": zip64,
+            }
+        )
+        self._write(
+            _LOCAL_HEADER.pack(
+                b"PK\x03\x04",
+                45 if zip64 else 20,
+                flags,
+                8 if compress else 0,
+                dos_time,
+                dos_date,
+                crc,
+                ZIP64_LIMIT if zip64 else compressed_size,
+                ZIP64_LIMIT if zip64 else size,
+                len(encoded),
+                len(extra),
+            )
+            + encoded
+            + extra
+        )
+
+    def _write_central_directory(self):
+        start = self.offset
+        for entry in self.entries:
+            fields = []
+            for key in ("size", "compressed_size", "offset"):
+                if entry[key] >= ZIP64_LIMIT:
+                    fields.append(entry[key])
+            extra = (
+                struct.pack(f"<HH{len(fields)}Q", 1, 8 * len(fields), *fields)
+                if fields
+                else b""
+            )
+            version = 45 if fields or entry["zip64"] else 20
+            self._write(
+                _CENTRAL_HEADER.pack(
+                    b"PK\x01\x02",
+                    version,
+                    3,  # made on unix, for the file permissions
+                    version,
+                    entry["flags"],
+                    entry["method"],
+                    entry["time"],
+                    entry["date"],
+                    entry["crc"],
+                    min(entry["compressed_size"], ZIP64_LIMIT),
+                    min(entry["size"], ZIP64_LIMIT),
+                    len(entry["name"]),
+                    len(extra),
+                    0,
+                    0,
+                    0,
+                    0o100644 << 16,
+                    min(entry["offset"], ZIP64_LIMIT),
+                )
+                + entry["name"]
+                + extra
+            )
+        size = self.offset - start
+        count = len(self.entries)
+        if count >= 0xFFFF or size >= ZIP64_LIMIT or start >= ZIP64_LIMIT:
+            end_offset = self.offset
+            self._write(
+                _ZIP64_END_RECORD.pack(
+                    b"PK\x06\x06", 44, 45, 45, 0, 0, count, count, size, start
+                )
+            )
+            self._write(_ZIP64_LOCATOR.pack(b"PK\x06\x07", 0, end_offset, 1))
+        self._write(
+            _END_RECORD.pack(
+                b"PK\x05\x06",
+                0,
+                0,
+                min(count, 0xFFFF),
+                min(count, 0xFFFF),
+                min(size, ZIP64_LIMIT),
+                min(start, ZIP64_LIMIT),
+                0,
+            )
+        )
+
+
+class _Buffer:
+    """
+    Write only file object whose content is taken out as it is produced.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.size += len(data)
+
+    def take(self):
+        data = b"".join(self.chunks)
+        self.chunks, self.size = [], 0
+        return data
+
+
+def directory_files(directory, skip=SKIPPED_FILES):
+    """
+    List the files of a directory to archive.
+
+    Parameters:
+    directory (str): Directory to list.
+    skip (tuple): File names to leave out.
+
+    Returns:
+    list: (path, name in the archive) tuples, sorted by name.
+    """
+    files = []
+    for root, _, names in os.walk(directory):
+        for file_name in names:
+            if file_name in skip:
+                continue
+            path = os.path.join(root, file_name)
+            files.append((path, os.path.relpath(path, directory).replace(os.sep, "/")))
+    return sorted(files, key=lambda file: file[1])
+
+
+def stream_zip(files, compresslevel=6, chunk_size=CHUNK_SIZE):
+    """
+    Zip files on the fly, e.g. as the body of an HTTP response, without writing the archive anywhere.
+
+    Parameters:
+    files (list): (path, name in the archive) tuples.
+    compresslevel (int): Deflate level from 1 to 9.
+    chunk_size (int): Approximate size of the chunks yielded.
+
+    Yields:
+    bytes: Consecutive chunks of the archive.
+    """
+    buffer = _Buffer()
+    archive = ZipArchive(buffer, compresslevel=compresslevel)
+    for path, name in files:
+        compress = should_deflate(name, _file_sample(path))
+        for _ in archive.stream_file(path, name, compress):
+            if buffer.size >= chunk_size:
+                yield buffer.take()
+    archive.close()
+    yield buffer.take()
@@ -0,0 +1,341 @@
+import asyncio
+import hashlib
+import json
+import os
+import struct
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+_EXPIRY = struct.Struct(">d")
+_HEADER_LENGTH = struct.Struct(">I")
+
+
+def make_cache_key(prefix, **params):
+    """
+    Build a stable cache key from keyword parameters.
+
+    Parameters:
+    prefix (str): Namespace of the key, e.g. "tile".
+    **params: JSON serializable parameters identifying the cached value.
+
+    Returns:
+    str: Cache key.
+    """
+    digest = hashlib.sha256(
+        json.dumps(params, sort_keys=True, separators=(",", ":")).encode()
+    ).hexdigest()
+    return f"{prefix}-{digest}"
+
+
+def pack_entry(payload, meta):
+    """
+    Pack bytes and a JSON metadata dict into a single cache value.
+
+    Parameters:
+    payload (bytes): Cached bytes.
+    meta (dict): JSON serializable metadata.
+
+    Returns:
+    bytes: Packed value.
+    """
+    header = json.dumps(meta).encode()
+    return _HEADER_LENGTH.pack(len(header)) + header + payload
+
+
+def unpack_entry(value):
+    """
+    Unpack a value created by pack_entry.
+
+    Parameters:
+    value (bytes): Packed value.
+
+    Returns:
+    tuple: Cached bytes and metadata dict.
+    """
+    (length,) = _HEADER_LENGTH.unpack_from(value)
+    start = _HEADER_LENGTH.size
+    return value[start + length :], json.loads(value[start : start + length])
+
+
+class MemoryCache:
+    """
+    In-process LRU cache bounded by the total size of the cached values.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        """
+        Initialize the MemoryCache.
+
+        Parameters:
+        max_bytes (int): Maximum total size of the cached values in bytes.
+        """
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    async def get(self, key):
+        """
+        Get a value.
+
+        Parameters:
+        key (str): Cache key.
+
+        Returns:
+        tuple: Value and its expiry timestamp, or None if missing or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= time.time():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    async def set(self, key, value, ttl):
+        """
+        Set a value, evicting the least recently used values when over budget.
+
+        Parameters:
+        key (str): Cache key.
+        value (bytes): Value to cache.
+        ttl (float): Time to live in seconds.
+        """
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, time.time() + ttl)
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        value, _ = self._entries.pop(key)
+        self.size -= len(value)
+
+
+class DiskCache:
+    """
+    On-disk cache shared by every process pointing at the same directory.
+    """
+
+    def __init__(self, directory, max_bytes=1024 * 1024 * 1024, prune_every=256):
+        """
+        Initialize the DiskCache.
+
+        Parameters:
+        directory (str): Directory to store the cached values in.
+        max_bytes (int): Total size above which the oldest values are pruned.
+        prune_every (int): Number of writes between two prune passes.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.prune_every = prune_every
+        self._writes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[-2:], key)
+
+    def _read(self, key):
+        try:
+            with open(self._path(key), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        (expires_at,) = _EXPIRY.unpack_from(data)
+        if expires_at <= time.time():
+            return None
+        return data[_EXPIRY.size :], expires_at
+
+    def _write(self, key, value, ttl):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            f.write(_EXPIRY.pack(time.time() + ttl))
+            f.write(value)
+        os.replace(tmp_path, path)
+
+    async def get(self, key):
+        """
+        Get a value.
+
+        Parameters:
+        key (str): Cache key.
+
+        Returns:
+        tuple: Value and its expiry timestamp, or None if missing or expired.
+        """
+        return await asyncio.to_thread(self._read, key)
+
+    async def set(self, key, value, ttl):
+        """
+        Set a value.
+
+        Parameters:
+        key (str): Cache key.
+        value (bytes): Value to cache.
+        ttl (float): Time to live in seconds.
+        """
+        await asyncio.to_thread(self._write, key, value, ttl)
+        self._writes += 1
+        if self._writes % self.prune_every == 0:
+            await asyncio.to_thread(self.prune)
+
+    def prune(self):
+        """
+        Delete expired values, then the oldest values until under the size budget.
+        """
+        now = time.time()
+        entries = []
+        total = 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    with open(path, "rb") as f:
+                        (expires_at,) = _EXPIRY.unpack(f.read(_EXPIRY.size))
+                    stat = os.stat(path)
+                except (OSError, struct.error):
+                    continue
+                if expires_at <= now:
+                    os.remove(path)
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+
+
+class RedisCache:
+    """
+    Cache backed by a Redis compatible server, shared by every process and host.
+    """
+
+    def __init__(self, url):
+        """
+        Initialize the RedisCache.
+
+        Parameters:
+        url (str): Redis URL, e.g. redis://localhost:6379/0.
+        """
+        try:
+            from redis import asyncio as aioredis
+        except ImportError as e:
+            raise ImportError(
+                "RedisCache requires the redis package, install it with `pip install redis`"
+            ) from e
+        self.client = aioredis.from_url(url)
+
+    async def get(self, key):
+        """
+        Get a value.
+
+        Parameters:
+        key (str): Cache key.
+
+        Returns:
+        tuple: Value and its expiry timestamp, or None if missing or expired.
+        """
+        async with self.client.pipeline(transaction=False) as pipe:
+            value, ttl = await pipe.get(key).pttl(key).execute()
+        if value is None:
+            return None
+        return value, time.time() + max(ttl, 0) / 1000
+
+    async def set(self, key, value, ttl):
+        """
+        Set a value.
+
+        Parameters:
+        key (str): Cache key.
+        value (bytes): Value to cache.
+        ttl (float): Time to live in seconds.
+        """
+        await self.client.set(key, value, px=int(ttl * 1000))
+
+
+class TileCache:
+    """
+    Multi-level cache checking each tier in order and backfilling the faster tiers on hits.
+    """
+
+    def __init__(self, tiers):
+        """
+        Initialize the TileCache.
+
+        Parameters:
+        tiers (list): Cache tiers ordered from fastest to slowest.
+        """
+        self.tiers = tiers
+
+    async def get(self, key):
+        """
+        Get a value from the first tier holding it.
+
+        Parameters:
+        key (str): Cache key.
+
+        Returns:
+        bytes: Cached value or None.
+        """
+        for index, tier in enumerate(self.tiers):
+            entry = await tier.get(key)
+            if entry is None:
+                continue
+            value, expires_at = entry
+            ttl = expires_at - time.time()
+            if ttl > 0:
+                for faster_tier in self.tiers[:index]:
+                    await faster_tier.set(key, value, ttl)
+            return value
+        return None
+
+    async def set(self, key, value, ttl):
+        """
+        Set a value in every tier.
+
+        Parameters:
+        key (str): Cache key.
+        value (bytes): Value to cache.
+        ttl (float): Time to live in seconds.
+        """
+        for tier in self.tiers:
+            await tier.set(key, value, ttl)
+
+    @classmethod
+    def from_env(cls):
+        """
+        Build a cache from environment variables.
+
+        TILE_CACHE_MEMORY_MB sizes the in-process tier (0 disables it),
+        TILE_CACHE_DIR enables the disk tier, TILE_CACHE_DISK_MB bounds it and
+        TILE_CACHE_REDIS_URL enables the shared Redis tier.
+
+        Returns:
+        TileCache: Configured cache.
+        """
+        tiers = []
+        memory_mb = int(os.getenv("TILE_CACHE_MEMORY_MB", 64))
+        if memory_mb > 0:
+            tiers.append(MemoryCache(memory_mb * 1024 * 1024))
+        if os.getenv("TILE_CACHE_DIR"):
+            tiers.append(
+                DiskCache(
+                    os.getenv("TILE_CACHE_DIR"),
+                    int(os.getenv("TILE_CACHE_DISK_MB", 1024)) * 1024 * 1024,
+                )
+            )
+        if os.getenv("TILE_CACHE_REDIS_URL"):
+            tiers.append(RedisCache(os.getenv("TILE_CACHE_REDIS_URL")))
+        return cls(tiers)
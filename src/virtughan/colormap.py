@@ -0,0 +1,140 @@
+import functools
+import re
+
+import numpy as np
+from matplotlib import colormaps
+
+_NORMALIZED_DIFFERENCE = re.compile(
+    r"^\((band[12])-(band[12])\)/\((band[12])\+(band[12])\)$"
+)
+
+
+@functools.lru_cache(maxsize=None)
+def get_lut(colormap_str):
+    """
+    Get the lookup table of a colormap, built once per colormap.
+
+    Parameters:
+    colormap_str (str): Name of the matplotlib colormap.
+
+    Returns:
+    numpy.ndarray: 256 x 4 uint8 RGBA lookup table.
+    """
+    colormap = colormaps.get_cmap(colormap_str)
+    lut = np.round(colormap(np.linspace(0, 1, 256)) * 255).astype(np.uint8)
+    lut.flags.writeable = False
+    return lut
+
+
+def prebuild_luts(colormap_strs=None):
+    """
+    Build the lookup tables of colormaps ahead of the first tile requests.
+
+    Parameters:
+    colormap_strs (list): Names of the colormaps, defaults to every registered colormap.
+    """
+    for colormap_str in colormap_strs or list(colormaps):
+        get_lut(colormap_str)
+
+
+def quantize(result, vmin=None, vmax=None):
+    """
+    Scale a result array to 256 levels.
+
+    Parameters:
+    result (numpy.ndarray): Result array, masked values and NaN are nodata.
+    vmin (float): Value mapped to the first level, defaults to the minimum of the valid values.
+    vmax (float): Value mapped to the last level, defaults to the maximum of the valid values.
+
+    Returns:
+    tuple: uint8 level array and boolean array of the valid pixels.
+    """
+    data = np.ma.filled(np.ma.asarray(result, dtype=np.float32), np.nan)
+    valid = np.isfinite(data)
+    if not valid.any():
+        return np.zeros(data.shape, dtype=np.uint8), valid
+    if vmin is None:
+        vmin = np.nanmin(data)
+    if vmax is None:
+        vmax = np.nanmax(data)
+    scale = 255 / (vmax - vmin) if vmax > vmin else 0.0
+    levels = data - np.float32(vmin)
+    levels *= np.float32(scale)
+    np.copyto(levels, 0, where=~valid)
+    np.clip(levels, 0, 255, out=levels)
+    return levels.astype(np.uint8), valid
+
+
+def apply_lut(result, colormap_str, vmin=None, vmax=None):
+    """
+    Color a result array with the lookup table of a colormap.
+
+    Parameters:
+    result (numpy.ndarray): Result array, masked values and NaN are nodata.
+    colormap_str (str): Name of the matplotlib colormap.
+    vmin (float): Value mapped to the first color, defaults to the minimum of the valid values.
+    vmax (float): Value mapped to the last color, defaults to the maximum of the valid values.
+
+    Returns:
+    numpy.ndarray: RGBA uint8 array, transparent where the result is nodata.
+    """
+    levels, valid = quantize(result, vmin, vmax)
+    # np.take is several times faster than fancy indexing for this gather
+    rgba = np.take(get_lut(colormap_str), levels, axis=0)
+    rgba[..., 3][~valid] = 0
+    return rgba
+
+
+def parse_rescale(value):
+    """
+    Parse a rescale range.
+
+    Parameters:
+    value (str): Range as "min,max", e.g. "-1,1".
+
+    Returns:
+    tuple: Minimum and maximum, or None if value is empty.
+    """
+    if not value:
+        return None
+    vmin, vmax = (float(bound) for bound in value.split(","))
+    if vmin >= vmax:
+        raise ValueError(f"Invalid rescale range {value}, min must be below max")
+    return vmin, vmax
+
+
+def formula_rescale(formula):
+    """
+    Get the natural range of a formula, e.g. -1 to 1 for normalized differences.
+
+    Parameters:
+    formula (str): Formula applied to the bands.
+
+    Returns:
+    tuple: Minimum and maximum, or None if the formula has no known range.
+    """
+    match = _NORMALIZED_DIFFERENCE.match("".join((formula or "").split()))
+    if match and match[1] != match[2] and {match[1], match[2]} == {match[3], match[4]}:
+        return -1.0, 1.0
+    return None
+
+
+def percentile_rescale(result, percentiles=(2, 98)):
+    """
+    Get a rescale range from percentiles of the valid values of a result.
+
+    Parameters:
+    result (numpy.ndarray): Result array, masked values and NaN are nodata.
+    percentiles (tuple): Lower and upper percentiles.
+
+    Returns:
+    tuple: Minimum and maximum, or None if the result has no valid values.
+    """
+    data = np.ma.filled(np.ma.asarray(result, dtype=np.float32), np.nan)
+    data = data[np.isfinite(data)]
+    if not data.size:
+        return None
+    vmin, vmax = np.percentile(data, percentiles)
+    if vmin >= vmax:
+        return None
+    return float(vmin), float(vmax)
@@ -1,25 +1,39 @@
 import os
 import sys
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from io import BytesIO
 
 import matplotlib
 import matplotlib.pyplot as plt
 import numpy as np
 import rasterio as rio
+from matplotlib.colors import Normalize
 from PIL import Image
 from pyproj import Transformer
-from rasterio.warp import reproject
+from rasterio.enums import Resampling
+from rasterio.io import MemoryFile
+from rasterio.windows import bounds as window_bounds
 from rasterio.windows import from_bounds
 
 # from scipy.stats import mode
 from tqdm import tqdm
 
+from .animation import AnimationWriter, colormap_palette, write_animation
+from .archive import ZipArchive
+from .colormap import apply_lut, formula_rescale, percentile_rescale
+from .gdal_env import io_env
+from .metrics import get_recorder
+from .progress import ProgressTracker, get_channel
+from .pyramid import MBTilesStore, write_pyramid
+from .reducers import reduce, stack_frames
+from .render import FrameRenderer
+from .resample import resample
+from .temporal import temporal_stats
 from .utils import (
     filter_intersected_features,
     remove_overlapping_sentinel2_tiles,
     search_stac_api,
     smart_filter_images,
-    zip_files,
 )
 
 matplotlib.use("Agg")
@@ -46,6 +60,14 @@ class VirtughanProcessor:
         cmap="RdYlGn",
         workers=1,
         smart_filter=True,
+        rescale=None,
+        pyramid=False,
+        temporal_stats=None,
+        baseline=None,
+        render=True,
+        animation=("gif",),
+        animation_max_size=1024,
+        resampling="average",
     ):
         """
         Initialize the VirtughanProcessor.
@@ -61,10 +83,18 @@ class VirtughanProcessor:
         operation (str): Operation to apply to the time series.
         timeseries (bool): Whether to generate a time series.
         output_dir (str): Directory to save the output files.
-        log_file (file): File to log the processing.
+        log_file (file): File to log the progress bar to when no job progress channel is active.
         cmap (str): Colormap to apply to the results.
         workers (int): Number of parallel workers.
         smart_filter (bool): Whether to apply smart filtering to the images.
+        rescale (tuple): Range mapped to the colormap, defaults to the formula range or the 2nd to 98th percentiles of the first rendered result.
+        pyramid (bool): Whether to also write the aggregate and every timeseries frame as MBTiles tile pyramids.
+        temporal_stats (list): Per pixel temporal statistics written as the bands of temporal_stats.tif, from temporal.TEMPORAL_STATS.
+        baseline (tuple): Start and end date of the baseline period of the anomaly statistic.
+        render (bool): Whether to render the colormap, trend plot, annotated frames and GIF, or only write the rasters.
+        animation (list): Formats of the timeseries animation, from animation.ANIMATION_FORMATS, saved as output.<format>.
+        animation_max_size (int): Largest width or height of the animation frames, larger results are downscaled once before annotation.
+        resampling (str): Rasterio resampling used to read a finer band on the grid of a coarser one.
         """
         self.bbox = bbox
         self.start_date = start_date
@@ -76,7 +106,10 @@ class VirtughanProcessor:
         self.operation = operation
         self.timeseries = timeseries
         self.output_dir = output_dir
-        self.log_file = log_file
+        self.channel = get_channel()
+        self.progress = ProgressTracker(self.channel)
+        self.metrics = get_recorder()
+        self.log_file = self.channel.stream or log_file
         self.cmap = cmap
         self.workers = workers
         self.result_list = []
@@ -85,12 +118,26 @@ class VirtughanProcessor:
         self.transform = None
         self.intermediate_images = []
         self.intermediate_images_with_text = []
+        self.archive = None
+        self.frames = []
         self.use_smart_filter = smart_filter
+        self.rescale = tuple(rescale) if rescale else formula_rescale(self.formula)
+        self.pyramid = pyramid
+        self.temporal_stats = tuple(temporal_stats or ())
+        self.baseline = baseline
+        self.render = render
+        self.animation = tuple(animation or ())
+        self.animation_max_size = animation_max_size
+        self.resampling = Resampling[resampling]
 
     def fetch_process_custom_band(self, band1_url, band2_url):
         """
         Fetch and process custom band data, resampling if bands have different resolutions.
 
+        When the bands have different resolutions, the finer band is read
+        directly on the grid of the coarser one, letting GDAL decimate from the
+        COG overviews instead of downloading and decoding it at full resolution.
+
         Parameters:
         band1_url (str): URL of the first band.
         band2_url (str): URL of the second band.
@@ -100,7 +147,7 @@ class VirtughanProcessor:
         """
 
         try:
-            with rio.open(band1_url) as band1_cog:
+            with io_env(), self._open(band1_url) as band1_cog:
                 min_x, min_y, max_x, max_y = self._transform_bbox(band1_cog.crs)
                 band1_window = self._calculate_window(
                     band1_cog, min_x, min_y, max_x, max_y
@@ -109,12 +156,10 @@ class VirtughanProcessor:
                 if self._is_window_out_of_bounds(band1_window):
                     return None, None, None, None
 
-                band1_data = band1_cog.read(window=band1_window).astype(float)
                 band1_transform = band1_cog.window_transform(band1_window)
-                band1_height, band1_width = band1_data.shape[1], band1_data.shape[2]
 
                 if band2_url:
-                    with rio.open(band2_url) as band2_cog:
+                    with self._open(band2_url) as band2_cog:
                         min_x, min_y, max_x, max_y = self._transform_bbox(band2_cog.crs)
                         band2_window = self._calculate_window(
                             band2_cog, min_x, min_y, max_x, max_y
@@ -123,66 +168,126 @@ class VirtughanProcessor:
                         if self._is_window_out_of_bounds(band2_window):
                             return None, None, None, None
 
-                        band2_data = band2_cog.read(window=band2_window).astype(float)
                         band2_transform = band2_cog.window_transform(band2_window)
-                        band2_height, band2_width = (
-                            band2_data.shape[1],
-                            band2_data.shape[2],
-                        )
 
-                        if band1_height != band2_height or band1_width != band2_width:
-                            band1_res = band1_transform[0]
-                            band2_res = band2_transform[0]
-
-                            if band1_res > band2_res:
-                                resampled_band2 = np.zeros_like(band1_data)
-
-                                resampled_band2, _ = reproject(
-                                    source=band2_data,
-                                    destination=resampled_band2,
-                                    src_transform=band2_transform,
-                                    src_crs=band2_cog.crs,
-                                    dst_transform=band1_transform,
-                                    dst_crs=band1_cog.crs,
-                                    resampling=rio.warp.Resampling.bilinear,
-                                    dst_shape=(band1_height, band1_width),
+                        if (
+                            band1_cog.crs == band2_cog.crs
+                            and band1_cog.res != band2_cog.res
+                        ):
+                            if band1_cog.res[0] > band2_cog.res[0]:
+                                band1_data = self._read_band(band1_cog, band1_window)
+                                band2_data = self._read_band_on_grid(
+                                    band2_cog, band1_cog, band1_window, band1_data
                                 )
-                                band2_data = resampled_band2
                                 transform = band1_transform
                             else:
-                                resampled_band1 = np.zeros_like(band2_data)
-
-                                resampled_band1, _ = reproject(
-                                    source=band1_data,
-                                    destination=resampled_band1,
-                                    src_transform=band1_transform,
-                                    src_crs=band1_cog.crs,
-                                    dst_transform=band2_transform,
-                                    dst_crs=band2_cog.crs,
-                                    resampling=rio.warp.Resampling.bilinear,
-                                    dst_shape=(band2_height, band2_width),
+                                band2_data = self._read_band(band2_cog, band2_window)
+                                band1_data = self._read_band_on_grid(
+                                    band1_cog, band2_cog, band2_window, band2_data
                                 )
-                                band1_data = resampled_band1
                                 transform = band2_transform
                         else:
+                            band1_data = self._read_band(band1_cog, band1_window)
+                            band2_data = self._read_band(band2_cog, band2_window)
                             transform = band1_transform
+                            if band1_data.shape != band2_data.shape:
+                                # resample to the coarser grid, the plan is shared by every scene of the tile
+                                with self.metrics.span("engine.resample"):
+                                    if band1_transform[0] > band2_transform[0]:
+                                        band2_data = resample(
+                                            band2_data,
+                                            band2_cog.crs,
+                                            band2_transform,
+                                            band1_cog.crs,
+                                            band1_transform,
+                                            band1_data.shape[1:],
+                                        )
+                                    else:
+                                        band1_data = resample(
+                                            band1_data,
+                                            band1_cog.crs,
+                                            band1_transform,
+                                            band2_cog.crs,
+                                            band2_transform,
+                                            band2_data.shape[1:],
+                                        )
+                                        transform = band2_transform
 
                         band1 = band1_data
                         band2 = band2_data
-                        result = eval(self.formula)
+                        with self.metrics.span("engine.formula"):
+                            result = eval(self.formula)
                 else:
-                    result = (
-                        eval(self.formula) if band1_data.shape[0] == 1 else band1_data
-                    )
+                    band1_data = self._read_band(band1_cog, band1_window)
+                    band1 = band1_data
+                    with self.metrics.span("engine.formula"):
+                        result = (
+                            eval(self.formula)
+                            if band1_data.shape[0] == 1
+                            else band1_data
+                        )
                     transform = band1_transform
 
             return result, band1_cog.crs, transform, band1_url
 
         except Exception as e:
             raise e
-            print(f"Error fetching image: {e}")
+            self.channel.log(f"Error fetching image: {e}")
             return None, None, None, None
 
+    def _open(self, url):
+        """
+        Open a COG, reading its header.
+
+        Parameters:
+        url (str): URL of the COG.
+
+        Returns:
+        rasterio.io.DatasetReader: COG dataset reader.
+        """
+        with self.metrics.span("engine.open"):
+            return rio.open(url)
+
+    def _read_band(self, cog, window, out_shape=None):
+        """
+        Read a window of a COG as float.
+
+        Parameters:
+        cog (rasterio.io.DatasetReader): COG dataset reader.
+        window (rasterio.windows.Window): Window to read.
+        out_shape (tuple): Height and width to read the window at, defaults to its own size.
+
+        Returns:
+        numpy.ndarray: Array of shape (bands, height, width).
+        """
+        with self.metrics.span("engine.read"):
+            data = cog.read(
+                window=window,
+                out_shape=(cog.count, *out_shape) if out_shape else None,
+                resampling=self.resampling,
+            )
+        self.progress.add_bytes(data.nbytes)
+        self.metrics.count("engine.bytes_read", data.nbytes)
+        return data.astype(float)
+
+    def _read_band_on_grid(self, cog, grid_cog, grid_window, grid_data):
+        """
+        Read a band directly on the grid of a window of another band of the same CRS.
+
+        Parameters:
+        cog (rasterio.io.DatasetReader): COG dataset reader of the band to read.
+        grid_cog (rasterio.io.DatasetReader): COG dataset reader of the band defining the grid.
+        grid_window (rasterio.windows.Window): Window of the grid band.
+        grid_data (numpy.ndarray): Data read from the grid window.
+
+        Returns:
+        numpy.ndarray: Array of shape (bands, height, width) on the grid of grid_data.
+        """
+        window = from_bounds(
+            *window_bounds(grid_window, grid_cog.transform), cog.transform
+        )
+        return self._read_band(cog, window, out_shape=grid_data.shape[1:])
+
     def _remove_overlapping_sentinel2_tiles(self, features):
         """
         Remove overlapping Sentinel-2 tiles.
@@ -289,25 +394,34 @@ class VirtughanProcessor:
             self.end_date,
             self.cloud_cover,
         )
-        print(f"Total scenes found: {len(features)}")
+        self.channel.log(f"Total scenes found: {len(features)}")
         filtered_features = filter_intersected_features(features, self.bbox)
-        print(f"Scenes covering input area: {len(filtered_features)}")
+        self.channel.log(f"Scenes covering input area: {len(filtered_features)}")
         overlapping_features_removed = remove_overlapping_sentinel2_tiles(
             filtered_features
         )
-        print(f"Scenes after removing overlaps: {len(overlapping_features_removed)}")
+        self.channel.log(
+            f"Scenes after removing overlaps: {len(overlapping_features_removed)}"
+        )
         if self.use_smart_filter:
             overlapping_features_removed = smart_filter_images(
                 overlapping_features_removed, self.start_date, self.end_date
             )
-            print(
+            self.channel.log(
                 f"Scenes after applying smart filter: {len(overlapping_features_removed)}"
             )
+        self.channel.emit(
+            "scenes_found",
+            found=len(features),
+            covering=len(filtered_features),
+            selected=len(overlapping_features_removed),
+        )
 
         band1_urls, band2_urls = self._get_band_urls(overlapping_features_removed)
+        self.progress.start(len(band1_urls))
 
         if self.workers > 1:
-            print("Using Parallel Processing...")
+            self.channel.log("Using Parallel Processing...")
             with ThreadPoolExecutor(max_workers=self.workers) as executor:
                 futures = [
                     executor.submit(
@@ -322,8 +436,10 @@ class VirtughanProcessor:
                     file=self.log_file,
                 ):
                     result, crs, transform, name_url = future.result()
+                    self.progress.advance()
                     if result is not None:
                         self.result_list.append(result)
+                        self.metrics.count("engine.scenes")
                         self.crs = crs
                         self.transform = transform
                         parts = name_url.split("/")
@@ -343,8 +459,10 @@ class VirtughanProcessor:
                 result, self.crs, self.transform, name_url = (
                     self.fetch_process_custom_band(band1_url, band2_url)
                 )
+                self.progress.advance()
                 if result is not None:
                     self.result_list.append(result)
+                    self.metrics.count("engine.scenes")
                     parts = name_url.split("/")
                     image_name = parts[-2]
                     self.dates.append(image_name.split("_")[2])
@@ -360,25 +478,35 @@ class VirtughanProcessor:
         result (numpy.ndarray): Array of the result to save.
         image_name (str): Name of the image file.
         """
-        output_file = os.path.join(self.output_dir, f"{image_name}_result.tif")
-        self._save_geotiff(result, output_file)
-        self.intermediate_images.append(output_file)
-        self.intermediate_images_with_text.append(
-            self.add_text_to_image(output_file, image_name)
-        )
-
-    def _save_geotiff(self, data, output_file):
+        if self.archive is None:
+            self.archive = ZipArchive(
+                os.path.join(self.output_dir, "tiff_files.zip"), workers=self.workers
+            )
+        # the GeoTIFF goes straight into the archive, without a copy on disk
+        output_name = f"{image_name}_result.tif"
+        with MemoryFile() as memfile:
+            self._save_geotiff(result, memfile.name)
+            with self.metrics.span("engine.zip"):
+                self.archive.add(output_name, memfile.read(), compress=True)
+        self.intermediate_images.append(output_name)
+        # frames are annotated later from memory, see render_frames
+        self.frames.append((image_name, result))
+        if self.pyramid:
+            self.write_pyramid(result, image_name)
+
+    def _save_geotiff(self, data, output_file, descriptions=None):
         """
         Save the data as a GeoTIFF file.
 
         Parameters:
         data (numpy.ndarray): Array of data to save.
         output_file (str): Path to the output file.
+        descriptions (list): Description of each band.
         """
         nodata_value = -9999
         data = np.where(np.isnan(data), nodata_value, data)
 
-        with rio.open(
+        with self.metrics.span("engine.write"), rio.open(
             output_file,
             "w",
             driver="GTiff",
@@ -392,13 +520,15 @@ class VirtughanProcessor:
         ) as dst:
             for band in range(1, data.shape[0] + 1):
                 dst.write(data[band - 1], band)
+                if descriptions:
+                    dst.set_band_description(band, descriptions[band - 1])
 
-    def _aggregate_results(self):
+    def _stack_results(self):
         """
-        Aggregate the results over time.
+        Stack the results in date order, padded to a common shape.
 
         Returns:
-        numpy.ndarray: Aggregated result.
+        tuple: Sorted dates and float array of shape (dates, bands, height, width), NaN being nodata.
         """
         sorted_dates_and_results = sorted(
             zip(self.dates, self.result_list), key=lambda x: x[0]
@@ -407,27 +537,57 @@ class VirtughanProcessor:
 
         max_shape = tuple(max(s) for s in zip(*[arr.shape for arr in sorted_results]))
         padded_result_list = [self._pad_array(arr, max_shape) for arr in sorted_results]
-        result_stack = np.ma.stack(padded_result_list)
+        return sorted_dates, stack_frames(padded_result_list)
 
-        operations = {
-            "mean": np.ma.mean,
-            "median": np.ma.median,
-            "max": np.ma.max,
-            "min": np.ma.min,
-            "std": np.ma.std,
-            "sum": np.ma.sum,
-            "var": np.ma.var,
-        }
+    def _aggregate_results(self, dates=None, result_stack=None):
+        """
+        Aggregate the results over time.
 
-        aggregated_result = operations[self.operation](result_stack, axis=0)
+        Parameters:
+        dates (list): Sorted dates of the results, stacked from the results when missing.
+        result_stack (numpy.ndarray): Stack of the results in date order.
 
-        dates = sorted_dates
-        dates_numeric = np.arange(len(dates))
+        Returns:
+        numpy.ndarray: Aggregated result.
+        """
+        if result_stack is None:
+            dates, result_stack = self._stack_results()
+
+        with self.metrics.span("engine.aggregate"):
+            aggregated_result = reduce(
+                result_stack, self.operation, workers=self.workers
+            )
 
-        values_per_date = operations[self.operation](result_stack, axis=(1, 2, 3))
+        if self.render:
+            with self.metrics.span("engine.render"):
+                self._plot_values_over_time(dates, result_stack)
 
-        slope, intercept = np.polyfit(dates_numeric, values_per_date, 1)
-        trend_line = slope * dates_numeric + intercept
+        return aggregated_result
+
+    def _plot_values_over_time(self, dates, result_stack):
+        """
+        Plot the operation across the pixels of each date and its trend line.
+
+        Parameters:
+        dates (list): Sorted dates of the results.
+        result_stack (numpy.ndarray): Stack of the results in date order.
+        """
+        dates_numeric = np.arange(len(dates))
+
+        # the same operation across the pixels of each date
+        values_per_date = reduce(
+            result_stack.reshape(len(dates), -1).T,
+            self.operation,
+            workers=self.workers,
+        )
+        fitted = np.isfinite(values_per_date)
+        if fitted.sum() > 1:
+            slope, intercept = np.polyfit(
+                dates_numeric[fitted], values_per_date[fitted], 1
+            )
+            trend_line = slope * dates_numeric + intercept
+        else:
+            trend_line = np.full(len(dates), np.nan)
 
         plt.figure(figsize=(10, 5))
         plt.plot(
@@ -448,8 +608,33 @@ class VirtughanProcessor:
 
         plt.savefig(os.path.join(self.output_dir, "values_over_time.png"))
         plt.close()
+        self.channel.emit("file_written", file="values_over_time.png")
 
-        return aggregated_result
+    def save_temporal_stats(self, dates, result_stack):
+        """
+        Save the per pixel temporal statistics as the bands of temporal_stats.tif.
+
+        Parameters:
+        dates (list): Date of each result.
+        result_stack (numpy.ndarray): Stack of the results of shape (dates, 1, height, width).
+
+        Returns:
+        str: Path to the output file.
+        """
+        stats = temporal_stats(
+            result_stack[:, 0],
+            dates,
+            self.temporal_stats,
+            baseline=self.baseline,
+            workers=self.workers,
+        )
+        output_file = os.path.join(self.output_dir, "temporal_stats.tif")
+        self._save_geotiff(
+            np.stack(list(stats.values())), output_file, descriptions=list(stats)
+        )
+        self.channel.log(f"Saved temporal statistics {', '.join(stats)}")
+        self.channel.emit("file_written", file=os.path.basename(output_file))
+        return output_file
 
     def save_aggregated_result_with_colormap(self, result_aggregate, output_file):
         """
@@ -460,9 +645,63 @@ class VirtughanProcessor:
         output_file (str): Path to the output file.
         """
         result_aggregate = np.ma.masked_invalid(result_aggregate)
-        image = self._create_image(result_aggregate)
-        self._plot_result(image, output_file)
+        if self.render:
+            image = self._create_image(result_aggregate)
+            self._plot_result(image, output_file)
         self._save_geotiff(result_aggregate, output_file)
+        self.channel.emit("file_written", file=os.path.basename(output_file))
+        if self.pyramid:
+            self.write_pyramid(result_aggregate, "aggregate")
+
+    def write_pyramid(self, data, name):
+        """
+        Write a result as an MBTiles tile pyramid in the pyramids folder of the output directory.
+
+        Parameters:
+        data (numpy.ndarray): Result array of shape (bands, height, width).
+        name (str): Name of the pyramid file, without extension.
+
+        Returns:
+        str: Path to the pyramid file.
+        """
+        data = np.ma.filled(np.ma.asarray(data, dtype=np.float32), np.nan)
+        if data.shape[0] == 1:
+            vmin, vmax = self._rescale_range(data[0])
+
+            def render(tile):
+                return apply_lut(tile[0], self.cmap, vmin, vmax)
+
+        else:
+            # scale once so the colors do not change from tile to tile
+            data = data[:3]
+            vmin, vmax = np.nanmin(data), np.nanmax(data)
+            data = (data - vmin) / ((vmax - vmin) or 1) * 255
+
+            def render(tile):
+                alpha = np.where(np.isfinite(tile).all(axis=0), 255, 0)
+                return np.dstack([*np.nan_to_num(tile), alpha]).astype(np.uint8)
+
+        def encode(tile):
+            buffered = BytesIO()
+            Image.fromarray(render(tile)).save(buffered, format="PNG", compress_level=2)
+            return buffered.getvalue()
+
+        pyramid_file = os.path.join(self.output_dir, "pyramids", f"{name}.mbtiles")
+        if os.path.exists(pyramid_file):
+            os.remove(pyramid_file)
+        with self.metrics.span("engine.pyramid"), MBTilesStore(pyramid_file) as store:
+            minzoom, maxzoom = write_pyramid(
+                store, data, self.crs, self.transform, encode
+            )
+            store.set_metadata(
+                name=name,
+                description=f"{self.formula} from {self.start_date} to {self.end_date}",
+            )
+        self.channel.log(f"Saved zoom {minzoom} to {maxzoom} tile pyramid of {name}")
+        self.channel.emit(
+            "file_written", file=os.path.relpath(pyramid_file, self.output_dir)
+        )
+        return pyramid_file
 
     def _create_image(self, data):
         """
@@ -475,20 +714,43 @@ class VirtughanProcessor:
         numpy.ndarray: Image array.
         """
         if data.shape[0] == 1:
-            result_normalized = (data[0] - data[0].min()) / (
-                data[0].max() - data[0].min()
-            )
-            colormap = plt.get_cmap(self.cmap)
-            result_colored = colormap(result_normalized)
-            return (result_colored[:, :, :3] * 255).astype(np.uint8)
+            vmin, vmax = self._rescale_range(data[0])
+            return apply_lut(data[0], self.cmap, vmin, vmax)
         else:
-            image_array = np.transpose(data, (1, 2, 0))
-            image_array = (
-                (image_array - image_array.min())
-                / (image_array.max() - image_array.min())
-                * 255
-            )
-            return image_array.astype(np.uint8)
+            return self._normalize_bands(np.transpose(data, (1, 2, 0)))
+
+    def _rescale_range(self, data):
+        """
+        Get the range mapped to the colormap.
+
+        Parameters:
+        data (numpy.ndarray): Result the range is computed from when no rescale is set.
+
+        Returns:
+        tuple: Minimum and maximum, or (None, None) to use the range of the data.
+        """
+        if self.rescale is None:
+            # fix the range once, so every frame of a timeseries shares the same colors
+            self.rescale = percentile_rescale(data)
+        return self.rescale or (None, None)
+
+    @staticmethod
+    def _normalize_bands(image_array):
+        """
+        Scale a multi band image to uint8, ignoring NaN.
+
+        Parameters:
+        image_array (numpy.ndarray): Image array with the bands last.
+
+        Returns:
+        numpy.ndarray: uint8 image array, black where there is no data.
+        """
+        image_array = np.ma.filled(np.ma.asarray(image_array, dtype=float), np.nan)
+        if not np.isfinite(image_array).any():
+            return np.zeros(image_array.shape, dtype=np.uint8)
+        vmin, vmax = np.nanmin(image_array), np.nanmax(image_array)
+        image_array = (image_array - vmin) / ((vmax - vmin) or 1) * 255
+        return np.nan_to_num(image_array).astype(np.uint8)
 
     def _plot_result(self, image, output_file):
         """
@@ -504,8 +766,10 @@ class VirtughanProcessor:
         plt.xlabel(
             f"From {self.start_date} to {self.end_date}\nCloud Cover < {self.cloud_cover}%\nBBox: {self.bbox}\nTotal Scene Processed: {len(self.result_list)}"
         )
+        vmin, vmax = self.rescale or (None, None)
         plt.colorbar(
             plt.cm.ScalarMappable(
+                norm=Normalize(vmin, vmax),
                 cmap=plt.get_cmap(self.cmap),
             ),
             ax=plt.gca(),
@@ -536,103 +800,156 @@ class VirtughanProcessor:
         ]
         return np.pad(array, pad_width, mode="constant", constant_values=fill_value)
 
-    def add_text_to_image(self, image_path, text):
+    def render_frames(self):
         """
-        Add text to an image.
+        Render the annotated frames of the timeseries from the results in memory.
 
-        Parameters:
-        image_path (str): Path to the image file.
-        text (str): Text to add to the image.
+        Frames are rendered in parallel with the workers of the processor and
+        saved next to their GeoTIFF as <scene>_result_text.png.
 
         Returns:
-        str: Path to the image file with the added text.
+        iterator: Annotated frames as PIL images, in date order.
         """
-        with rio.open(image_path) as src:
-            image_array = (
-                src.read(1)
-                if src.count == 1
-                else np.dstack([src.read(i) for i in range(1, 4)])
-            )
-            image_array = (
-                (image_array - image_array.min())
-                / (image_array.max() - image_array.min())
-                * 255
+        frames = sorted(
+            self.frames, key=lambda frame: (frame[0].split("_")[2], frame[0])
+        )
+        if not frames:
+            return
+        first = frames[0][1]
+        vmin, vmax = (
+            self._rescale_range(first[0]) if first.shape[0] == 1 else (None, None)
+        )
+        renderer = FrameRenderer(
+            self.cmap,
+            vmin,
+            vmax,
+            workers=self.workers,
+            max_size=self.animation_max_size,
+        )
+        output_files = [
+            os.path.join(self.output_dir, f"{image_name}_result_text.png")
+            for image_name, _ in frames
+        ]
+        rendered = renderer.render_all(
+            (result, image_name, output_file)
+            for (image_name, result), output_file in zip(frames, output_files)
+        )
+        for (image_name, _), output_file, frame in zip(frames, output_files, rendered):
+            self.intermediate_images_with_text.append(output_file)
+            self.channel.emit(
+                "file_written", file=os.path.basename(output_file), scene=image_name
             )
-            image = Image.fromarray(image_array.astype(np.uint8))
-
-        plt.figure(figsize=(10, 10))
-        plt.imshow(image, cmap=self.cmap if src.count == 1 else None)
-        plt.axis("off")
-        plt.title(text)
-        temp_image_path = os.path.splitext(image_path)[0] + "_text.png"
-        plt.savefig(temp_image_path, bbox_inches="tight", pad_inches=0.1)
-        plt.close()
-        return temp_image_path
+            yield frame
 
     @staticmethod
-    def create_gif(image_list, output_path, duration_per_image=1):
+    def create_gif(image_list, output_path, duration_per_image=1, max_size=None):
         """
         Create a GIF from a list of images.
 
         Parameters:
-        image_list (list): List of image file paths.
+        image_list (list): List of image file paths, or iterable of PIL images in display order.
         output_path (str): Path to the output GIF file.
         duration_per_image (int): Duration per image in the GIF (seconds).
-        """
-        sorted_image_list = sorted(image_list)
-
-        images = [Image.open(image_path) for image_path in sorted_image_list]
-        max_width = max(image.width for image in images)
-        max_height = max(image.height for image in images)
-        resized_images = [
-            image.resize((max_width, max_height), Image.LANCZOS) for image in images
-        ]
+        max_size (int): Largest width or height of the frames.
+        """
+        if isinstance(image_list, (list, tuple)) and all(
+            isinstance(image, str) for image in image_list
+        ):
+            image_list = (Image.open(image_path) for image_path in sorted(image_list))
+        write_animation(
+            image_list,
+            output_path,
+            "gif",
+            duration=duration_per_image,
+            max_size=max_size,
+        )
+        channel = get_channel()
+        channel.log(f"Saved timeseries GIF to {output_path}")
+        channel.emit("file_written", file=os.path.basename(output_path))
 
-        frame_duration = duration_per_image * 1000
+    def create_animations(self, duration_per_image=1):
+        """
+        Encode the annotated frames into every animation format at once,
+        each frame being rendered once and streamed to the writers.
 
-        resized_images[0].save(
-            output_path,
-            save_all=True,
-            append_images=resized_images[1:],
-            duration=frame_duration,
-            loop=0,
+        Parameters:
+        duration_per_image (int): Duration per frame (seconds).
+        """
+        palette = (
+            colormap_palette(self.cmap)
+            if self.frames and self.frames[0][1].shape[0] == 1
+            else None
         )
-        print(f"Saved timeseries GIF to {output_path}")
+        writers = [
+            AnimationWriter(
+                os.path.join(self.output_dir, f"output.{output_format}"),
+                output_format,
+                duration=duration_per_image,
+                max_size=self.animation_max_size,
+                palette=palette,
+            )
+            for output_format in self.animation
+        ]
+        try:
+            for frame in self.render_frames():
+                for writer in writers:
+                    writer.write(frame)
+        finally:
+            for writer in writers:
+                writer.close()
+        for writer in writers:
+            self.channel.log(f"Saved timeseries animation to {writer.path}")
+            self.channel.emit("file_written", file=os.path.basename(writer.path))
 
     def compute(self):
         """
         Compute the results based on the provided parameters.
         """
-        print("Engine starting...")
+        self.channel.log("Engine starting...")
         os.makedirs(self.output_dir, exist_ok=True)
         if not self.band1:
             raise Exception("Band1 is required")
 
-        print("Searching STAC .....")
-        self._process_images()
+        self.channel.log("Searching STAC .....")
+        try:
+            self._process_images()
+        finally:
+            if self.archive is not None:
+                with self.metrics.span("engine.zip"):
+                    self.archive.close()
+                self.channel.log(
+                    f"Saved intermediate images ZIP to {self.archive.path}"
+                )
+                self.channel.emit(
+                    "file_written", file=os.path.basename(self.archive.path)
+                )
+
+        if self.result_list and (self.operation or self.temporal_stats):
+            dates, result_stack = self._stack_results()
+
+        if self.result_list and self.temporal_stats:
+            self.channel.log("Computing temporal statistics...")
+            with self.metrics.span("engine.temporal_stats"):
+                self.save_temporal_stats(dates, result_stack)
 
         if self.result_list and self.operation:
-            print("Aggregating results...")
-            result_aggregate = self._aggregate_results()
+            self.channel.log("Aggregating results...")
+            result_aggregate = self._aggregate_results(dates, result_stack)
             output_file = os.path.join(
                 self.output_dir, "custom_band_output_aggregate.tif"
             )
-            print("Saving aggregated result with colormap...")
-            self.save_aggregated_result_with_colormap(result_aggregate, output_file)
+            self.channel.log("Saving aggregated result with colormap...")
+            with self.metrics.span("engine.render"):
+                self.save_aggregated_result_with_colormap(result_aggregate, output_file)
 
         if self.timeseries:
-            print("Creating GIF and zipping TIFF files...")
             if self.intermediate_images:
-                self.create_gif(
-                    self.intermediate_images_with_text,
-                    os.path.join(self.output_dir, "output.gif"),
-                )
-                zip_files(
-                    self.intermediate_images,
-                    os.path.join(self.output_dir, "tiff_files.zip"),
-                )
+                if self.render:
+                    self.channel.log("Creating timeseries animations...")
+                    with self.metrics.span("engine.animation"):
+                        self.create_animations()
             else:
-                print("No images found for the given parameters")
+                self.channel.log("No images found for the given parameters")
 
 
 if __name__ == "__main__":
@@ -1,21 +1,28 @@
 import os
 import sys
+import threading
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import ExitStack
 
 import numpy as np
 import rasterio
 from pyproj import Transformer
 from rasterio.enums import Resampling
-from rasterio.warp import reproject
+from rasterio.io import MemoryFile
+from rasterio.windows import bounds as window_bounds
 from rasterio.windows import from_bounds
 from tqdm import tqdm
 
+from .archive import ZipArchive
+from .gdal_env import io_env
+from .metrics import get_recorder
+from .progress import ProgressTracker, get_channel
+from .resample import resample
 from .utils import (
     filter_intersected_features,
     remove_overlapping_sentinel2_tiles,
     search_stac_api,
     smart_filter_images,
-    zip_files,
 )
 
 VALID_BANDS = {
@@ -35,6 +42,12 @@ VALID_BANDS = {
     "nir09": "NIR 3 - 60m",
 }
 
+# tiff: one float64 GeoTIFF per scene, cog: one COG per scene in the data type of the bands,
+# stack: one multi-temporal GeoTIFF of every scene, zarr: one Zarr cube of every scene
+EXTRACT_FORMATS = ("tiff", "cog", "stack", "zarr")
+# stacked GeoTIFF being written, removed once it is in the archive
+STACK_PART_NAME = "bands_stack.tif.part"
+
 
 class ExtractProcessor:
     """
@@ -53,6 +66,8 @@ class ExtractProcessor:
         workers=1,
         zip_output=False,
         smart_filter=True,
+        resampling="average",
+        output_format="tiff",
     ):
         """
         Initialize the ExtractProcessor.
@@ -64,10 +79,12 @@ class ExtractProcessor:
         cloud_cover (int): Maximum allowed cloud cover percentage.
         bands_list (list): List of bands to extract.
         output_dir (str): Directory to save the extracted bands.
-        log_file (file): File to log the extraction process.
+        log_file (file): File to log the progress bar to when no job progress channel is active.
         workers (int): Number of parallel workers.
         zip_output (bool): Whether to zip the output files.
         smart_filter (bool): Whether to apply smart filtering to the images.
+        resampling (str): Rasterio resampling used to read finer bands on the grid of the lowest resolution band.
+        output_format (str): Output layout, one of EXTRACT_FORMATS.
         """
         self.bbox = bbox
         self.start_date = start_date
@@ -75,12 +92,25 @@ class ExtractProcessor:
         self.cloud_cover = cloud_cover
         self.bands_list = bands_list
         self.output_dir = output_dir
-        self.log_file = log_file
+        self.channel = get_channel()
+        self.progress = ProgressTracker(self.channel)
+        self.log_file = self.channel.stream or log_file
         self.workers = workers
         self.zip_output = zip_output
         self.crs = None
         self.transform = None
         self.use_smart_filter = smart_filter
+        self.resampling = Resampling[resampling]
+        if output_format not in EXTRACT_FORMATS:
+            raise ValueError(
+                f"Invalid output format {output_format}. Choose from {', '.join(EXTRACT_FORMATS)}"
+            )
+        self.output_format = output_format
+        self._archive = None
+        self._target = None
+        self._zarr_store = None
+        self._lock = threading.Lock()
+        self.metrics = get_recorder()
 
         self._validate_bands_list()
 
@@ -159,103 +189,379 @@ class ExtractProcessor:
         ]
         return band_urls
 
-    def _fetch_and_save_bands(self, band_urls, feature_id):
+    def _fetch_bands(self, band_urls):
         """
-        Fetch and save the bands from the given URLs.
+        Read the bands of a scene on the grid of its lowest resolution band.
 
         Parameters:
         band_urls (list): List of band URLs.
-        feature_id (str): Feature ID for naming the output file.
 
         Returns:
-        str: Path to the saved GeoTIFF file.
+        tuple: Array of shape (bands, height, width) in the data type of the bands, CRS, transform and nodata value, or None if the area is outside of the scene.
         """
-        try:
+        with ExitStack() as stack:
+            stack.enter_context(io_env())
+            band_cogs = [
+                stack.enter_context(self._open(band_url)) for band_url in band_urls
+            ]
+            windows = []
+            for band_cog in band_cogs:
+                min_x, min_y, max_x, max_y = self._transform_bbox(band_cog.crs)
+                band_window = self._calculate_window(
+                    band_cog, min_x, min_y, max_x, max_y
+                )
+                if self._is_window_out_of_bounds(band_window):
+                    return None
+                windows.append(band_window)
+
+            # stack on the grid of the lowest resolution band
+            lowest = max(
+                range(len(band_cogs)),
+                key=lambda index: band_cogs[index].res[0] * band_cogs[index].res[1],
+            )
+            lowest_cog, lowest_window = band_cogs[lowest], windows[lowest]
+            crs = lowest_cog.crs
+            transform = lowest_cog.window_transform(lowest_window)
+            nodata = lowest_cog.nodata
+            lowest_data = self._read(lowest_cog, window=lowest_window)
+            shape = lowest_data.shape
+
             bands = []
-            bands_meta = []
-            resolutions = []
+            for band_cog, band_window in zip(band_cogs, windows):
+                if band_cog is lowest_cog:
+                    band_data = lowest_data
+                elif band_cog.crs == crs and band_cog.res == lowest_cog.res:
+                    band_data = self._read(band_cog, window=band_window)
+                elif band_cog.crs == crs:
+                    # finer bands are read straight on the coarse grid, from their overviews
+                    band_data = self._read(
+                        band_cog,
+                        window=from_bounds(
+                            *window_bounds(lowest_window, lowest_cog.transform),
+                            band_cog.transform,
+                        ),
+                        out_shape=shape,
+                        resampling=self.resampling,
+                    )
+                else:
+                    band_data = self._read(band_cog, window=band_window)
+                    band_data = self._resample(
+                        band_data,
+                        band_cog.crs,
+                        band_cog.window_transform(band_window),
+                        crs,
+                        transform,
+                        shape,
+                        nodata,
+                    )
+                bands.append(band_data)
+        return np.stack(bands), crs, transform, nodata
 
-            for band_url in band_urls:
-                with rasterio.open(band_url) as band_cog:
-                    resolutions.append(band_cog.res)
+    def _open(self, band_url):
+        """
+        Open a band, reading its header.
 
-            lowest_resolution = max(resolutions, key=lambda res: res[0] * res[1])
+        Parameters:
+        band_url (str): URL of the band.
 
-            for band_url in band_urls:
-                with rasterio.open(band_url) as band_cog:
-                    min_x, min_y, max_x, max_y = self._transform_bbox(band_cog.crs)
-                    band_window = self._calculate_window(
-                        band_cog, min_x, min_y, max_x, max_y
-                    )
+        Returns:
+        rasterio.io.DatasetReader: Dataset reader of the band.
+        """
+        with self.metrics.span("extract.open"):
+            return rasterio.open(band_url)
+
+    def _read(self, band_cog, **kwargs):
+        """
+        Read the first band of a dataset, counting the bytes read.
+
+        Parameters:
+        band_cog (rasterio.io.DatasetReader): Dataset reader of the band.
+        **kwargs: Arguments of rasterio.io.DatasetReader.read, e.g. window.
+
+        Returns:
+        numpy.ndarray: Array of shape (height, width).
+        """
+        with self.metrics.span("extract.read"):
+            data = band_cog.read(1, **kwargs)
+        self.progress.add_bytes(data.nbytes)
+        self.metrics.count("extract.bytes_read", data.nbytes)
+        return data
+
+    def _resample(self, data, src_crs, src_transform, crs, transform, shape, nodata):
+        """
+        Resample integer or float band data to another grid, keeping its data type.
 
-                    if self._is_window_out_of_bounds(band_window):
-                        return None
-                    self.crs = band_cog.crs
-                    self.transform = band_cog.transform
-
-                    band_data = band_cog.read(1, window=band_window).astype(float)
-
-                    # Resample if necessary
-                    if band_cog.res != lowest_resolution:
-                        scale_factor_x = band_cog.res[0] / lowest_resolution[0]
-                        scale_factor_y = band_cog.res[1] / lowest_resolution[1]
-                        band_data = reproject(
-                            source=band_data,
-                            destination=np.empty(
-                                (
-                                    int(band_data.shape[0] * scale_factor_y),
-                                    int(band_data.shape[1] * scale_factor_x),
-                                ),
-                                dtype=band_data.dtype,
-                            ),
-                            src_transform=band_cog.transform,
-                            src_crs=band_cog.crs,
-                            dst_transform=band_cog.transform
-                            * band_cog.transform.scale(scale_factor_x, scale_factor_y),
-                            dst_crs=band_cog.crs,
-                            resampling=Resampling.average,
-                        )[0]
-
-                    bands.append(band_data)
-                    bands_meta.append(band_url.split("/")[-1].split(".")[0])
-
-            print("Stacking Bands...")
-            stacked_bands = np.stack(bands)
-            output_file = os.path.join(
-                self.output_dir, f"{feature_id}_bands_export.tif"
+        Returns:
+        numpy.ndarray: Resampled array, nodata outside of the source.
+        """
+        values = data.astype(float)
+        if nodata is not None:
+            values[data == nodata] = np.nan
+        with self.metrics.span("extract.resample"):
+            values = resample(
+                values, src_crs, src_transform, crs, transform, shape, self.resampling
             )
-            self._save_geotiff(stacked_bands, output_file, bands_meta)
+        if np.issubdtype(data.dtype, np.integer):
+            values = np.rint(values)
+        return np.where(
+            np.isnan(values), 0 if nodata is None else nodata, values
+        ).astype(data.dtype)
+
+    def _fetch_and_save_bands(self, band_urls, feature_id):
+        """
+        Fetch and save the bands from the given URLs.
+
+        Parameters:
+        band_urls (list): List of band URLs.
+        feature_id (str): Feature ID for naming the output file.
+
+        Returns:
+        str: Path to the saved GeoTIFF file, or its name in the archive when the output is zipped.
+        """
+        try:
+            fetched = self._fetch_bands(band_urls)
+            if fetched is None:
+                return None
+            data, crs, transform, nodata = fetched
+            self.crs, self.transform = crs, transform
+            bands_meta = [
+                band_url.split("/")[-1].split(".")[0] for band_url in band_urls
+            ]
+
+            self.channel.log("Stacking Bands...")
+            output_name = f"{feature_id}_bands_export.tif"
+            if self.output_format == "tiff":
+                data, nodata = data.astype(float), None
+            if self._archive is not None:
+                # write the file in memory and stream it into the archive
+                with MemoryFile() as memfile:
+                    self._save_geotiff(
+                        data, memfile, bands_meta, crs, transform, nodata
+                    )
+                    self._add_to_archive(output_name, memfile.read())
+                return output_name
+            output_file = os.path.join(self.output_dir, output_name)
+            self._save_geotiff(data, output_file, bands_meta, crs, transform, nodata)
+            self.channel.emit("file_written", file=os.path.basename(output_file))
             return output_file
         except Exception as ex:
-            print(f"Error fetching bands: {ex}")
+            self.channel.log(f"Error fetching bands: {ex}")
             raise ex
             return None
 
-    def _save_geotiff(self, bands, output_file, bands_meta=None):
+    def _fetch_and_stack_bands(self, band_urls, feature, index):
+        """
+        Fetch the bands of a scene and write them at its time index of the stacked output.
+
+        Parameters:
+        band_urls (list): List of band URLs.
+        feature (dict): STAC feature of the scene.
+        index (int): Time index of the scene.
+
+        Returns:
+        str: Feature ID, or None if the area is outside of the scene.
+        """
+        fetched = self._fetch_bands(band_urls)
+        if fetched is None:
+            return None
+        data, crs, transform, nodata = fetched
+        with self._lock:
+            if self._target is None:
+                self._open_target(data, crs, transform, nodata)
+        if (crs, transform, data.shape[1:]) != (self.crs, self.transform, self._shape):
+            # scenes of another tile or orbit are resampled to the grid of the stack
+            data = np.stack(
+                [
+                    self._resample(
+                        band,
+                        crs,
+                        transform,
+                        self.crs,
+                        self.transform,
+                        self._shape,
+                        nodata,
+                    )
+                    for band in data
+                ]
+            )
+        data = data.astype(self._dtype)
+        if self.output_format == "zarr":
+            with self.metrics.span("extract.write"):
+                self._target[index] = data
+        else:
+            band_count = len(self.bands_list)
+            with self._lock, self.metrics.span("extract.write"):
+                self._target.write(
+                    data,
+                    indexes=list(
+                        range(index * band_count + 1, (index + 1) * band_count + 1)
+                    ),
+                )
+        return feature["id"]
+
+    def _open_target(self, data, crs, transform, nodata):
+        """
+        Create the stacked output on the grid of the first scene read.
+        """
+        self.crs, self.transform = crs, transform
+        self._shape = data.shape[1:]
+        self._dtype = data.dtype
+        self._nodata = nodata
+        band_count = len(self.bands_list)
+        scene_ids = [feature["id"] for feature in self._features]
+        dates = [feature["properties"]["datetime"] for feature in self._features]
+        if self.output_format == "zarr":
+            try:
+                import zarr
+            except ImportError:
+                raise ImportError(
+                    "Zarr output requires the zarr package, install it with `pip install zarr`"
+                )
+
+            if self.zip_output:
+                self._zarr_store = zarr.storage.ZipStore(
+                    os.path.join(self.output_dir, "tiff_files.zip"), mode="w"
+                )
+                store, path = self._zarr_store, "bands_cube.zarr"
+            else:
+                store, path = os.path.join(self.output_dir, "bands_cube.zarr"), None
+            # zip entries cannot be rewritten, so the attributes are set on creation
+            self._target = zarr.open_array(
+                store=store,
+                path=path,
+                mode="w",
+                shape=(len(self._features), band_count, *self._shape),
+                chunks=(1, 1, 512, 512),
+                dtype=self._dtype,
+                fill_value=0 if nodata is None else nodata,
+                attributes=dict(
+                    dimensions=["time", "band", "y", "x"],
+                    time=dates,
+                    scene=scene_ids,
+                    band=list(self.bands_list),
+                    crs=crs.to_wkt(),
+                    transform=list(transform)[:6],
+                    nodata=nodata,
+                ),
+            )
+            return
+        # the scenes land in any order, so a zipped stack is written to a
+        # temporary file and streamed into the archive once complete
+        stack_name = STACK_PART_NAME if self.zip_output else "bands_stack.tif"
+        self._target = rasterio.open(
+            os.path.join(self.output_dir, stack_name),
+            "w",
+            driver="GTiff",
+            height=self._shape[0],
+            width=self._shape[1],
+            count=len(self._features) * band_count,
+            dtype=self._dtype,
+            crs=crs,
+            transform=transform,
+            nodata=nodata,
+            tiled=True,
+            blockxsize=512,
+            blockysize=512,
+            compress="deflate",
+            predictor=2,
+            BIGTIFF="IF_SAFER",
+        )
+        for scene, (scene_id, date) in enumerate(zip(scene_ids, dates)):
+            for band_index, band in enumerate(self.bands_list):
+                index = scene * band_count + band_index + 1
+                self._target.set_band_description(index, f"{scene_id}:{band}")
+                self._target.update_tags(
+                    index, scene=scene_id, datetime=date, band=band
+                )
+
+    def _close_target(self):
+        """
+        Finish the stacked output, building the overviews of the GeoTIFF.
+
+        Returns:
+        str: Path to the stacked output, or to the archive holding it.
+        """
+        if self.output_format == "zarr":
+            if self._zarr_store is not None:
+                self._zarr_store.close()
+                return self._zarr_store.path
+            return os.path.join(self.output_dir, "bands_cube.zarr")
+        factors = []
+        while max(self._shape) // 2 ** (len(factors) + 1) >= 256:
+            factors.append(2 ** (len(factors) + 1))
+        if factors:
+            self._target.build_overviews(factors, Resampling.average)
+        self._target.close()
+        if not self.zip_output:
+            return self._target.name
+        archive_path = os.path.join(self.output_dir, "tiff_files.zip")
+        try:
+            with self.metrics.span("extract.zip"), ZipArchive(archive_path) as archive:
+                # deflated internally already
+                archive.add_file(self._target.name, "bands_stack.tif", compress=False)
+        finally:
+            os.remove(self._target.name)
+        return archive_path
+
+    def _add_to_archive(self, name, data):
+        """
+        Add a file to the zip archive of the outputs.
+
+        Parameters:
+        name (str): Name of the file in the archive.
+        data (bytes): Content of the file.
+        """
+        # COGs are compressed internally, deflating them again only costs time
+        with self.metrics.span("extract.zip"):
+            self._archive.add(name, data, compress=self.output_format == "tiff")
+
+    def _save_geotiff(
+        self,
+        bands,
+        output_file,
+        bands_meta=None,
+        crs=None,
+        transform=None,
+        nodata=None,
+    ):
         """
         Save the bands as a GeoTIFF file.
 
+        Float bands are saved as a plain GeoTIFF with -9999 as nodata, other
+        data types as a COG keeping the data type of the bands.
+
         Parameters:
         bands (numpy.ndarray): Array of bands to save.
-        output_file (str): Path to the output file.
+        output_file (str or rasterio.io.MemoryFile): Path to the output file, or in memory file.
         bands_meta (list): List of metadata for the bands.
+        crs (rasterio.crs.CRS): Coordinate reference system of the bands, defaults to the last one read.
+        transform (affine.Affine): Geotransform of the bands, defaults to the last one read.
+        nodata (float): Nodata value of integer bands.
         """
 
         band_shape = bands.shape
-        nodata_value = -9999
-        bands = np.where(np.isnan(bands), nodata_value, bands)
-        with rasterio.open(
-            output_file,
-            "w",
-            driver="GTiff",
+        if np.issubdtype(bands.dtype, np.floating):
+            nodata_value = -9999
+            bands = np.where(np.isnan(bands), nodata_value, bands)
+            profile = dict(driver="GTiff")
+        else:
+            nodata_value = nodata
+            profile = dict(driver="COG", compress="deflate", predictor=2, blocksize=512)
+        profile.update(
             height=bands.shape[1],
             width=bands.shape[2],
             count=len(bands),
             dtype=bands.dtype,
-            crs=self.crs,
-            transform=self.transform,
+            crs=crs or self.crs,
+            transform=transform or self.transform,
             nodata=nodata_value,
-        ) as dst:
+        )
+        dst = (
+            output_file.open(**profile)
+            if isinstance(output_file, MemoryFile)
+            else rasterio.open(output_file, "w", **profile)
+        )
+        with self.metrics.span("extract.write"), dst:
             for band in range(1, band_shape[0] + 1):
                 dst.write(bands[band - 1], band)
                 if bands_meta:
@@ -265,7 +571,7 @@ class ExtractProcessor:
         """
         Extract the bands from the satellite images and save them as GeoTIFF files.
         """
-        print("Extracting bands...")
+        self.channel.log("Extracting bands...")
         os.makedirs(self.output_dir, exist_ok=True)
 
         features = search_stac_api(
@@ -274,56 +580,94 @@ class ExtractProcessor:
             self.end_date,
             self.cloud_cover,
         )
-        print(f"Total scenes found: {len(features)}")
+        self.channel.log(f"Total scenes found: {len(features)}")
         filtered_features = filter_intersected_features(features, self.bbox)
-        print(f"Scenes covering input area: {len(filtered_features)}")
+        self.channel.log(f"Scenes covering input area: {len(filtered_features)}")
         overlapping_features_removed = remove_overlapping_sentinel2_tiles(
             filtered_features
         )
-        print(f"Scenes after removing overlaps: {len(overlapping_features_removed)}")
+        self.channel.log(
+            f"Scenes after removing overlaps: {len(overlapping_features_removed)}"
+        )
         if self.use_smart_filter:
             overlapping_features_removed = smart_filter_images(
                 overlapping_features_removed, self.start_date, self.end_date
             )
-            print(
+            self.channel.log(
                 f"Scenes after applying smart filter: {len(overlapping_features_removed)}"
             )
+        self.channel.emit(
+            "scenes_found",
+            found=len(features),
+            covering=len(filtered_features),
+            selected=len(overlapping_features_removed),
+        )
 
+        stacked = self.output_format in ("stack", "zarr")
+        if stacked:
+            # the scenes of a stacked output are ordered in time
+            overlapping_features_removed = sorted(
+                overlapping_features_removed,
+                key=lambda feature: feature["properties"]["datetime"],
+            )
+            self._features = overlapping_features_removed
         band_urls_list = self._get_band_urls(overlapping_features_removed)
+        archive_path = os.path.join(self.output_dir, "tiff_files.zip")
+        if self.zip_output and self.output_format in ("tiff", "cog"):
+            # scenes go straight into the archive, without a copy on disk
+            self._archive = ZipArchive(archive_path)
+
+        def process(index, band_urls, feature):
+            if stacked:
+                return self._fetch_and_stack_bands(band_urls, feature, index)
+            return self._fetch_and_save_bands(band_urls, feature["id"])
+
+        self.progress.start(len(band_urls_list))
         result_lists = []
-        if self.workers > 1:
-            print("Using Parallel Processing...")
-            with ThreadPoolExecutor(max_workers=self.workers) as executor:
-                futures = [
-                    executor.submit(
-                        self._fetch_and_save_bands, band_urls, feature["id"]
-                    )
-                    for band_urls, feature in zip(
-                        band_urls_list, overlapping_features_removed
-                    )
-                ]
-                for future in tqdm(
-                    as_completed(futures),
-                    total=len(futures),
+        try:
+            if self.workers > 1:
+                self.channel.log("Using Parallel Processing...")
+                with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                    futures = [
+                        executor.submit(process, index, band_urls, feature)
+                        for index, (band_urls, feature) in enumerate(
+                            zip(band_urls_list, overlapping_features_removed)
+                        )
+                    ]
+                    for future in tqdm(
+                        as_completed(futures),
+                        total=len(futures),
+                        desc="Extracting Bands",
+                        file=self.log_file,
+                    ):
+                        result = future.result()
+                        result_lists.append(result)
+                        self.progress.advance()
+                        if result is not None:
+                            self.metrics.count("extract.scenes")
+            else:
+                for index, (band_urls, feature) in tqdm(
+                    enumerate(zip(band_urls_list, overlapping_features_removed)),
+                    total=len(band_urls_list),
                     desc="Extracting Bands",
                     file=self.log_file,
                 ):
-                    result = future.result()
+                    result = process(index, band_urls, feature)
                     result_lists.append(result)
-        else:
-            for band_urls, feature in tqdm(
-                zip(band_urls_list, overlapping_features_removed),
-                total=len(band_urls_list),
-                desc="Extracting Bands",
-                file=self.log_file,
-            ):
-                result = self._fetch_and_save_bands(band_urls, feature["id"])
-                result_lists.append(result)
-        if self.zip_output:
-            zip_files(
-                result_lists,
-                os.path.join(self.output_dir, "tiff_files.zip"),
-            )
+                    self.progress.advance()
+                    if result is not None:
+                        self.metrics.count("extract.scenes")
+        finally:
+            if self._archive is not None:
+                with self.metrics.span("extract.zip"):
+                    self._archive.close()
+                self._archive = None
+                self.channel.emit("file_written", file=os.path.basename(archive_path))
+            if self._target is not None:
+                with self.metrics.span("extract.write"):
+                    output_path = self._close_target()
+                self._target = self._zarr_store = None
+                self.channel.emit("file_written", file=os.path.basename(output_path))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,89 @@
+import time
+from collections import OrderedDict
+
+import numpy as np
+from shapely import STRtree
+from shapely.geometry import box, shape
+
+
+class FootprintIndex:
+    """
+    Spatial index over the footprints of the STAC features found for an area.
+    """
+
+    def __init__(self, features):
+        """
+        Initialize the FootprintIndex.
+
+        Parameters:
+        features (list): STAC features, in the order they should be returned.
+        """
+        self.features = features
+        self.tree = STRtree([shape(feature["geometry"]) for feature in features])
+
+    def __len__(self):
+        return len(self.features)
+
+    def query(self, bbox):
+        """
+        Get the features whose footprint fully contains a bounding box.
+
+        Parameters:
+        bbox (list): Bounding box coordinates [min_lon, min_lat, max_lon, max_lat].
+
+        Returns:
+        list: Matching features, in their original order.
+        """
+        indices = self.tree.query(box(*bbox), predicate="within")
+        return [self.features[index] for index in np.sort(indices)]
+
+
+class FootprintIndexCache:
+    """
+    Small LRU of footprint indexes expiring after a fixed time.
+    """
+
+    def __init__(self, max_entries=256, ttl=600):
+        """
+        Initialize the FootprintIndexCache.
+
+        Parameters:
+        max_entries (int): Maximum number of indexes kept.
+        ttl (float): Time to live of an index in seconds.
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        """
+        Get an index.
+
+        Parameters:
+        key (hashable): Index key.
+
+        Returns:
+        FootprintIndex: Cached index or None if missing or expired.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        index, expires_at = entry
+        if expires_at <= time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return index
+
+    def set(self, key, index):
+        """
+        Store an index.
+
+        Parameters:
+        key (hashable): Index key.
+        index (FootprintIndex): Index to store.
+        """
+        self._entries[key] = (index, time.time() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
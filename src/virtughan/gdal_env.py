@@ -0,0 +1,149 @@
+import os
+
+import rasterio
+from rasterio.env import set_gdal_config
+
+# GDAL configuration of the COG reads, by profile name
+IO_PROFILES = {
+    # GDAL defaults, the reference to measure the other profiles against
+    "default": {},
+    # COGs over HTTP or S3: no directory listing or sidecar probes on open,
+    # the header in one request, merged and multiplexed range requests
+    "cog": {
+        "GDAL_DISABLE_READDIR_ON_OPEN": "EMPTY_DIR",
+        "CPL_VSIL_CURL_ALLOWED_EXTENSIONS": ".tif,.TIF,.tiff",
+        "GDAL_INGESTED_BYTES_AT_OPEN": "32768",
+        "GDAL_HTTP_MERGE_CONSECUTIVE_RANGES": "YES",
+        "GDAL_HTTP_MULTIPLEX": "YES",
+        "GDAL_HTTP_MAX_RETRY": "3",
+        "GDAL_HTTP_RETRY_DELAY": "1",
+        "CPL_VSIL_CURL_CACHE_SIZE": str(128 * 1024 * 1024),
+        "VSI_CACHE": "TRUE",
+        "VSI_CACHE_SIZE": str(32 * 1024 * 1024),
+        "GDAL_CACHEMAX": 512 * 1024 * 1024,
+    },
+    # COGs mirrored on a local disk: the page cache already holds the bytes
+    "local": {
+        "GDAL_DISABLE_READDIR_ON_OPEN": "EMPTY_DIR",
+        "VSI_CACHE": "FALSE",
+        "GDAL_CACHEMAX": 512 * 1024 * 1024,
+    },
+}
+DEFAULT_IO_PROFILE = "cog"
+# options sizing caches of the whole process, set once instead of around each read
+PROCESS_OPTIONS = ("GDAL_CACHEMAX", "CPL_VSIL_CURL_CACHE_SIZE")
+
+
+class IOProfile:
+    """
+    GDAL configuration applied around every COG read.
+
+    GDAL options are thread local, so the profile is entered in the thread
+    doing the read. The options of PROCESS_OPTIONS are set once, when the
+    profile is first entered.
+    """
+
+    def __init__(self, name=DEFAULT_IO_PROFILE, **options):
+        """
+        Initialize the IOProfile.
+
+        Parameters:
+        name (str): Name of the base profile, one of IO_PROFILES.
+        **options: GDAL configuration options added to or overriding the base profile, None removes one. GDAL_CACHEMAX is in bytes.
+        """
+        if name not in IO_PROFILES:
+            raise ValueError(
+                f"Invalid I/O profile {name}, valid profiles are {', '.join(IO_PROFILES)}"
+            )
+        self.name = name
+        self.options = {
+            key: value
+            for key, value in {**IO_PROFILES[name], **options}.items()
+            if value is not None
+        }
+        self._applied = False
+
+    @classmethod
+    def from_env(cls):
+        """
+        Build the profile named by the GDAL_IO_PROFILE environment variable.
+        GDAL options set in the environment take precedence over the profile.
+
+        Returns:
+        IOProfile: Configured profile.
+        """
+        name = os.getenv("GDAL_IO_PROFILE", DEFAULT_IO_PROFILE)
+        return cls(
+            name,
+            **{key: None for key in IO_PROFILES.get(name, {}) if key in os.environ},
+        )
+
+    def env(self):
+        """
+        Get a GDAL environment with the options of the profile.
+
+        Returns:
+        rasterio.Env: Environment to enter around the reads.
+        """
+        if not self._applied:
+            for key in PROCESS_OPTIONS:
+                if key in self.options:
+                    set_gdal_config(key, self.options[key])
+            self._applied = True
+        return rasterio.Env(
+            **{
+                key: value
+                for key, value in self.options.items()
+                if key not in PROCESS_OPTIONS
+            }
+        )
+
+    def describe(self):
+        """
+        Describe the profile, e.g. for benchmark results.
+
+        Returns:
+        dict: Name and GDAL options of the profile.
+        """
+        return {"name": self.name, "options": dict(self.options)}
+
+
+_io_profile = IOProfile.from_env()
+
+
+def get_io_profile():
+    """
+    Get the I/O profile of the COG reads.
+
+    Returns:
+    IOProfile: Current profile.
+    """
+    return _io_profile
+
+
+def configure_io(profile=DEFAULT_IO_PROFILE, **options):
+    """
+    Change the I/O profile of the COG reads, at runtime.
+
+    Parameters:
+    profile (str or IOProfile): Profile or name of the base profile.
+    **options: GDAL configuration options added to or overriding the base profile.
+
+    Returns:
+    IOProfile: New profile.
+    """
+    global _io_profile
+    _io_profile = (
+        profile if isinstance(profile, IOProfile) else IOProfile(profile, **options)
+    )
+    return _io_profile
+
+
+def io_env():
+    """
+    Get a GDAL environment with the current I/O profile, to enter around a read.
+
+    Returns:
+    rasterio.Env: Environment of the current profile.
+    """
+    return _io_profile.env()
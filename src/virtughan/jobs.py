@@ -0,0 +1,579 @@
+import json
+import logging
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+from .engine import VirtughanProcessor
+from .extract import ExtractProcessor
+from .metrics import REGISTRY, read_summary, recording, write_summary
+from .profiling import profiled
+from .progress import ProgressChannel, get_channel
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+
+ACTIVE_STATUSES = (JOB_QUEUED, JOB_RUNNING)
+FINISHED_STATUSES = (JOB_COMPLETED, JOB_FAILED, JOB_CANCELLED)
+
+logger = logging.getLogger(__name__)
+
+
+class JobLimitError(Exception):
+    """
+    Raised when a client already has the maximum number of active jobs.
+    """
+
+
+def run_export_job(params, output_dir):
+    """
+    Run a VirtughanProcessor computation for a queued export job.
+
+    Parameters:
+    params (dict): Keyword arguments for the VirtughanProcessor.
+    output_dir (str): Directory to save the output files.
+    """
+    channel = get_channel()
+    channel.log("Starting processing...")
+    try:
+        processor = VirtughanProcessor(output_dir=output_dir, **params)
+        processor.compute()
+        channel.log(f"Processing completed. Results saved in {output_dir}")
+    except Exception as e:
+        channel.log(f"Error processing : {e}")
+        raise
+
+
+def run_extract_job(params, output_dir):
+    """
+    Run an ExtractProcessor extraction for a queued image download job.
+
+    Parameters:
+    params (dict): Keyword arguments for the ExtractProcessor.
+    output_dir (str): Directory to save the extracted bands.
+    """
+    channel = get_channel()
+    channel.log("Starting raw band extraction...")
+    try:
+        processor = ExtractProcessor(output_dir=output_dir, zip_output=True, **params)
+        processor.extract()
+        channel.log(f"Raw band extraction completed. Results saved in {output_dir}")
+    except Exception as e:
+        channel.log(f"Error during raw band extraction: {e}")
+        raise
+
+
+JOB_RUNNERS = {
+    "export": run_export_job,
+    "image-download": run_extract_job,
+}
+
+
+class JobStore:
+    """
+    SQLite backed store for job state, shared by every process using the same file.
+    """
+
+    def __init__(self, db_path):
+        """
+        Initialize the JobStore.
+
+        Parameters:
+        db_path (str): Path to the SQLite database file.
+        """
+        self.db_path = db_path
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    uid TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    params TEXT NOT NULL,
+                    output_dir TEXT NOT NULL,
+                    client TEXT,
+                    priority INTEGER NOT NULL DEFAULT 0,
+                    status TEXT NOT NULL,
+                    progress REAL NOT NULL DEFAULT 0,
+                    message TEXT,
+                    error TEXT,
+                    pid INTEGER,
+                    cancel_requested INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL
+                )
+                """)
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, priority, created_at)"
+            )
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _to_dict(row):
+        if row is None:
+            return None
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        job["cancel_requested"] = bool(job["cancel_requested"])
+        return job
+
+    def create(self, uid, kind, params, output_dir, client=None, priority=0):
+        """
+        Insert a new queued job.
+
+        Parameters:
+        uid (str): Unique job identifier.
+        kind (str): Job kind, one of JOB_RUNNERS.
+        params (dict): JSON serializable job parameters.
+        output_dir (str): Directory the job writes its results to.
+        client (str): Identifier of the client submitting the job.
+        priority (int): Higher priorities are picked first.
+        """
+        with self._connect() as conn:
+            conn.execute(
+                """
+                INSERT INTO jobs (uid, kind, params, output_dir, client, priority, status, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    uid,
+                    kind,
+                    json.dumps(params),
+                    output_dir,
+                    client,
+                    priority,
+                    JOB_QUEUED,
+                    time.time(),
+                ),
+            )
+
+    def get(self, uid):
+        """
+        Get a job by its identifier.
+
+        Parameters:
+        uid (str): Unique job identifier.
+
+        Returns:
+        dict: Job record or None if not found.
+        """
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE uid = ?", (uid,)).fetchone()
+        return self._to_dict(row)
+
+    def update(self, uid, **fields):
+        """
+        Update fields of a job.
+
+        Parameters:
+        uid (str): Unique job identifier.
+        **fields: Column values to set.
+        """
+        if not fields:
+            return
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        with self._connect() as conn:
+            conn.execute(
+                f"UPDATE jobs SET {columns} WHERE uid = ?", (*fields.values(), uid)
+            )
+
+    def count_active(self, client):
+        """
+        Count queued and running jobs of a client.
+
+        Parameters:
+        client (str): Identifier of the client.
+
+        Returns:
+        int: Number of active jobs.
+        """
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE client = ? AND status IN (?, ?)",
+                (client, *ACTIVE_STATUSES),
+            ).fetchone()[0]
+
+    def queue_position(self, uid):
+        """
+        Get the number of queued jobs that will be picked before the given one.
+
+        Parameters:
+        uid (str): Unique job identifier.
+
+        Returns:
+        int: Position in the queue, 0 meaning next.
+        """
+        with self._connect() as conn:
+            return conn.execute(
+                """
+                SELECT COUNT(*) FROM jobs AS other, jobs AS job
+                WHERE job.uid = ? AND other.status = ?
+                AND (other.priority > job.priority
+                     OR (other.priority = job.priority AND other.created_at < job.created_at))
+                """,
+                (uid, JOB_QUEUED),
+            ).fetchone()[0]
+
+    def claim_next(self, max_running, pid=None):
+        """
+        Atomically move the next queued job to running if a slot is free.
+
+        The job is claimed with the pid of the claiming process, replaced by
+        the pid of its worker once started, so it always belongs to a process
+        another server sharing the database can check.
+
+        Parameters:
+        max_running (int): Maximum number of jobs allowed to run at once.
+        pid (int): Process claiming the job, defaults to the current process.
+
+        Returns:
+        dict: Claimed job record or None if nothing could be claimed.
+        """
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                running = conn.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status = ?", (JOB_RUNNING,)
+                ).fetchone()[0]
+                row = None
+                if running < max_running:
+                    row = conn.execute(
+                        """
+                        SELECT * FROM jobs WHERE status = ?
+                        ORDER BY priority DESC, created_at ASC LIMIT 1
+                        """,
+                        (JOB_QUEUED,),
+                    ).fetchone()
+                if row is not None:
+                    conn.execute(
+                        "UPDATE jobs SET status = ?, started_at = ?, pid = ? WHERE uid = ?",
+                        (JOB_RUNNING, time.time(), pid or os.getpid(), row["uid"]),
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return self._to_dict(row)
+
+    def running_jobs(self):
+        """
+        Get all running jobs.
+
+        Returns:
+        list: List of running job records.
+        """
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT * FROM jobs WHERE status = ?", (JOB_RUNNING,)
+            ).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def purge(self, older_than):
+        """
+        Delete finished jobs created before the given timestamp.
+
+        Parameters:
+        older_than (float): Unix timestamp.
+        """
+        with self._connect() as conn:
+            conn.execute(
+                "DELETE FROM jobs WHERE created_at < ? AND status IN (?, ?, ?)",
+                (older_than, *FINISHED_STATUSES),
+            )
+
+
+def _run_job(db_path, uid):
+    """
+    Entry point of a job worker process.
+
+    Parameters:
+    db_path (str): Path to the SQLite database file.
+    uid (str): Unique job identifier.
+    """
+    store = JobStore(db_path)
+    job = store.get(uid)
+    store.update(uid, pid=os.getpid(), message="Processing")
+    channel = ProgressChannel(job["output_dir"])
+    channel.add_listener(lambda event: _record_progress(store, uid, event))
+    params = dict(job["params"])
+    profile = params.pop("profile", None)
+    try:
+        with channel, recording() as recorder:
+            try:
+                with profiled(job["output_dir"], profile):
+                    JOB_RUNNERS[job["kind"]](params, job["output_dir"])
+            except Exception as e:
+                channel.emit("job_finished", status=JOB_FAILED, error=str(e))
+                raise
+            finally:
+                # where the time went, also merged into the metrics of the API
+                write_summary(recorder, job["output_dir"])
+            channel.emit("job_finished", status=JOB_COMPLETED)
+    except Exception as e:
+        store.update(
+            uid,
+            status=JOB_FAILED,
+            error=str(e),
+            message="Failed",
+            finished_at=time.time(),
+        )
+    else:
+        store.update(
+            uid,
+            status=JOB_COMPLETED,
+            progress=1.0,
+            message="Completed",
+            finished_at=time.time(),
+        )
+
+
+def _record_progress(store, uid, event):
+    """
+    Mirror scene progress events of a job into its store record.
+
+    Parameters:
+    store (JobStore): Store holding the job.
+    uid (str): Unique job identifier.
+    event (dict): Progress event emitted by the job channel.
+    """
+    if event["type"] == "scenes_found":
+        store.update(uid, message=f"{event['selected']} scenes selected")
+    elif event["type"] == "scene_processed" and event["total"]:
+        # keep the last percent for aggregation and writing outputs
+        store.update(
+            uid,
+            progress=round(0.99 * event["done"] / event["total"], 4),
+            message=f"{event['done']}/{event['total']} scenes processed",
+        )
+
+
+class JobQueue:
+    """
+    Priority job queue running each job in its own worker process.
+    """
+
+    def __init__(self, db_path, workers=2, max_jobs_per_client=2, poll_interval=1.0):
+        """
+        Initialize the JobQueue.
+
+        Parameters:
+        db_path (str): Path to the SQLite database file holding the queue.
+        workers (int): Maximum number of jobs running at once across all processes sharing the database.
+        max_jobs_per_client (int): Maximum number of queued and running jobs per client.
+        poll_interval (float): Seconds between dispatcher iterations.
+        """
+        self.store = JobStore(db_path)
+        self.workers = workers
+        self.max_jobs_per_client = max_jobs_per_client
+        self.poll_interval = poll_interval
+        self._context = multiprocessing.get_context("spawn")
+        self._processes = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def submit(self, kind, params, output_dir, client=None, priority=0, uid=None):
+        """
+        Queue a new job.
+
+        Parameters:
+        kind (str): Job kind, one of JOB_RUNNERS.
+        params (dict): JSON serializable job parameters.
+        output_dir (str): Directory the job writes its results to.
+        client (str): Identifier of the client submitting the job.
+        priority (int): Higher priorities are picked first.
+        uid (str): Unique job identifier, generated if not given.
+
+        Returns:
+        str: Unique job identifier.
+        """
+        if kind not in JOB_RUNNERS:
+            raise ValueError(f"Unknown job kind '{kind}'")
+        if (
+            client is not None
+            and self.store.count_active(client) >= self.max_jobs_per_client
+        ):
+            raise JobLimitError(
+                f"Client already has {self.max_jobs_per_client} active jobs"
+            )
+        uid = (
+            uid or datetime.now().strftime("%Y%m%d%H%M%S") + "_" + str(uuid.uuid4())[:6]
+        )
+        self.store.create(uid, kind, params, output_dir, client, priority)
+        return uid
+
+    def status(self, uid):
+        """
+        Get the status of a job.
+
+        Parameters:
+        uid (str): Unique job identifier.
+
+        Returns:
+        dict: Job status or None if not found.
+        """
+        job = self.store.get(uid)
+        if job is None:
+            return None
+        status = {
+            "uid": job["uid"],
+            "kind": job["kind"],
+            "status": job["status"],
+            "progress": job["progress"],
+            "message": job["message"],
+            "error": job["error"],
+            "priority": job["priority"],
+            "created_at": _isoformat(job["created_at"]),
+            "started_at": _isoformat(job["started_at"]),
+            "finished_at": _isoformat(job["finished_at"]),
+        }
+        if job["status"] == JOB_QUEUED:
+            status["queue_position"] = self.store.queue_position(uid)
+        return status
+
+    def cancel(self, uid):
+        """
+        Cancel a queued or running job.
+
+        Parameters:
+        uid (str): Unique job identifier.
+
+        Returns:
+        bool: True if the job was active and is being cancelled.
+        """
+        job = self.store.get(uid)
+        if job is None or job["status"] not in ACTIVE_STATUSES:
+            return False
+        if job["status"] == JOB_QUEUED:
+            self.store.update(
+                uid,
+                status=JOB_CANCELLED,
+                message="Cancelled",
+                finished_at=time.time(),
+            )
+        else:
+            # the process owning the worker terminates it on its next iteration
+            self.store.update(uid, cancel_requested=1)
+        return True
+
+    def start(self):
+        """
+        Start the dispatcher thread.
+        """
+        self._fail_orphaned_jobs()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._dispatch_loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the dispatcher thread and terminate the jobs it started.
+        """
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        for uid, process in self._processes.items():
+            process.terminate()
+            process.join()
+            self.store.update(
+                uid,
+                status=JOB_CANCELLED,
+                message="Server shutdown",
+                finished_at=time.time(),
+            )
+        self._processes.clear()
+
+    def _fail_orphaned_jobs(self):
+        for job in self.store.running_jobs():
+            if not job["pid"]:
+                # claimed by a server that did not record itself as the owner
+                error = "Worker process was never started"
+            elif job["pid"] == os.getpid():
+                # this server has not claimed anything yet, e.g. PID 1 of a restarted container
+                error = "Server restarted before starting the worker"
+            elif not _pid_alive(job["pid"]):
+                error = "Worker process exited unexpectedly"
+            else:
+                continue
+            self.store.update(
+                job["uid"], status=JOB_FAILED, error=error, finished_at=time.time()
+            )
+
+    def _dispatch_loop(self):
+        while not self._stop.is_set():
+            try:
+                self._reap()
+                self._fill_slots()
+            except Exception:
+                logger.exception("Job dispatcher error")
+            self._stop.wait(self.poll_interval)
+
+    def _reap(self):
+        for uid, process in list(self._processes.items()):
+            job = self.store.get(uid)
+            if process.is_alive():
+                if job is None or job["cancel_requested"]:
+                    process.terminate()
+                    process.join()
+                    self.store.update(
+                        uid,
+                        status=JOB_CANCELLED,
+                        message="Cancelled",
+                        finished_at=time.time(),
+                    )
+                    del self._processes[uid]
+                continue
+            process.join()
+            if job is not None:
+                summary = read_summary(job["output_dir"])
+                if summary is not None:
+                    REGISTRY.merge(summary)
+            if job is not None and job["status"] == JOB_RUNNING:
+                self.store.update(
+                    uid,
+                    status=JOB_FAILED,
+                    error=f"Worker process exited with code {process.exitcode}",
+                    finished_at=time.time(),
+                )
+            del self._processes[uid]
+
+    def _fill_slots(self):
+        while len(self._processes) < self.workers:
+            job = self.store.claim_next(self.workers)
+            if job is None:
+                return
+            process = self._context.Process(
+                target=_run_job, args=(self.store.db_path, job["uid"]), daemon=True
+            )
+            process.start()
+            self.store.update(job["uid"], pid=process.pid)
+            self._processes[job["uid"]] = process
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _isoformat(timestamp):
+    return datetime.fromtimestamp(timestamp).isoformat() if timestamp else None
@@ -0,0 +1,254 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+METRICS_FILE_NAME = "metrics.json"
+
+_current_recorder = ContextVar("virtughan_metrics_recorder", default=None)
+
+
+class Recorder:
+    """
+    Thread safe timings of named spans and counters.
+
+    A recorder forwards everything it records to its parent, so the spans of a
+    job or a tile request also add up in the process wide REGISTRY.
+    """
+
+    def __init__(self, parent=None):
+        """
+        Initialize the Recorder.
+
+        Parameters:
+        parent (Recorder): Recorder receiving a copy of every span and counter.
+        """
+        self.parent = parent
+        self.spans = {}
+        self.counters = {}
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name):
+        """
+        Time a block of code.
+
+        Parameters:
+        name (str): Name of the span, e.g. "engine.read".
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def observe(self, name, seconds):
+        """
+        Record the duration of a span.
+
+        Parameters:
+        name (str): Name of the span.
+        seconds (float): Duration of the span.
+        """
+        with self._lock:
+            stats = self.spans.setdefault(
+                name, {"count": 0, "seconds": 0.0, "max": 0.0}
+            )
+            stats["count"] += 1
+            stats["seconds"] += seconds
+            stats["max"] = max(stats["max"], seconds)
+        if self.parent is not None:
+            self.parent.observe(name, seconds)
+
+    def count(self, name, value=1):
+        """
+        Increment a counter.
+
+        Parameters:
+        name (str): Name of the counter, e.g. "tile.cache_hits".
+        value (int): Increment.
+        """
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+        if self.parent is not None:
+            self.parent.count(name, value)
+
+    def merge(self, summary):
+        """
+        Add the spans and counters of a summary, e.g. of a job run in another process.
+
+        Parameters:
+        summary (dict): Summary returned by Recorder.summary.
+        """
+        with self._lock:
+            for name, other in summary.get("spans", {}).items():
+                stats = self.spans.setdefault(
+                    name, {"count": 0, "seconds": 0.0, "max": 0.0}
+                )
+                stats["count"] += other["count"]
+                stats["seconds"] += other["seconds"]
+                stats["max"] = max(stats["max"], other["max"])
+            for name, value in summary.get("counters", {}).items():
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    def summary(self):
+        """
+        Get the recorded spans and counters.
+
+        Returns:
+        dict: Wall time since the recorder was created, spans with their count, total and maximum seconds, and counters.
+        """
+        with self._lock:
+            return {
+                "wall_time": round(time.perf_counter() - self._started, 6),
+                "spans": {
+                    name: {
+                        "count": stats["count"],
+                        "seconds": round(stats["seconds"], 6),
+                        "max": round(stats["max"], 6),
+                    }
+                    for name, stats in sorted(self.spans.items())
+                },
+                "counters": dict(sorted(self.counters.items())),
+            }
+
+    def server_timing(self):
+        """
+        Format the spans as a Server-Timing header value.
+
+        Spans running concurrently, e.g. the reads of a timeseries tile, add up
+        to more than the wall time of the request.
+
+        Returns:
+        str: Comma separated metrics with their duration in milliseconds.
+        """
+        entries = []
+        for name, stats in self.summary()["spans"].items():
+            entry = f"{name};dur={stats['seconds'] * 1000:.1f}"
+            if stats["count"] > 1:
+                entry += f';desc="{stats["count"]}x"'
+            entries.append(entry)
+        return ", ".join(entries)
+
+    def prometheus(self, prefix="virtughan"):
+        """
+        Format the spans and counters in the Prometheus text exposition format.
+
+        Parameters:
+        prefix (str): Prefix of the metric names.
+
+        Returns:
+        str: Metrics text.
+        """
+        summary = self.summary()
+        lines = []
+        metrics = (
+            ("span_seconds_total", "counter", "Seconds spent in each span.", "seconds"),
+            ("span_count_total", "counter", "Number of times each span ran.", "count"),
+            ("span_max_seconds", "gauge", "Longest duration of each span.", "max"),
+        )
+        for metric, kind, description, field in metrics:
+            lines.append(f"# HELP {prefix}_{metric} {description}")
+            lines.append(f"# TYPE {prefix}_{metric} {kind}")
+            for name, stats in summary["spans"].items():
+                lines.append(
+                    f'{prefix}_{metric}{{span="{_escape(name)}"}} {stats[field]}'
+                )
+        lines.append(f"# HELP {prefix}_events_total Counted events.")
+        lines.append(f"# TYPE {prefix}_events_total counter")
+        for name, value in summary["counters"].items():
+            lines.append(f'{prefix}_events_total{{event="{_escape(name)}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+REGISTRY = Recorder()
+
+
+def get_recorder():
+    """
+    Get the metrics recorder of the current context.
+
+    Returns:
+    Recorder: Recorder of the active job or request, or the process wide REGISTRY.
+    """
+    return _current_recorder.get() or REGISTRY
+
+
+@contextmanager
+def recording():
+    """
+    Record the spans and counters of a job or request in a new recorder, also
+    forwarded to the recorder that was current.
+
+    Returns:
+    Recorder: Recorder of the block.
+    """
+    recorder = Recorder(parent=get_recorder())
+    token = _current_recorder.set(recorder)
+    try:
+        yield recorder
+    finally:
+        _current_recorder.reset(token)
+
+
+def span(name):
+    """
+    Time a block of code in the recorder of the current context.
+
+    Parameters:
+    name (str): Name of the span.
+    """
+    return get_recorder().span(name)
+
+
+def count(name, value=1):
+    """
+    Increment a counter in the recorder of the current context.
+
+    Parameters:
+    name (str): Name of the counter.
+    value (int): Increment.
+    """
+    get_recorder().count(name, value)
+
+
+def write_summary(recorder, output_dir):
+    """
+    Write the summary of a recorder to metrics.json in a job directory.
+
+    Parameters:
+    recorder (Recorder): Recorder of the job.
+    output_dir (str): Job directory.
+
+    Returns:
+    dict: Written summary.
+    """
+    summary = recorder.summary()
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, METRICS_FILE_NAME), "w") as file:
+        json.dump(summary, file, indent=2)
+    return summary
+
+
+def read_summary(output_dir):
+    """
+    Read the metrics summary of a job directory.
+
+    Parameters:
+    output_dir (str): Job directory.
+
+    Returns:
+    dict: Summary, or None if the job did not write one.
+    """
+    path = os.path.join(output_dir, METRICS_FILE_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path) as file:
+        return json.load(file)
@@ -0,0 +1,252 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# sample: stacks of every thread sampled periodically, written for speedscope.app
+# cprofile: every call of the thread running the job or request, written as pstats
+PROFILE_MODES = ("sample", "cprofile")
+SPEEDSCOPE_FILE_NAME = "profile.speedscope.json"
+PSTATS_FILE_NAME = "profile.pstats"
+PSTATS_TEXT_FILE_NAME = "profile.txt"
+MEMORY_FILE_NAME = "memory.json"
+PROFILE_FILE_NAMES = (
+    SPEEDSCOPE_FILE_NAME,
+    PSTATS_FILE_NAME,
+    PSTATS_TEXT_FILE_NAME,
+    MEMORY_FILE_NAME,
+)
+
+
+class SamplingProfiler:
+    """
+    Sampling profiler of every thread of the process, using only the standard
+    library: a background thread records the Python stack of each thread at a
+    fixed interval. Time spent in GDAL or numpy shows in the calling frame.
+    """
+
+    def __init__(self, interval=0.005, max_depth=128):
+        """
+        Initialize the SamplingProfiler.
+
+        Parameters:
+        interval (float): Seconds between samples.
+        max_depth (int): Frames kept from the top of each stack.
+        """
+        self.interval = interval
+        self.max_depth = max_depth
+        self.frames = {}
+        self.samples = {}
+        self.thread_names = {}
+        self.duration = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+        self._started = None
+
+    def start(self):
+        self._stop.clear()
+        self._started = time.perf_counter()
+        self._thread = threading.Thread(
+            target=self._run, name="virtughan-profiler", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        self.duration = time.perf_counter() - self._started
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    key = (code.co_name, code.co_filename, code.co_firstlineno)
+                    stack.append(self.frames.setdefault(key, len(self.frames)))
+                    frame = frame.f_back
+                stack = tuple(reversed(stack))
+                thread_samples = self.samples.setdefault(ident, {})
+                thread_samples[stack] = thread_samples.get(stack, 0) + 1
+                self.thread_names.setdefault(ident, names.get(ident, str(ident)))
+
+    def speedscope(self, name="virtughan"):
+        """
+        Get the samples in the speedscope file format, one profile per thread.
+
+        Parameters:
+        name (str): Name of the profile.
+
+        Returns:
+        dict: Speedscope document.
+        """
+        frames = sorted(self.frames.items(), key=lambda item: item[1])
+        profiles = []
+        for ident, stacks in self.samples.items():
+            weights = [count * self.interval for count in stacks.values()]
+            profiles.append(
+                {
+                    "type": "sampled",
+                    "name": self.thread_names[ident],
+                    "unit": "seconds",
+                    "startValue": 0,
+                    "endValue": sum(weights),
+                    "samples": [list(stack) for stack in stacks],
+                    "weights": weights,
+                }
+            )
+        # the busiest thread is the one speedscope opens first
+        profiles.sort(key=lambda profile: profile["endValue"], reverse=True)
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": name,
+            "exporter": "virtughan",
+            "activeProfileIndex": 0,
+            "shared": {
+                "frames": [
+                    {"name": function, "file": file, "line": line}
+                    for (function, file, line), _ in frames
+                ]
+            },
+            "profiles": profiles,
+        }
+
+
+_tracemalloc_users = 0
+_tracemalloc_lock = threading.Lock()
+
+
+def _start_tracemalloc():
+    global _tracemalloc_users
+    with _tracemalloc_lock:
+        if _tracemalloc_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        _tracemalloc_users += 1
+        tracemalloc.reset_peak()
+
+
+def _stop_tracemalloc():
+    global _tracemalloc_users
+    with _tracemalloc_lock:
+        _tracemalloc_users -= 1
+        if _tracemalloc_users == 0:
+            tracemalloc.stop()
+
+
+def peak_rss_mb():
+    """
+    Get the peak resident memory of the current process.
+
+    Returns:
+    float: Peak RSS in MiB, None where the resource module is unavailable.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / 1024
+
+
+def memory_report(snapshot, top=20):
+    """
+    Summarize the memory of a profiled run.
+
+    Parameters:
+    snapshot (tracemalloc.Snapshot): Allocations alive at the end of the run.
+    top (int): Number of allocation sites to report.
+
+    Returns:
+    dict: Peak and current traced memory, peak RSS of the process and the largest allocation sites.
+    """
+    current, peak = tracemalloc.get_traced_memory()
+    return {
+        "traced_peak_mb": round(peak / (1 << 20), 3),
+        "traced_current_mb": round(current / (1 << 20), 3),
+        "process_peak_rss_mb": peak_rss_mb(),
+        "top_allocations": [
+            {
+                "location": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                "size_mb": round(stat.size / (1 << 20), 3),
+                "count": stat.count,
+            }
+            for stat in snapshot.statistics("lineno")[:top]
+        ],
+    }
+
+
+@contextmanager
+def profiled(output_dir, mode=None, interval=0.005):
+    """
+    Profile a block of code and write the profile and a memory high-water
+    report to a directory.
+
+    The sampling profiler covers every thread, e.g. the workers of the engine
+    and the threads of the tile reads; cProfile only sees the thread entering
+    the block and cannot run twice at the same time in a process, so it is
+    kept for jobs, which each have their own process. Other jobs or requests
+    running at the same time in the process show up in the samples and in the
+    memory peak.
+
+    Parameters:
+    output_dir (str): Directory the files are written to.
+    mode (str): One of PROFILE_MODES, None runs the block without profiling.
+    interval (float): Seconds between samples of the sampling profiler.
+
+    Returns:
+    list: Names of the written files, filled when the block exits.
+    """
+    written = []
+    if mode is None:
+        yield written
+        return
+    if mode not in PROFILE_MODES:
+        raise ValueError(
+            f"Invalid profile mode {mode}. Choose from {', '.join(PROFILE_MODES)}"
+        )
+    _start_tracemalloc()
+    if mode == "sample":
+        profiler = SamplingProfiler(interval).start()
+    else:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        yield written
+    finally:
+        if mode == "sample":
+            profiler.stop()
+        else:
+            profiler.disable()
+        snapshot = tracemalloc.take_snapshot()
+        report = memory_report(snapshot)
+        _stop_tracemalloc()
+
+        os.makedirs(output_dir, exist_ok=True)
+        if mode == "sample":
+            with open(os.path.join(output_dir, SPEEDSCOPE_FILE_NAME), "w") as file:
+                json.dump(profiler.speedscope(os.path.basename(output_dir)), file)
+            written.append(SPEEDSCOPE_FILE_NAME)
+        else:
+            profiler.dump_stats(os.path.join(output_dir, PSTATS_FILE_NAME))
+            text = io.StringIO()
+            pstats.Stats(profiler, stream=text).sort_stats("cumulative").print_stats(50)
+            with open(os.path.join(output_dir, PSTATS_TEXT_FILE_NAME), "w") as file:
+                file.write(text.getvalue())
+            written.extend([PSTATS_FILE_NAME, PSTATS_TEXT_FILE_NAME])
+        with open(os.path.join(output_dir, MEMORY_FILE_NAME), "w") as file:
+            json.dump(report, file, indent=2)
+        written.append(MEMORY_FILE_NAME)
@@ -0,0 +1,313 @@
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from contextvars import ContextVar
+
+LOG_FILE_NAME = "runtime.log"
+EVENTS_FILE_NAME = "events.jsonl"
+
+_current_channel = ContextVar("virtughan_progress_channel", default=None)
+
+
+class ConsoleChannel:
+    """
+    Channel used when no job channel is active, printing logs and dropping events.
+    """
+
+    stream = None
+
+    def log(self, message):
+        """
+        Print a log message.
+
+        Parameters:
+        message (str): Message to log.
+        """
+        print(message)
+
+    def emit(self, event, **fields):
+        """
+        Ignore a progress event.
+
+        Parameters:
+        event (str): Event type.
+        **fields: Event payload.
+        """
+
+
+class _ChannelStream:
+    """
+    File-like adapter turning writes (e.g. from tqdm) into channel log lines.
+    """
+
+    def __init__(self, channel):
+        self.channel = channel
+
+    def write(self, text):
+        for line in text.replace("\r", "\n").split("\n"):
+            line = line.strip()
+            if line:
+                self.channel.log(line)
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+class ProgressChannel:
+    """
+    Per-job log and progress channel writing to the job directory from a background thread.
+
+    Log lines go to runtime.log, and every log line and progress event goes to
+    events.jsonl as one JSON object per line so clients can follow the job without
+    parsing the log text.
+    """
+
+    def __init__(self, output_dir, flush_interval=0.5):
+        """
+        Initialize the ProgressChannel.
+
+        Parameters:
+        output_dir (str): Job directory to write the log and event files to.
+        flush_interval (float): Maximum seconds buffered records wait before being written.
+        """
+        self.output_dir = output_dir
+        self.log_path = os.path.join(output_dir, LOG_FILE_NAME)
+        self.events_path = os.path.join(output_dir, EVENTS_FILE_NAME)
+        self.flush_interval = flush_interval
+        self.stream = _ChannelStream(self)
+        self._listeners = []
+        self._queue = queue.SimpleQueue()
+        self._closed = threading.Event()
+        self._thread = None
+        self._token = None
+
+    def add_listener(self, listener):
+        """
+        Register a callable receiving every event dict, called from the writer thread.
+
+        Parameters:
+        listener (callable): Function taking the event dict.
+        """
+        self._listeners.append(listener)
+
+    def log(self, message):
+        """
+        Log a message.
+
+        Parameters:
+        message (str): Message to log.
+        """
+        self._queue.put({"time": time.time(), "type": "log", "message": str(message)})
+
+    def emit(self, event, **fields):
+        """
+        Emit a machine readable progress event.
+
+        Parameters:
+        event (str): Event type.
+        **fields: JSON serializable event payload.
+        """
+        self._queue.put({"time": time.time(), "type": event, **fields})
+
+    def open(self):
+        """
+        Start the writer thread and make this the current channel.
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        for path in (self.log_path, self.events_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self._closed.clear()
+        self._thread = threading.Thread(target=self._write_loop, daemon=True)
+        self._thread.start()
+        self._token = _current_channel.set(self)
+        return self
+
+    def close(self):
+        """
+        Flush pending records, stop the writer thread and restore the previous channel.
+        """
+        if self._token is not None:
+            _current_channel.reset(self._token)
+            self._token = None
+        self._closed.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _drain(self):
+        records = []
+        while True:
+            try:
+                records.append(self._queue.get_nowait())
+            except queue.Empty:
+                return records
+
+    def _write_loop(self):
+        with open(self.log_path, "a") as log_file, open(
+            self.events_path, "a"
+        ) as events_file:
+            while True:
+                closed = self._closed.wait(self.flush_interval)
+                records = self._drain()
+                if records:
+                    log_file.writelines(
+                        record["message"] + "\n"
+                        for record in records
+                        if record["type"] == "log"
+                    )
+                    events_file.writelines(
+                        json.dumps(record) + "\n" for record in records
+                    )
+                    log_file.flush()
+                    events_file.flush()
+                    for record in records:
+                        for listener in self._listeners:
+                            try:
+                                listener(record)
+                            except Exception as e:
+                                print(f"Progress listener error: {e}", file=sys.stderr)
+                if closed:
+                    return
+
+
+class ProgressTracker:
+    """
+    Counts processed items and bytes read, emitting progress events with an ETA.
+    """
+
+    def __init__(self, channel, event="scene_processed"):
+        """
+        Initialize the ProgressTracker.
+
+        Parameters:
+        channel (ProgressChannel): Channel to emit the events to.
+        event (str): Event type emitted for every processed item.
+        """
+        self.channel = channel
+        self.event = event
+        self.total = 0
+        self.done = 0
+        self.bytes_read = 0
+        self._started = None
+        self._lock = threading.Lock()
+
+    def start(self, total):
+        """
+        Reset the counters for a new run.
+
+        Parameters:
+        total (int): Number of items to process.
+        """
+        with self._lock:
+            self.total = total
+            self.done = 0
+            self.bytes_read = 0
+            self._started = time.monotonic()
+
+    def add_bytes(self, nbytes):
+        """
+        Count bytes read, safe to call from worker threads.
+
+        Parameters:
+        nbytes (int): Number of bytes read.
+        """
+        with self._lock:
+            self.bytes_read += nbytes
+
+    def advance(self, **fields):
+        """
+        Mark one item as processed and emit a progress event.
+
+        Parameters:
+        **fields: Extra JSON serializable event payload.
+        """
+        with self._lock:
+            self.done += 1
+            elapsed = time.monotonic() - self._started
+            remaining = self.total - self.done
+            eta = elapsed / self.done * remaining if remaining > 0 else 0.0
+            event = {
+                "done": self.done,
+                "total": self.total,
+                "bytes_read": self.bytes_read,
+                "elapsed": round(elapsed, 3),
+                "eta": round(eta, 3),
+            }
+        self.channel.emit(self.event, **event, **fields)
+
+
+_console_channel = ConsoleChannel()
+
+
+def get_channel():
+    """
+    Get the progress channel of the current context.
+
+    Returns:
+    ProgressChannel: Active job channel, or a console channel if none is active.
+    """
+    return _current_channel.get() or _console_channel
+
+
+def read_events(output_dir, offset=0):
+    """
+    Read complete event records appended to a job event file after an offset.
+
+    Parameters:
+    output_dir (str): Job directory holding the event file.
+    offset (int): Byte offset to start reading from.
+
+    Returns:
+    tuple: List of (end offset, event dict) pairs and the offset to continue from.
+    """
+    events_path = os.path.join(output_dir, EVENTS_FILE_NAME)
+    if not os.path.exists(events_path):
+        return [], offset
+    events = []
+    with open(events_path, "rb") as f:
+        f.seek(offset)
+        for line in f:
+            # a partially written record is picked up on the next read
+            if not line.endswith(b"\n"):
+                break
+            offset += len(line)
+            events.append((offset, json.loads(line)))
+    return events, offset
+
+
+def tail_log(output_dir, lines=30, block_size=8192):
+    """
+    Read the last lines of a job log without reading the whole file.
+
+    Parameters:
+    output_dir (str): Job directory holding the log file.
+    lines (int): Number of lines to return.
+    block_size (int): Number of bytes read per backwards step.
+
+    Returns:
+    list: Last log lines, or None if the log file does not exist.
+    """
+    log_path = os.path.join(output_dir, LOG_FILE_NAME)
+    if not os.path.exists(log_path):
+        return None
+    with open(log_path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        data = b""
+        while position > 0 and data.count(b"\n") <= lines:
+            step = min(block_size, position)
+            position -= step
+            f.seek(position)
+            data = f.read(step) + data
+    return data.decode("utf-8", errors="replace").splitlines()[-lines:]
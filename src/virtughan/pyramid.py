@@ -0,0 +1,253 @@
+import math
+import os
+import sqlite3
+import threading
+
+import mercantile
+import numpy as np
+from rasterio.transform import Affine, array_bounds
+from rasterio.warp import Resampling, reproject, transform_bounds
+
+from .resample import block_average
+
+WEB_MERCATOR_EXTENT = 2 * math.pi * 6378137
+
+
+class MBTilesStore:
+    """
+    Tile pyramid stored in an MBTiles file, the SQLite layout read by most map tools.
+    """
+
+    def __init__(self, path, readonly=False):
+        """
+        Initialize the MBTilesStore, creating the file when it is writable.
+
+        Parameters:
+        path (str): Path to the .mbtiles file.
+        readonly (bool): Whether to open an existing file for reading only.
+        """
+        self.path = path
+        self.readonly = readonly
+        if readonly:
+            if not os.path.exists(path):
+                raise FileNotFoundError(path)
+            self._conn = sqlite3.connect(
+                f"file:{path}?mode=ro", uri=True, check_same_thread=False
+            )
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT);
+                CREATE TABLE IF NOT EXISTS tiles (
+                    zoom_level INTEGER,
+                    tile_column INTEGER,
+                    tile_row INTEGER,
+                    tile_data BLOB,
+                    PRIMARY KEY (zoom_level, tile_column, tile_row)
+                );
+                """)
+        self._lock = threading.Lock()
+
+    def set_metadata(self, **metadata):
+        """
+        Set metadata values, e.g. name, format, bounds, minzoom and maxzoom.
+
+        Parameters:
+        **metadata: Metadata values, lists are stored comma separated.
+        """
+        rows = [
+            (
+                name,
+                (
+                    ",".join(map(str, value))
+                    if isinstance(value, (list, tuple))
+                    else str(value)
+                ),
+            )
+            for name, value in metadata.items()
+            if value is not None
+        ]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO metadata (name, value) VALUES (?, ?)", rows
+            )
+
+    def metadata(self):
+        """
+        Get the metadata values.
+
+        Returns:
+        dict: Metadata values as strings.
+        """
+        with self._lock:
+            return dict(self._conn.execute("SELECT name, value FROM metadata"))
+
+    def put(self, z, x, y, data):
+        """
+        Store a tile.
+
+        Parameters:
+        z (int): Zoom level of the tile.
+        x (int): X coordinate of the tile.
+        y (int): Y coordinate of the tile, in XYZ order.
+        data (bytes): Encoded tile.
+        """
+        self.put_many([((z, x, y), data)])
+
+    def put_many(self, tiles):
+        """
+        Store tiles in a single transaction.
+
+        Parameters:
+        tiles (iterable): ((z, x, y), data) pairs, y in XYZ order.
+        """
+        # MBTiles rows are numbered from the south (TMS)
+        rows = [(z, x, (1 << z) - 1 - y, data) for (z, x, y), data in tiles]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO tiles (zoom_level, tile_column, tile_row, tile_data) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+
+    def get(self, z, x, y):
+        """
+        Get a tile.
+
+        Parameters:
+        z (int): Zoom level of the tile.
+        x (int): X coordinate of the tile.
+        y (int): Y coordinate of the tile, in XYZ order.
+
+        Returns:
+        bytes: Encoded tile or None if missing.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+                (z, x, (1 << z) - 1 - y),
+            ).fetchone()
+        return row[0] if row else None
+
+    def close(self):
+        """
+        Close the file.
+        """
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def write_pyramid(
+    store,
+    data,
+    crs,
+    transform,
+    encode,
+    output_format="png",
+    minzoom=None,
+    maxzoom=None,
+    tilesize=256,
+):
+    """
+    Write an XYZ tile pyramid of a raster to a store.
+
+    The raster is reprojected to Web Mercator once, at the zoom level closest
+    to its native resolution, and every lower zoom level is built from the
+    previous one by averaging 2 x 2 pixel blocks, so the source is never read
+    again.
+
+    Parameters:
+    store (MBTilesStore): Store to write the tiles to.
+    data (numpy.ndarray): Array of shape (bands, height, width), NaN or masked values are nodata.
+    crs (rasterio.crs.CRS): Coordinate reference system of the array.
+    transform (affine.Affine): Geotransform of the array.
+    encode (callable): Function turning a (bands, tilesize, tilesize) float array into encoded tile bytes.
+    output_format (str): Format of the encoded tiles, stored in the metadata.
+    minzoom (int): Lowest zoom level, defaults to the level where the raster fits in one tile.
+    maxzoom (int): Highest zoom level, defaults to the level closest to the native resolution.
+    tilesize (int): Width and height of a tile in pixels.
+
+    Returns:
+    tuple: Lowest and highest zoom level written.
+    """
+    data = np.ma.filled(np.ma.asarray(data, dtype=np.float32), np.nan)
+    bands, height, width = data.shape
+    west, south, east, north = transform_bounds(
+        crs, "EPSG:4326", *array_bounds(height, width, transform)
+    )
+    if maxzoom is None:
+        left, bottom, right, top = transform_bounds(
+            crs, "EPSG:3857", *array_bounds(height, width, transform)
+        )
+        resolution = min((right - left) / width, (top - bottom) / height)
+        maxzoom = max(
+            0, min(22, round(math.log2(WEB_MERCATOR_EXTENT / (tilesize * resolution))))
+        )
+
+    first = mercantile.tile(west, north, maxzoom)
+    last = mercantile.tile(east, south, maxzoom)
+    tile_x, tile_y = first.x, first.y
+    columns, rows = last.x - first.x + 1, last.y - first.y + 1
+    resolution = WEB_MERCATOR_EXTENT / (tilesize * 2**maxzoom)
+    origin = mercantile.xy_bounds(first)
+    mosaic = np.full((bands, rows * tilesize, columns * tilesize), np.nan, np.float32)
+    reproject(
+        source=data,
+        destination=mosaic,
+        src_transform=transform,
+        src_crs=crs,
+        src_nodata=np.nan,
+        dst_transform=Affine(resolution, 0, origin.left, 0, -resolution, origin.top),
+        dst_crs="EPSG:3857",
+        dst_nodata=np.nan,
+        resampling=Resampling.nearest,
+    )
+
+    zoom = maxzoom
+    while True:
+        tiles = []
+        for row in range(rows):
+            for column in range(columns):
+                tile = mosaic[
+                    :,
+                    row * tilesize : (row + 1) * tilesize,
+                    column * tilesize : (column + 1) * tilesize,
+                ]
+                if np.isfinite(tile).any():
+                    tiles.append(((zoom, tile_x + column, tile_y + row), encode(tile)))
+        store.put_many(tiles)
+        if zoom == 0 or (minzoom is None and columns == rows == 1) or zoom == minzoom:
+            break
+        # pad to whole parent tiles before halving the resolution
+        pad_left, pad_top = tile_x & 1, tile_y & 1
+        pad_right = (pad_left + columns) & 1
+        pad_bottom = (pad_top + rows) & 1
+        mosaic = np.pad(
+            mosaic,
+            (
+                (0, 0),
+                (pad_top * tilesize, pad_bottom * tilesize),
+                (pad_left * tilesize, pad_right * tilesize),
+            ),
+            constant_values=np.nan,
+        )
+        mosaic = block_average(mosaic, 2)
+        columns = (pad_left + columns + pad_right) // 2
+        rows = (pad_top + rows + pad_bottom) // 2
+        tile_x, tile_y = tile_x >> 1, tile_y >> 1
+        zoom -= 1
+
+    store.set_metadata(
+        format=output_format,
+        type="overlay",
+        bounds=[west, south, east, north],
+        center=[(west + east) / 2, (south + north) / 2, zoom],
+        minzoom=zoom,
+        maxzoom=maxzoom,
+    )
+    return zoom, maxzoom
@@ -0,0 +1,180 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+CHUNK_PIXELS = 1 << 16
+
+
+def _count(stack, valid):
+    return valid.sum(axis=0)
+
+
+def _total(stack, valid):
+    return np.where(valid, stack, 0).sum(axis=0)
+
+
+def _sum(stack, valid):
+    total = _total(stack, valid)
+    total[~valid.any(axis=0)] = np.nan
+    return total
+
+
+def _mean(stack, valid):
+    count = valid.sum(axis=0)
+    return np.divide(
+        _total(stack, valid),
+        count,
+        out=np.full(count.shape, np.nan, stack.dtype),
+        where=count > 0,
+    )
+
+
+def _var(stack, valid):
+    deviations = np.where(valid, stack - _mean(stack, valid), 0)
+    count = valid.sum(axis=0)
+    return np.divide(
+        (deviations * deviations).sum(axis=0),
+        count,
+        out=np.full(count.shape, np.nan, stack.dtype),
+        where=count > 0,
+    )
+
+
+def _std(stack, valid):
+    return np.sqrt(_var(stack, valid))
+
+
+def _invalid_to_nan(stack, valid):
+    # infinities are not valid either, fmin, fmax and sort only skip NaN
+    return np.where(valid, stack, np.nan)
+
+
+def _min(stack, valid):
+    return np.fmin.reduce(_invalid_to_nan(stack, valid), axis=0)
+
+
+def _max(stack, valid):
+    return np.fmax.reduce(_invalid_to_nan(stack, valid), axis=0)
+
+
+def _percentile(q):
+    def reduce_percentile(stack, valid):
+        # NaN sorts last, so the valid values of a pixel are its first count values
+        ordered = np.sort(_invalid_to_nan(stack, valid), axis=0)
+        count = valid.sum(axis=0)
+        position = q / 100 * np.maximum(count - 1, 0)
+        lower = np.floor(position).astype(np.intp)
+        upper = np.ceil(position).astype(np.intp)
+        low = np.take_along_axis(ordered, lower[np.newaxis], axis=0)[0]
+        high = np.take_along_axis(ordered, upper[np.newaxis], axis=0)[0]
+        result = low + (high - low) * (position - lower).astype(stack.dtype)
+        result[count == 0] = np.nan
+        return result
+
+    return reduce_percentile
+
+
+REDUCERS = {
+    "mean": _mean,
+    "median": _percentile(50),
+    "max": _max,
+    "min": _min,
+    "std": _std,
+    "sum": _sum,
+    "var": _var,
+    "p10": _percentile(10),
+    "p90": _percentile(90),
+    "count": _count,
+}
+
+
+def stack_frames(frames):
+    """
+    Stack frames into one float array, masked values becoming NaN.
+
+    Parameters:
+    frames (list): Arrays of the same shape, plain or masked.
+
+    Returns:
+    numpy.ndarray: Array of shape (len(frames), *frame shape).
+    """
+    dtype = np.result_type(np.float32, *(np.asarray(frame).dtype for frame in frames))
+    stack = np.empty((len(frames), *np.shape(frames[0])), dtype=dtype)
+    for index, frame in enumerate(frames):
+        stack[index] = np.ma.filled(np.ma.asarray(frame, dtype=dtype), np.nan)
+    return stack
+
+
+def map_chunks(func, pixels, workers=1, chunk_pixels=CHUNK_PIXELS):
+    """
+    Apply a function to chunks of pixel columns of a stack.
+
+    Parameters:
+    func (callable): Function called with the start of each chunk and the chunk, a contiguous array of shape (time, pixels).
+    pixels (numpy.ndarray): Stack of shape (time, pixels).
+    workers (int): Number of threads processing chunks at once.
+    chunk_pixels (int): Number of pixels per chunk.
+    """
+
+    def run(start):
+        func(start, np.ascontiguousarray(pixels[:, start : start + chunk_pixels]))
+
+    starts = range(0, pixels.shape[1], chunk_pixels)
+    if workers > 1 and len(starts) > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(run, starts))
+    else:
+        for start in starts:
+            run(start)
+
+
+def as_stack(data):
+    """
+    Turn a list of frames or an array into a float stack, NaN being nodata.
+
+    Parameters:
+    data (numpy.ndarray or list): Stack of shape (time, ...) or list of frames.
+
+    Returns:
+    numpy.ndarray: Float array of shape (time, ...).
+    """
+    if isinstance(data, (list, tuple)) or np.ma.isMaskedArray(data):
+        return stack_frames(list(data))
+    stack = np.asarray(data)
+    if not np.issubdtype(stack.dtype, np.floating):
+        stack = stack.astype(np.float32)
+    return stack
+
+
+def reduce(data, operation, workers=1, chunk_pixels=CHUNK_PIXELS):
+    """
+    Reduce a stack of frames along its first axis, ignoring NaN and masked values.
+
+    The stack is processed in chunks of pixels, in parallel when workers is
+    above one, so temporary arrays stay small whatever the size of the frames.
+
+    Parameters:
+    data (numpy.ndarray or list): Stack of shape (time, ...) or list of frames.
+    operation (str): Reducer name, one of REDUCERS.
+    workers (int): Number of threads reducing chunks at once.
+    chunk_pixels (int): Number of pixels reduced per chunk.
+
+    Returns:
+    numpy.ndarray: Reduced array of the frame shape, NaN where a pixel has no valid value.
+    """
+    if operation not in REDUCERS:
+        raise ValueError(
+            f"Invalid operation {operation}. Choose from {', '.join(REDUCERS)}"
+        )
+    reducer = REDUCERS[operation]
+    stack = as_stack(data)
+    frame_shape = stack.shape[1:]
+    pixels = stack.reshape(stack.shape[0], -1)
+    dtype = np.float32 if operation == "count" else stack.dtype
+    result = np.empty(pixels.shape[1], dtype=dtype)
+
+    def reduce_chunk(start, chunk):
+        result[start : start + chunk.shape[1]] = reducer(chunk, np.isfinite(chunk))
+
+    map_chunks(reduce_chunk, pixels, workers, chunk_pixels)
+    return result.reshape(frame_shape)
@@ -0,0 +1,150 @@
+import functools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+from .colormap import apply_lut
+
+BACKGROUND = (255, 255, 255)
+
+
+@functools.lru_cache(maxsize=None)
+def _font(size):
+    try:
+        return ImageFont.load_default(size=size)
+    except (TypeError, ImportError):
+        # without FreeType only the fixed size bitmap font is available
+        return ImageFont.load_default()
+
+
+def colorize(data, cmap="RdYlGn", vmin=None, vmax=None):
+    """
+    Turn a result array into an RGBA image array.
+
+    Parameters:
+    data (numpy.ndarray): Array of shape (bands, height, width), NaN or masked values are nodata.
+    cmap (str): Colormap applied to single band results.
+    vmin (float): Value mapped to the first color of the colormap.
+    vmax (float): Value mapped to the last color of the colormap.
+
+    Returns:
+    numpy.ndarray: RGBA uint8 array, transparent where there is no data.
+    """
+    data = np.ma.filled(np.ma.asarray(data, dtype=np.float32), np.nan)
+    if data.shape[0] == 1:
+        return apply_lut(data[0], cmap, vmin, vmax)
+    bands = data[:3]
+    valid = np.isfinite(bands).all(axis=0)
+    rgba = np.zeros((*bands.shape[1:], 4), dtype=np.uint8)
+    if valid.any():
+        low, high = np.nanmin(bands), np.nanmax(bands)
+        scaled = (bands - low) / ((high - low) or 1) * 255
+        rgba[..., :3] = np.moveaxis(np.nan_to_num(scaled), 0, -1)
+        rgba[..., 3] = np.where(valid, 255, 0)
+    return rgba
+
+
+def annotate(image, text, max_size=None):
+    """
+    Draw a title band above an image, flattened on a white background.
+
+    Parameters:
+    image (numpy.ndarray or PIL.Image.Image): RGBA image.
+    text (str): Title of the image.
+    max_size (int): Largest width or height of the image before the title, larger images are downscaled.
+
+    Returns:
+    PIL.Image.Image: RGB image with the title.
+    """
+    if isinstance(image, np.ndarray):
+        image = Image.fromarray(image)
+    image = image.convert("RGBA")
+    if max_size and max(image.size) > max_size:
+        scale = max_size / max(image.size)
+        image = image.resize(
+            (
+                max(1, round(image.width * scale)),
+                max(1, round(image.height * scale)),
+            ),
+            Image.Resampling.BOX,
+        )
+    font_size = max(10, image.width // 32)
+    band = font_size * 2
+    canvas = Image.new("RGB", (image.width, image.height + band), BACKGROUND)
+    canvas.paste(image, (0, band), image)
+    ImageDraw.Draw(canvas).text(
+        (image.width / 2, band / 2),
+        text,
+        fill=(0, 0, 0),
+        font=_font(font_size),
+        anchor="mm",
+    )
+    return canvas
+
+
+class FrameRenderer:
+    """
+    Render annotated frames of a timeseries from result arrays, in parallel.
+    """
+
+    def __init__(self, cmap="RdYlGn", vmin=None, vmax=None, workers=1, max_size=None):
+        """
+        Initialize the FrameRenderer.
+
+        Parameters:
+        cmap (str): Colormap applied to single band results.
+        vmin (float): Value mapped to the first color, shared by every frame.
+        vmax (float): Value mapped to the last color, shared by every frame.
+        workers (int): Number of frames rendered at once.
+        max_size (int): Largest width or height of a frame before its title.
+        """
+        self.cmap = cmap
+        self.vmin = vmin
+        self.vmax = vmax
+        self.workers = workers
+        self.max_size = max_size
+
+    def render(self, data, text, output_file=None):
+        """
+        Render one frame.
+
+        Parameters:
+        data (numpy.ndarray): Result array of shape (bands, height, width).
+        text (str): Title of the frame.
+        output_file (str): Path to also save the frame to as PNG.
+
+        Returns:
+        PIL.Image.Image: Annotated RGB frame.
+        """
+        frame = annotate(
+            colorize(data, self.cmap, self.vmin, self.vmax), text, self.max_size
+        )
+        if output_file:
+            frame.save(output_file, format="PNG", compress_level=2)
+        return frame
+
+    def render_all(self, frames):
+        """
+        Render frames in order, a few at a time ahead of the consumer.
+
+        Parameters:
+        frames (iterable): (data, text, output_file) tuples.
+
+        Yields:
+        PIL.Image.Image: Annotated RGB frames, in the order of the input.
+        """
+        if self.workers <= 1:
+            for frame in frames:
+                yield self.render(*frame)
+            return
+        # bound the frames held in memory to twice the number of workers
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = deque()
+            for frame in frames:
+                pending.append(executor.submit(self.render, *frame))
+                if len(pending) >= 2 * self.workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
@@ -0,0 +1,223 @@
+import functools
+
+import numpy as np
+from rasterio.enums import Resampling
+from rasterio.warp import reproject
+
+# grids closer than this fraction of a pixel are considered aligned
+ALIGNMENT_TOLERANCE = 1e-6
+
+
+def block_average(data, factor):
+    """
+    Average factor x factor pixel blocks, ignoring NaN.
+
+    Parameters:
+    data (numpy.ndarray): Array of shape (bands, height, width), height and width multiples of factor.
+    factor (int): Size of the blocks.
+
+    Returns:
+    numpy.ndarray: Array of the height and width divided by factor, NaN where a block has no data.
+    """
+    bands, height, width = data.shape
+    blocks = data.reshape(bands, height // factor, factor, width // factor, factor)
+    valid = np.isfinite(blocks)
+    sums = np.where(valid, blocks, 0).sum(axis=(2, 4))
+    counts = valid.sum(axis=(2, 4))
+    return np.divide(
+        sums, counts, out=np.full(sums.shape, np.nan, sums.dtype), where=counts > 0
+    )
+
+
+def _integer(value):
+    rounded = round(value)
+    return rounded if abs(value - rounded) < ALIGNMENT_TOLERANCE else None
+
+
+class ResamplePlan:
+    """
+    Resampling from one raster grid to another, computed once per pair of grids.
+
+    Grids of the same CRS whose resolutions differ by an integer factor and
+    whose pixel edges line up, such as the 10 m, 20 m and 60 m grids of a
+    Sentinel-2 tile, are resampled by averaging or repeating pixel blocks.
+    Any other pair of grids goes through a rasterio warp.
+    """
+
+    def __init__(
+        self, src_crs, src_transform, src_shape, dst_crs, dst_transform, dst_shape
+    ):
+        """
+        Initialize the ResamplePlan.
+
+        Parameters:
+        src_crs (rasterio.crs.CRS): Coordinate reference system of the source.
+        src_transform (affine.Affine): Geotransform of the source.
+        src_shape (tuple): Height and width of the source.
+        dst_crs (rasterio.crs.CRS): Coordinate reference system of the destination.
+        dst_transform (affine.Affine): Geotransform of the destination.
+        dst_shape (tuple): Height and width of the destination.
+        """
+        self.src_crs = src_crs
+        self.src_transform = src_transform
+        self.src_shape = tuple(src_shape)
+        self.dst_crs = dst_crs
+        self.dst_transform = dst_transform
+        self.dst_shape = tuple(dst_shape)
+        self.kind = "warp"
+        self.factor = 1
+        self.row_off = self.col_off = 0
+
+        rotated = (
+            src_transform.b or src_transform.d or dst_transform.b or dst_transform.d
+        )
+        if src_crs != dst_crs or rotated:
+            return
+        src_x, src_y = src_transform.a, src_transform.e
+        dst_x, dst_y = dst_transform.a, dst_transform.e
+        down = _integer(dst_x / src_x)
+        up = _integer(src_x / dst_x)
+        if down and down == _integer(dst_y / src_y):
+            # destination origin in source pixels
+            col_off = _integer((dst_transform.c - src_transform.c) / src_x)
+            row_off = _integer((dst_transform.f - src_transform.f) / src_y)
+            if col_off is not None and row_off is not None:
+                self.kind = "identity" if down == 1 else "average"
+                self.factor, self.row_off, self.col_off = down, row_off, col_off
+        elif up and up == _integer(src_y / dst_y):
+            # source origin in destination pixels
+            col_off = _integer((src_transform.c - dst_transform.c) / dst_x)
+            row_off = _integer((src_transform.f - dst_transform.f) / dst_y)
+            if col_off is not None and row_off is not None:
+                self.kind = "repeat"
+                self.factor, self.row_off, self.col_off = up, row_off, col_off
+                # source pixel of every destination row and column
+                rows = (np.arange(self.dst_shape[0]) - row_off) // up
+                columns = (np.arange(self.dst_shape[1]) - col_off) // up
+                self._outside_rows = (rows < 0) | (rows >= self.src_shape[0])
+                self._outside_columns = (columns < 0) | (columns >= self.src_shape[1])
+                self._rows = rows.clip(0, self.src_shape[0] - 1)
+                self._columns = columns.clip(0, self.src_shape[1] - 1)
+
+    def _crop(self, data, row_off, col_off, height, width):
+        """
+        Get rows row_off to row_off + height and matching columns of data, NaN outside of it.
+        """
+        bands, data_height, data_width = data.shape
+        if (
+            row_off >= 0
+            and col_off >= 0
+            and row_off + height <= data_height
+            and col_off + width <= data_width
+        ):
+            return data[:, row_off : row_off + height, col_off : col_off + width]
+        out = np.full((bands, height, width), np.nan, data.dtype)
+        top, left = max(row_off, 0), max(col_off, 0)
+        bottom = min(row_off + height, data_height)
+        right = min(col_off + width, data_width)
+        if bottom > top and right > left:
+            out[
+                :, top - row_off : bottom - row_off, left - col_off : right - col_off
+            ] = data[:, top:bottom, left:right]
+        return out
+
+    def apply(self, data, resampling=Resampling.bilinear):
+        """
+        Resample an array from the source grid to the destination grid.
+
+        Parameters:
+        data (numpy.ndarray): Array of shape (bands, *src_shape) or src_shape, NaN being nodata.
+        resampling (rasterio.enums.Resampling): Resampling of the general warp.
+
+        Returns:
+        numpy.ndarray: Float array of shape (bands, *dst_shape) or dst_shape.
+        """
+        single = data.ndim == 2
+        data = np.asarray(data, dtype=np.result_type(data.dtype, np.float32))
+        if single:
+            data = data[np.newaxis]
+        height, width = self.dst_shape
+        if self.kind in ("identity", "average"):
+            factor = self.factor
+            result = self._crop(
+                data, self.row_off, self.col_off, height * factor, width * factor
+            )
+            if factor > 1:
+                result = block_average(result, factor)
+        elif self.kind == "repeat":
+            result = data.take(self._rows, axis=1).take(self._columns, axis=2)
+            if self._outside_rows.any() or self._outside_columns.any():
+                result[:, self._outside_rows] = np.nan
+                result[:, :, self._outside_columns] = np.nan
+        else:
+            result = np.full((data.shape[0], height, width), np.nan, data.dtype)
+            reproject(
+                source=data,
+                destination=result,
+                src_transform=self.src_transform,
+                src_crs=self.src_crs,
+                src_nodata=np.nan,
+                dst_transform=self.dst_transform,
+                dst_crs=self.dst_crs,
+                dst_nodata=np.nan,
+                resampling=resampling,
+            )
+        return result[0] if single else result
+
+
+@functools.lru_cache(maxsize=256)
+def resampling_plan(
+    src_crs, src_transform, src_shape, dst_crs, dst_transform, dst_shape
+):
+    """
+    Get the resampling plan between two grids, computed once per pair of grids.
+
+    Parameters:
+    src_crs (rasterio.crs.CRS): Coordinate reference system of the source.
+    src_transform (affine.Affine): Geotransform of the source.
+    src_shape (tuple): Height and width of the source.
+    dst_crs (rasterio.crs.CRS): Coordinate reference system of the destination.
+    dst_transform (affine.Affine): Geotransform of the destination.
+    dst_shape (tuple): Height and width of the destination.
+
+    Returns:
+    ResamplePlan: Plan to resample arrays of the source grid.
+    """
+    return ResamplePlan(
+        src_crs, src_transform, src_shape, dst_crs, dst_transform, dst_shape
+    )
+
+
+def resample(
+    data,
+    src_crs,
+    src_transform,
+    dst_crs,
+    dst_transform,
+    dst_shape,
+    resampling=Resampling.bilinear,
+):
+    """
+    Resample an array to another grid, e.g. a 20 m band to the 10 m grid of a scene.
+
+    Parameters:
+    data (numpy.ndarray): Array of shape (bands, height, width) or (height, width), NaN being nodata.
+    src_crs (rasterio.crs.CRS): Coordinate reference system of the array.
+    src_transform (affine.Affine): Geotransform of the array.
+    dst_crs (rasterio.crs.CRS): Coordinate reference system of the destination.
+    dst_transform (affine.Affine): Geotransform of the destination.
+    dst_shape (tuple): Height and width of the destination.
+    resampling (rasterio.enums.Resampling): Resampling used when the grids are not aligned.
+
+    Returns:
+    numpy.ndarray: Float array on the destination grid.
+    """
+    plan = resampling_plan(
+        src_crs,
+        src_transform,
+        tuple(data.shape[-2:]),
+        dst_crs,
+        dst_transform,
+        tuple(dst_shape),
+    )
+    return plan.apply(data, resampling)
@@ -0,0 +1,231 @@
+import argparse
+import asyncio
+import sys
+from datetime import datetime, timedelta
+
+import mercantile
+from fastapi import HTTPException
+from tqdm import tqdm
+
+from .cache import MemoryCache
+from .colormap import parse_rescale
+from .progress import get_channel
+from .pyramid import MBTilesStore
+from .tile import TILE_FORMATS, TileProcessor
+
+
+def seed_tile_list(bbox, minzoom, maxzoom, metatile=1):
+    """
+    List the tiles of a bounding box and zoom range in seeding order.
+
+    Tiles of the same metatile block are listed next to each other so that
+    concurrent workers share the render of the block.
+
+    Parameters:
+    bbox (list): Bounding box coordinates [min_lon, min_lat, max_lon, max_lat].
+    minzoom (int): Lowest zoom level to seed.
+    maxzoom (int): Highest zoom level to seed.
+    metatile (int): Metatile size of the tile processor.
+
+    Returns:
+    list: mercantile.Tile objects.
+    """
+    shift = metatile.bit_length() - 1
+    tiles = mercantile.tiles(*bbox, zooms=range(minzoom, maxzoom + 1))
+    return sorted(tiles, key=lambda t: (t.z, t.y >> shift, t.x >> shift, t.y, t.x))
+
+
+async def seed_tiles(
+    tile_processor,
+    bbox,
+    minzoom,
+    maxzoom,
+    start_date,
+    end_date,
+    cloud_cover,
+    band1,
+    band2,
+    formula,
+    colormap_str="RdYlGn",
+    latest=True,
+    operation="median",
+    output_format="png",
+    rescale=None,
+    store=None,
+    concurrency=8,
+):
+    """
+    Render every tile of a bounding box and zoom range into the tile cache,
+    and optionally into a pyramid store.
+
+    Parameters:
+    tile_processor (TileProcessor): Processor rendering and caching the tiles.
+    bbox (list): Bounding box coordinates [min_lon, min_lat, max_lon, max_lat].
+    minzoom (int): Lowest zoom level to seed.
+    maxzoom (int): Highest zoom level to seed.
+    start_date (str): Start date for the data extraction (YYYY-MM-DD).
+    end_date (str): End date for the data extraction (YYYY-MM-DD).
+    cloud_cover (int): Maximum allowed cloud cover percentage.
+    band1 (str): First band for the formula.
+    band2 (str): Second band for the formula.
+    formula (str): Formula to apply to the bands.
+    colormap_str (str): Name of the colormap to apply.
+    latest (bool): Whether to use the latest image.
+    operation (str): Operation to apply to the time series.
+    output_format (str): Encoding of the tiles, one of TILE_FORMATS.
+    rescale (tuple): Range mapped to the colormap, None for the default range.
+    store (MBTilesStore): Pyramid to write the tiles to.
+    concurrency (int): Number of tiles rendered at once.
+
+    Returns:
+    dict: Number of rendered, empty and failed tiles.
+    """
+    channel = get_channel()
+    tiles = seed_tile_list(bbox, minzoom, maxzoom, tile_processor.metatile)
+    channel.log(f"Seeding {len(tiles)} tiles from zoom {minzoom} to {maxzoom}")
+    counts = {"rendered": 0, "empty": 0, "failed": 0}
+    pending = iter(tiles)
+    batch = []
+    progress_bar = tqdm(
+        total=len(tiles), desc="Seeding tiles", file=channel.stream or sys.stdout
+    )
+
+    async def worker():
+        for tile in pending:
+            try:
+                image_bytes, _ = await tile_processor.cached_generate_tile(
+                    tile.x,
+                    tile.y,
+                    tile.z,
+                    start_date,
+                    end_date,
+                    cloud_cover,
+                    band1,
+                    band2,
+                    formula,
+                    colormap_str,
+                    latest=latest,
+                    operation=operation,
+                    output_format=output_format,
+                    rescale=rescale,
+                )
+            except HTTPException as e:
+                if e.status_code == 404:
+                    counts["empty"] += 1
+                else:
+                    counts["failed"] += 1
+                    channel.log(f"Failed to seed tile {tuple(tile)}: {e.detail}")
+            except Exception as e:
+                counts["failed"] += 1
+                channel.log(f"Failed to seed tile {tuple(tile)}: {e}")
+            else:
+                counts["rendered"] += 1
+                if store is not None:
+                    batch.append(((tile.z, tile.x, tile.y), image_bytes))
+                    # write in batches, one transaction per tile is slow
+                    if len(batch) >= 256:
+                        rows = batch[:]
+                        batch.clear()
+                        await asyncio.to_thread(store.put_many, rows)
+            progress_bar.update(1)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    progress_bar.close()
+
+    if store is not None:
+        store.put_many(batch)
+        store.set_metadata(
+            name=formula,
+            format=output_format,
+            type="overlay",
+            bounds=bbox,
+            minzoom=minzoom,
+            maxzoom=maxzoom,
+            description=f"{formula} from {start_date} to {end_date}, cloud cover < {cloud_cover}%",
+        )
+    channel.log(
+        f"Seeded {counts['rendered']} tiles, {counts['empty']} without images, {counts['failed']} failed"
+    )
+    return counts
+
+
+def main(argv=None):
+    """
+    Seed tiles from the command line, e.g.
+
+    python -m virtughan.seed --bbox 83.84,28.22,83.93,28.30 --zoom 10-14 --mbtiles ndvi.mbtiles
+    """
+    parser = argparse.ArgumentParser(
+        description="Pre-render the tiles of an area into the tile cache or an MBTiles file."
+    )
+    parser.add_argument("--bbox", required=True, help="west,south,east,north")
+    parser.add_argument(
+        "--zoom", default="10-14", help="Zoom level or range, e.g. 12 or 10-14"
+    )
+    parser.add_argument(
+        "--start-date",
+        default=(datetime.now() - timedelta(days=365)).strftime("%Y-%m-%d"),
+    )
+    parser.add_argument("--end-date", default=datetime.now().strftime("%Y-%m-%d"))
+    parser.add_argument("--cloud-cover", type=int, default=30)
+    parser.add_argument("--band1", default="red")
+    parser.add_argument("--band2", default="nir")
+    parser.add_argument("--formula", default="(band2-band1)/(band2+band1)")
+    parser.add_argument("--colormap", default="RdYlGn")
+    parser.add_argument(
+        "--timeseries",
+        action="store_true",
+        help="Aggregate the time series instead of using the latest image",
+    )
+    parser.add_argument("--operation", default="median")
+    parser.add_argument("--format", default="png", choices=sorted(TILE_FORMATS))
+    parser.add_argument("--rescale", help="min,max")
+    parser.add_argument("--mbtiles", help="MBTiles file to write the tiles to")
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args(argv)
+
+    bbox = [float(value) for value in args.bbox.split(",")]
+    minzoom, _, maxzoom = args.zoom.partition("-")
+    minzoom, maxzoom = int(minzoom), int(maxzoom or minzoom)
+
+    # seeded tiles must be complete, so they are never rendered progressively
+    tile_processor = TileProcessor.from_env(progressive_scenes=None)
+    if (
+        all(isinstance(tier, MemoryCache) for tier in tile_processor.cache.tiers)
+        and not args.mbtiles
+    ):
+        parser.error(
+            "nothing would outlive this process, set TILE_CACHE_DIR or TILE_CACHE_REDIS_URL to seed the shared tile cache, or pass --mbtiles"
+        )
+
+    store = MBTilesStore(args.mbtiles) if args.mbtiles else None
+    try:
+        counts = asyncio.run(
+            seed_tiles(
+                tile_processor,
+                bbox,
+                minzoom,
+                maxzoom,
+                args.start_date,
+                args.end_date,
+                args.cloud_cover,
+                args.band1,
+                args.band2 or None,
+                args.formula,
+                colormap_str=args.colormap,
+                latest=not args.timeseries,
+                operation=args.operation,
+                output_format=args.format,
+                rescale=parse_rescale(args.rescale),
+                store=store,
+                concurrency=args.concurrency,
+            )
+        )
+    finally:
+        if store is not None:
+            store.close()
+    return 1 if counts["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,46 @@
+import asyncio
+
+
+class SingleFlight:
+    """
+    Deduplicate concurrent calls sharing a key into a single in-flight task.
+    """
+
+    def __init__(self):
+        """
+        Initialize the SingleFlight.
+        """
+        self._inflight = {}
+
+    def __len__(self):
+        return len(self._inflight)
+
+    async def do(self, key, func, *args, **kwargs):
+        """
+        Await the in-flight call for a key, starting it if there is none.
+
+        Every caller of the same key gets the same result or exception. A caller
+        being cancelled does not cancel the shared call for the others.
+
+        Parameters:
+        key (hashable): Key identifying identical calls.
+        func (callable): Coroutine function to call.
+        *args: Positional arguments for func.
+        **kwargs: Keyword arguments for func.
+
+        Returns:
+        Any: Result of the call.
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func(*args, **kwargs))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            # mark the exception as retrieved when every caller went away
+            task.exception()
@@ -0,0 +1,195 @@
+from datetime import date, datetime
+
+import numpy as np
+
+from .reducers import CHUNK_PIXELS, REDUCERS, as_stack, map_chunks
+
+TEMPORAL_STATS = (
+    "slope",
+    "intercept",
+    "theil_sen_slope",
+    "theil_sen_intercept",
+    "time_of_max",
+    "time_of_min",
+    "amplitude",
+    "anomaly",
+)
+DEFAULT_TEMPORAL_STATS = ("slope", "intercept", "time_of_max", "time_of_min")
+
+_median = REDUCERS["median"]
+
+
+def parse_date(value):
+    """
+    Parse a date written as YYYY-MM-DD or YYYYMMDD, e.g. from a scene id.
+
+    Parameters:
+    value (str or datetime.date): Date to parse.
+
+    Returns:
+    datetime.date: Parsed date.
+    """
+    if isinstance(value, date):
+        return value
+    for fmt in ("%Y-%m-%d", "%Y%m%d"):
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            pass
+    raise ValueError(f"Invalid date {value}, expected YYYY-MM-DD")
+
+
+def parse_temporal_stats(value):
+    """
+    Parse a comma separated list of temporal statistics.
+
+    Parameters:
+    value (str): Statistics, e.g. "slope,anomaly".
+
+    Returns:
+    tuple: Statistic names, or None if value is empty.
+    """
+    if not value:
+        return None
+    stats = tuple(stat.strip() for stat in value.split(",") if stat.strip())
+    for stat in stats:
+        if stat not in TEMPORAL_STATS:
+            raise ValueError(
+                f"Invalid temporal statistic {stat}. Choose from {', '.join(TEMPORAL_STATS)}"
+            )
+    return stats
+
+
+def parse_baseline(value):
+    """
+    Parse a baseline period.
+
+    Parameters:
+    value (str): Period as "start,end", e.g. "2020-01-01,2022-12-31".
+
+    Returns:
+    tuple: Start and end dates as YYYY-MM-DD strings, or None if value is empty.
+    """
+    if not value:
+        return None
+    start, end = (parse_date(bound.strip()) for bound in value.split(","))
+    if start > end:
+        raise ValueError(f"Invalid baseline {value}, start must not be after end")
+    return start.isoformat(), end.isoformat()
+
+
+def _linear_trend(chunk, valid, times):
+    count = valid.sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_time = np.where(valid, times[:, np.newaxis], 0).sum(axis=0) / count
+        mean_value = np.where(valid, chunk, 0).sum(axis=0) / count
+        # centering the times keeps the sums small and the fit stable
+        deviations = np.where(valid, times[:, np.newaxis] - mean_time, 0)
+        sxx = (deviations * deviations).sum(axis=0)
+        sxy = (deviations * np.where(valid, chunk, 0)).sum(axis=0)
+        slope = np.where(sxx > 0, sxy / sxx, np.nan)
+    return slope, mean_value - slope * mean_time
+
+
+def _theil_sen(chunk, valid, times, pairs):
+    first, second = pairs
+    with np.errstate(invalid="ignore", divide="ignore"):
+        slopes = (chunk[second] - chunk[first]) / (times[second] - times[first])[
+            :, np.newaxis
+        ].astype(chunk.dtype)
+    slopes[~np.isfinite(slopes)] = np.nan
+    slope = _median(slopes, np.isfinite(slopes))
+    residuals = chunk - slope * times[:, np.newaxis].astype(chunk.dtype)
+    intercept = _median(residuals, np.isfinite(residuals))
+    return slope, intercept
+
+
+def temporal_stats(
+    data,
+    dates,
+    stats=DEFAULT_TEMPORAL_STATS,
+    baseline=None,
+    workers=1,
+    chunk_pixels=CHUNK_PIXELS,
+):
+    """
+    Compute per pixel statistics of a time series in a single pass over the stack.
+
+    Available statistics:
+    slope, intercept: least squares trend, in units per year and value at the first date.
+    theil_sen_slope, theil_sen_intercept: median of the pairwise slopes, robust to outliers such as missed clouds.
+    time_of_max, time_of_min: day of year of the highest and lowest value.
+    amplitude: difference between the highest and lowest value.
+    anomaly: mean of the dates outside the baseline period minus the mean of the baseline period.
+
+    Parameters:
+    data (numpy.ndarray or list): Stack of shape (time, ...) or list of frames, NaN or masked values are nodata.
+    dates (list): Date of each frame, as dates or YYYY-MM-DD / YYYYMMDD strings.
+    stats (tuple): Statistics to compute, from TEMPORAL_STATS.
+    baseline (tuple): Start and end date of the baseline period, required for the anomaly.
+    workers (int): Number of threads processing chunks at once.
+    chunk_pixels (int): Number of pixels processed per chunk.
+
+    Returns:
+    dict: Statistic name to array of the frame shape, NaN where a pixel has too few valid values.
+    """
+    for stat in stats:
+        if stat not in TEMPORAL_STATS:
+            raise ValueError(
+                f"Invalid temporal statistic {stat}. Choose from {', '.join(TEMPORAL_STATS)}"
+            )
+    if "anomaly" in stats and not baseline:
+        raise ValueError("A baseline period is required for the anomaly")
+
+    stack = as_stack(data)
+    if len(dates) != stack.shape[0]:
+        raise ValueError(f"Got {len(dates)} dates for {stack.shape[0]} frames")
+    dates = [parse_date(value) for value in dates]
+    first = min(dates)
+    times = np.array([(value - first).days / 365.25 for value in dates])
+    day_of_year = np.array([value.timetuple().tm_yday for value in dates], np.float32)
+    if baseline:
+        start, end = (parse_date(value) for value in baseline)
+        in_baseline = np.array([start <= value <= end for value in dates])
+
+    frame_shape = stack.shape[1:]
+    pixels = stack.reshape(stack.shape[0], -1)
+    results = {stat: np.empty(pixels.shape[1], np.float32) for stat in stats}
+    wanted = set(stats)
+
+    theil_sen = wanted & {"theil_sen_slope", "theil_sen_intercept"}
+    if theil_sen:
+        pairs = np.triu_indices(len(dates), 1)
+        # the pairwise slopes hold one row per pair of dates, keep them as large as a plain chunk
+        chunk_pixels = max(256, chunk_pixels * len(dates) // max(len(pairs[0]), 1))
+
+    def compute_chunk(start, chunk):
+        valid = np.isfinite(chunk)
+        found = valid.any(axis=0)
+        out = {}
+        if wanted & {"slope", "intercept"}:
+            out["slope"], out["intercept"] = _linear_trend(chunk, valid, times)
+        if theil_sen:
+            out["theil_sen_slope"], out["theil_sen_intercept"] = _theil_sen(
+                chunk, valid, times, pairs
+            )
+        if wanted & {"time_of_max", "amplitude"}:
+            highest = np.where(valid, chunk, -np.inf).argmax(axis=0)
+            out["time_of_max"] = np.where(found, day_of_year[highest], np.nan)
+        if wanted & {"time_of_min", "amplitude"}:
+            lowest = np.where(valid, chunk, np.inf).argmin(axis=0)
+            out["time_of_min"] = np.where(found, day_of_year[lowest], np.nan)
+        if "amplitude" in wanted:
+            columns = np.arange(chunk.shape[1])
+            out["amplitude"] = np.where(
+                found, chunk[highest, columns] - chunk[lowest, columns], np.nan
+            )
+        if "anomaly" in wanted:
+            reference = REDUCERS["mean"](chunk[in_baseline], valid[in_baseline])
+            current = REDUCERS["mean"](chunk[~in_baseline], valid[~in_baseline])
+            out["anomaly"] = current - reference
+        for stat in stats:
+            results[stat][start : start + chunk.shape[1]] = out[stat]
+
+    map_chunks(compute_chunk, pixels, workers, chunk_pixels)
+    return {stat: result.reshape(frame_shape) for stat, result in results.items()}
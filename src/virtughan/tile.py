@@ -1,20 +1,27 @@
 import asyncio
+import logging
+import os
 from io import BytesIO
 
 import matplotlib
 import mercantile
 import numpy as np
-from aiocache import cached
 from fastapi import HTTPException
-from matplotlib import pyplot as plt
 from PIL import Image
 from rio_tiler.io import COGReader
 from shapely.geometry import box, mapping
 
+from .cache import MemoryCache, TileCache, make_cache_key, pack_entry, unpack_entry
+from .colormap import apply_lut, formula_rescale, percentile_rescale
+from .footprint import FootprintIndex, FootprintIndexCache
+from .gdal_env import io_env
+from .metrics import count, span
+from .singleflight import SingleFlight
 from .utils import (
     aggregate_time_series,
     filter_intersected_features,
     filter_latest_image_per_grid,
+    get_stac_endpoint,
     remove_overlapping_sentinel2_tiles,
     search_stac_api_async,
     smart_filter_images,
@@ -22,41 +29,248 @@ from .utils import (
 
 matplotlib.use("Agg")
 
+logger = logging.getLogger(__name__)
+
+TILE_FORMATS = {
+    "png": "image/png",
+    "webp": "image/webp",
+    "npy": "application/x-npy",
+}
+
+
+def negotiate_tile_format(accept, default="png"):
+    """
+    Pick the tile format preferred by an Accept header.
+
+    Parameters:
+    accept (str): Value of the Accept request header.
+    default (str): Format used when no tile format is explicitly accepted.
+
+    Returns:
+    str: Tile format, one of TILE_FORMATS.
+    """
+    media_types = []
+    for position, part in enumerate((accept or "").split(",")):
+        media_type, *params = [value.strip() for value in part.split(";")]
+        quality = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            media_types.append((-quality, position, media_type))
+    formats = {media_type: name for name, media_type in TILE_FORMATS.items()}
+    for _, _, media_type in sorted(media_types):
+        if media_type in formats:
+            return formats[media_type]
+    return default
+
 
 class TileProcessor:
     """
     Processor for generating and caching tiles from satellite images.
     """
 
-    def __init__(self, cache_time=60):
+    def __init__(
+        self,
+        cache_time=60,
+        timeseries_cache_time=None,
+        cache=None,
+        index_zoom=10,
+        index_cache_time=600,
+        metatile=1,
+        max_concurrent_reads=16,
+        max_scenes=None,
+        progressive_scenes=None,
+        partial_cache_time=30,
+        png_compress_level=2,
+        webp_quality=90,
+        rescale_percentiles=(2, 98),
+    ):
         """
         Initialize the TileProcessor.
 
         Parameters:
-        cache_time (int): Cache time in seconds.
+        cache_time (int): Cache time in seconds of tiles rendered from the latest image.
+        timeseries_cache_time (int): Cache time in seconds of timeseries tiles, defaults to cache_time.
+        cache (TileCache): Tile cache, defaults to an in-process LRU cache.
+        index_zoom (int): Zoom level of the parent tiles whose STAC search results are indexed and shared by their children.
+        index_cache_time (int): Cache time in seconds of the parent tile footprint indexes.
+        metatile (int): Render blocks of metatile x metatile tiles at once and cache all of them, 1 disables it.
+        max_concurrent_reads (int): Maximum number of COG tile reads running at once across all requests.
+        max_scenes (int): Maximum number of scenes aggregated into a timeseries tile, the least cloudy are kept, None keeps all.
+        progressive_scenes (int): Answer timeseries tiles from the least cloudy progressive_scenes scenes first and refine them with the full scene budget in the background, None disables it.
+        partial_cache_time (int): Cache time in seconds of timeseries tiles awaiting their refinement.
+        png_compress_level (int): zlib compression level of PNG tiles, from 0 (none) to 9 (smallest).
+        webp_quality (int): Quality of WebP tiles, from 0 to 100.
+        rescale_percentiles (tuple): Percentiles of the values around a tile used as its default rescale range.
         """
+        if metatile < 1 or metatile & (metatile - 1):
+            raise ValueError("metatile must be a power of two")
         self.cache_time = cache_time
+        self.timeseries_cache_time = timeseries_cache_time or cache_time
+        self.cache = cache or TileCache([MemoryCache()])
+        self.index_zoom = index_zoom
+        self.metatile = metatile
+        self.max_scenes = max_scenes
+        self.progressive_scenes = progressive_scenes
+        self.partial_cache_time = partial_cache_time
+        self.png_compress_level = png_compress_level
+        self.webp_quality = webp_quality
+        self.rescale_percentiles = tuple(rescale_percentiles)
+        self._read_semaphore = asyncio.Semaphore(max_concurrent_reads)
+        self._refinements = set()
+        self._indexes = FootprintIndexCache(ttl=index_cache_time)
+        self._tile_flights = SingleFlight()
+        self._search_flights = SingleFlight()
+        self._read_flights = SingleFlight()
+        self._index_flights = SingleFlight()
+
+    @classmethod
+    def from_env(cls, **overrides):
+        """
+        Build a processor from environment variables.
+
+        TILE_CACHE_TTL_LATEST, TILE_CACHE_TTL_TIMESERIES and TILE_CACHE_TTL_PARTIAL
+        set the cache times, TILE_METATILE the metatile size,
+        TILE_MAX_CONCURRENT_READS, TILE_MAX_SCENES and TILE_PROGRESSIVE_SCENES
+        the timeseries fan-out (0 disables the scene limits) and
+        TILE_PNG_COMPRESS_LEVEL and TILE_WEBP_QUALITY the encoding. The cache is
+        built with TileCache.from_env.
+
+        Parameters:
+        **overrides: Constructor arguments taking precedence over the environment.
+
+        Returns:
+        TileProcessor: Configured processor.
+        """
+        params = dict(
+            cache_time=int(os.getenv("TILE_CACHE_TTL_LATEST", 60 * 60)),
+            timeseries_cache_time=int(
+                os.getenv("TILE_CACHE_TTL_TIMESERIES", 6 * 60 * 60)
+            ),
+            metatile=int(os.getenv("TILE_METATILE", 2)),
+            max_concurrent_reads=int(os.getenv("TILE_MAX_CONCURRENT_READS", 16)),
+            max_scenes=int(os.getenv("TILE_MAX_SCENES", 24)) or None,
+            progressive_scenes=int(os.getenv("TILE_PROGRESSIVE_SCENES", 6)) or None,
+            partial_cache_time=int(os.getenv("TILE_CACHE_TTL_PARTIAL", 30)),
+            png_compress_level=int(os.getenv("TILE_PNG_COMPRESS_LEVEL", 2)),
+            webp_quality=int(os.getenv("TILE_WEBP_QUALITY", 90)),
+        )
+        params.update(overrides)
+        if "cache" not in params:
+            params["cache"] = TileCache.from_env()
+        return cls(**params)
+
+    def cache_ttl(self, latest=True):
+        """
+        Get the cache time of a tile type.
+
+        Parameters:
+        latest (bool): Whether the tile is rendered from the latest image.
+
+        Returns:
+        int: Cache time in seconds.
+        """
+        return self.cache_time if latest else self.timeseries_cache_time
 
     @staticmethod
-    def apply_colormap(result, colormap_str):
+    def tile_cache_key(
+        x,
+        y,
+        z,
+        start_date,
+        end_date,
+        cloud_cover,
+        band1,
+        band2,
+        formula,
+        colormap_str,
+        latest,
+        operation,
+        output_format="png",
+        rescale=None,
+    ):
+        """
+        Build the cache key of a tile.
+
+        Parameters:
+        x (int): X coordinate of the tile.
+        y (int): Y coordinate of the tile.
+        z (int): Zoom level of the tile.
+        start_date (str): Start date for the data extraction (YYYY-MM-DD).
+        end_date (str): End date for the data extraction (YYYY-MM-DD).
+        cloud_cover (int): Maximum allowed cloud cover percentage.
+        band1 (str): First band for the formula.
+        band2 (str): Second band for the formula.
+        formula (str): Formula to apply to the bands.
+        colormap_str (str): Name of the colormap to apply.
+        latest (bool): Whether to use the latest image.
+        operation (str): Operation to apply to the time series.
+        output_format (str): Encoding of the tile, one of TILE_FORMATS.
+        rescale (tuple): Range mapped to the colormap, None for the default range.
+
+        Returns:
+        str: Cache key.
+        """
+        return make_cache_key(
+            "tile",
+            stac=get_stac_endpoint().key,
+            x=x,
+            y=y,
+            z=z,
+            start_date=start_date,
+            end_date=end_date,
+            cloud_cover=cloud_cover,
+            band1=band1,
+            band2=band2,
+            formula="".join(formula.split()),
+            colormap=colormap_str,
+            latest=latest,
+            operation=None if latest else operation,
+            output_format=output_format,
+            rescale=list(rescale) if rescale else None,
+        )
+
+    @staticmethod
+    def _feature_summary(feature):
+        """
+        Keep only the feature fields reported with a tile.
+
+        Parameters:
+        feature (dict): STAC feature used for the tile.
+
+        Returns:
+        dict: Feature with its id, date and cloud cover.
+        """
+        return {
+            "id": feature["id"],
+            "properties": {
+                "datetime": feature["properties"]["datetime"],
+                "eo:cloud_cover": feature["properties"]["eo:cloud_cover"],
+            },
+        }
+
+    @staticmethod
+    def apply_colormap(result, colormap_str, rescale=None):
         """
         Apply a colormap to the result.
 
         Parameters:
-        result (numpy.ndarray): Array of results to apply the colormap to.
+        result (numpy.ndarray): Array of results to apply the colormap to, masked values and NaN are transparent.
         colormap_str (str): Name of the colormap to apply.
+        rescale (tuple): Range mapped to the colormap, defaults to the range of the result.
 
         Returns:
-        PIL.Image.Image: Image with the applied colormap.
+        PIL.Image.Image: RGBA image with the applied colormap.
         """
-        result_normalized = (result - result.min()) / (result.max() - result.min())
-        colormap = plt.get_cmap(colormap_str)
-        result_colored = colormap(result_normalized)
-        result_image = (result_colored[:, :, :3] * 255).astype(np.uint8)
-        return Image.fromarray(result_image)
+        vmin, vmax = rescale or (None, None)
+        return Image.fromarray(apply_lut(result, colormap_str, vmin, vmax))
 
     @staticmethod
-    async def fetch_tile(url, x, y, z):
+    async def fetch_tile(url, x, y, z, tilesize=256):
         """
         Fetch a tile from the given URL.
 
@@ -65,19 +279,307 @@ class TileProcessor:
         x (int): X coordinate of the tile.
         y (int): Y coordinate of the tile.
         z (int): Zoom level of the tile.
+        tilesize (int): Width and height of the tile in pixels.
 
         Returns:
-        numpy.ndarray: Array of the tile data.
+        numpy.ma.MaskedArray: Array of the tile data, masked where there is no data.
         """
 
         def read_tile():
-            with COGReader(url) as cog:
-                tile, _ = cog.tile(x, y, z)
-                return tile
+            with span("tile.read"), io_env(), COGReader(url) as cog:
+                return cog.tile(x, y, z, tilesize=tilesize).array
+
+        count("tile.reads")
 
         return await asyncio.to_thread(read_tile)
 
-    @cached(ttl=60 * 1)
+    async def read_tile(self, url, x, y, z, tilesize=256):
+        """
+        Fetch a tile, sharing the read with concurrent requests for the same tile
+        and waiting for a free read slot.
+
+        Parameters:
+        url (str): URL of the tile.
+        x (int): X coordinate of the tile.
+        y (int): Y coordinate of the tile.
+        z (int): Zoom level of the tile.
+        tilesize (int): Width and height of the tile in pixels.
+
+        Returns:
+        numpy.ma.MaskedArray: Array of the tile data, masked where there is no data.
+        """
+        return await self._read_flights.do(
+            (url, x, y, z, tilesize), self._bounded_fetch_tile, url, x, y, z, tilesize
+        )
+
+    async def _bounded_fetch_tile(self, url, x, y, z, tilesize):
+        async with self._read_semaphore:
+            return await self.fetch_tile(url, x, y, z, tilesize)
+
+    @staticmethod
+    def select_scenes(results, start_date, end_date, max_scenes=None):
+        """
+        Select the scenes aggregated into a timeseries tile.
+
+        Parameters:
+        results (list): Features covering the tile, newest first.
+        start_date (str): Start date for the data extraction (YYYY-MM-DD).
+        end_date (str): End date for the data extraction (YYYY-MM-DD).
+        max_scenes (int): Maximum number of scenes to keep, None keeps all.
+
+        Returns:
+        list: Selected features, in the order of the filtered results.
+        """
+        if not results:
+            return []
+        results = remove_overlapping_sentinel2_tiles(results)
+        results = smart_filter_images(results, start_date, end_date)
+        if max_scenes is None or len(results) <= max_scenes:
+            return results
+        best = sorted(
+            range(len(results)),
+            key=lambda i: results[i]["properties"]["eo:cloud_cover"],
+        )[:max_scenes]
+        return [results[i] for i in sorted(best)]
+
+    async def timeseries_scenes(
+        self, x, y, z, start_date, end_date, cloud_cover, max_scenes=None
+    ):
+        """
+        Find the scenes aggregated into a timeseries tile.
+
+        Parameters:
+        x (int): X coordinate of the tile.
+        y (int): Y coordinate of the tile.
+        z (int): Zoom level of the tile.
+        start_date (str): Start date for the search (YYYY-MM-DD).
+        end_date (str): End date for the search (YYYY-MM-DD).
+        cloud_cover (int): Maximum allowed cloud cover percentage.
+        max_scenes (int): Maximum number of scenes to keep, defaults to the processor scene budget.
+
+        Returns:
+        list: Selected features, in the order of the filtered results.
+        """
+        results = await self.find_features(x, y, z, start_date, end_date, cloud_cover)
+        return self.select_scenes(
+            results, start_date, end_date, max_scenes or self.max_scenes
+        )
+
+    async def find_features(self, x, y, z, start_date, end_date, cloud_cover):
+        """
+        Find the features fully covering a tile.
+
+        Tiles at or below index_zoom are resolved locally against the footprint
+        index of their parent tile, which is searched once per date range and
+        cloud cover instead of once per tile.
+
+        Parameters:
+        x (int): X coordinate of the tile.
+        y (int): Y coordinate of the tile.
+        z (int): Zoom level of the tile.
+        start_date (str): Start date for the search (YYYY-MM-DD).
+        end_date (str): End date for the search (YYYY-MM-DD).
+        cloud_cover (int): Maximum allowed cloud cover percentage.
+
+        Returns:
+        list: Features covering the tile, newest first.
+        """
+        bbox = mercantile.bounds(mercantile.Tile(x, y, z))
+        bbox = [bbox.west, bbox.south, bbox.east, bbox.north]
+        if z < self.index_zoom:
+            results = await self.search(
+                mapping(box(*bbox)), start_date, end_date, cloud_cover
+            )
+            return filter_intersected_features(results, bbox)
+
+        parent = (
+            mercantile.parent(mercantile.Tile(x, y, z), zoom=self.index_zoom)
+            if z > self.index_zoom
+            else mercantile.Tile(x, y, z)
+        )
+        key = (
+            get_stac_endpoint().key,
+            tuple(parent),
+            start_date,
+            end_date,
+            cloud_cover,
+        )
+        index = self._indexes.get(key)
+        if index is None:
+            index = await self._index_flights.do(
+                key, self._build_index, key, parent, start_date, end_date, cloud_cover
+            )
+        return index.query(bbox)
+
+    async def _build_index(self, key, parent, start_date, end_date, cloud_cover):
+        parent_bbox = mercantile.bounds(parent)
+        results = await self.search(
+            mapping(
+                box(
+                    parent_bbox.west,
+                    parent_bbox.south,
+                    parent_bbox.east,
+                    parent_bbox.north,
+                )
+            ),
+            start_date,
+            end_date,
+            cloud_cover,
+        )
+        index = FootprintIndex(results)
+        self._indexes.set(key, index)
+        return index
+
+    async def search(self, bbox_geojson, start_date, end_date, cloud_cover):
+        """
+        Search the STAC API, sharing the search with concurrent identical searches.
+
+        Parameters:
+        bbox_geojson (dict): Bounding box in GeoJSON format.
+        start_date (str): Start date for the search (YYYY-MM-DD).
+        end_date (str): End date for the search (YYYY-MM-DD).
+        cloud_cover (int): Maximum allowed cloud cover percentage.
+
+        Returns:
+        list: List of features found in the search.
+        """
+        key = make_cache_key(
+            "search",
+            stac=get_stac_endpoint().key,
+            bbox=bbox_geojson,
+            start_date=start_date,
+            end_date=end_date,
+            cloud_cover=cloud_cover,
+        )
+        return await self._search_flights.do(
+            key,
+            search_stac_api_async,
+            bbox_geojson,
+            start_date,
+            end_date,
+            cloud_cover,
+        )
+
+    async def dataset_rescale(
+        self,
+        x,
+        y,
+        z,
+        start_date,
+        end_date,
+        cloud_cover,
+        band1,
+        band2,
+        formula,
+        latest=True,
+        operation="median",
+    ):
+        """
+        Get the default rescale range of a tile.
+
+        Formulas with a natural range, like normalized differences, use it. Other
+        formulas use percentiles of the result over the index_zoom parent tile,
+        read once at low resolution and cached, so that neighbouring tiles share
+        their colors.
+
+        Parameters:
+        x (int): X coordinate of the tile.
+        y (int): Y coordinate of the tile.
+        z (int): Zoom level of the tile.
+        start_date (str): Start date for the data extraction (YYYY-MM-DD).
+        end_date (str): End date for the data extraction (YYYY-MM-DD).
+        cloud_cover (int): Maximum allowed cloud cover percentage.
+        band1 (str): First band for the formula.
+        band2 (str): Second band for the formula.
+        formula (str): Formula to apply to the bands.
+        latest (bool): Whether to use the latest image.
+        operation (str): Operation to apply to the time series.
+
+        Returns:
+        tuple: Minimum and maximum, or None to scale the tile by its own range.
+        """
+        rescale = formula_rescale(formula)
+        if rescale is not None:
+            return rescale
+        parent = (
+            mercantile.parent(mercantile.Tile(x, y, z), zoom=self.index_zoom)
+            if z > self.index_zoom
+            else mercantile.Tile(x, y, z)
+        )
+        key = make_cache_key(
+            "rescale",
+            stac=get_stac_endpoint().key,
+            parent=list(parent),
+            start_date=start_date,
+            end_date=end_date,
+            cloud_cover=cloud_cover,
+            band1=band1,
+            band2=band2,
+            formula="".join(formula.split()),
+            latest=latest,
+            operation=None if latest else operation,
+            percentiles=self.rescale_percentiles,
+        )
+        cached_entry = await self.cache.get(key)
+        if cached_entry is not None:
+            _, meta = unpack_entry(cached_entry)
+            return tuple(meta["rescale"]) if meta["rescale"] else None
+        return await self._tile_flights.do(
+            ("rescale", key),
+            self._compute_rescale,
+            key,
+            parent,
+            start_date,
+            end_date,
+            cloud_cover,
+            band1,
+            band2,
+            formula,
+            latest,
+            operation,
+        )
+
+    async def _compute_rescale(
+        self,
+        key,
+        parent,
+        start_date,
+        end_date,
+        cloud_cover,
+        band1,
+        band2,
+        formula,
+        latest,
+        operation,
+    ):
+        try:
+            result, _ = await self.render_tile(
+                *parent,
+                start_date,
+                end_date,
+                cloud_cover,
+                band1,
+                band2,
+                formula,
+                latest=latest,
+                operation=operation,
+                max_scenes=self.progressive_scenes,
+                output_format="npy",
+            )
+        except HTTPException as e:
+            if e.status_code != 404:
+                raise
+            result = None
+        rescale = (
+            percentile_rescale(result, self.rescale_percentiles)
+            if result is not None and result.ndim == 2
+            else None
+        )
+        await self.cache.set(
+            key, pack_entry(b"", {"rescale": rescale}), self.cache_ttl(latest)
+        )
+        return rescale
+
     async def cached_generate_tile(
         self,
         x: int,
@@ -92,9 +594,15 @@ class TileProcessor:
         colormap_str: str = "RdYlGn",
         latest: bool = True,
         operation: str = "median",
-    ) -> bytes:
+        output_format: str = "png",
+        rescale: tuple = None,
+    ) -> tuple:
         """
-        Generate and cache a tile.
+        Get a tile from the cache, generating and caching it on a miss.
+
+        With progressive_scenes set, a timeseries tile missing from the cache is
+        first rendered from its least cloudy scenes and flagged as partial in the
+        feature summary, then refined in the background.
 
         Parameters:
         x (int): X coordinate of the tile.
@@ -109,25 +617,513 @@ class TileProcessor:
         colormap_str (str): Name of the colormap to apply.
         latest (bool): Whether to use the latest image.
         operation (str): Operation to apply to the time series.
+        output_format (str): Encoding of the tile, one of TILE_FORMATS.
+        rescale (tuple): Range mapped to the colormap, defaults to the formula range or the dataset percentiles.
 
         Returns:
-        bytes: Image bytes of the generated tile.
+        tuple: Encoded tile and the summary of the feature it was rendered from.
         """
-        tile = mercantile.Tile(x, y, z)
-        bbox = mercantile.bounds(tile)
-        bbox_geojson = mapping(box(bbox.west, bbox.south, bbox.east, bbox.north))
-        results = await search_stac_api_async(
-            bbox_geojson, start_date, end_date, cloud_cover
+        key = self.tile_cache_key(
+            x,
+            y,
+            z,
+            start_date,
+            end_date,
+            cloud_cover,
+            band1,
+            band2,
+            formula,
+            colormap_str,
+            latest,
+            operation,
+            output_format,
+            rescale,
+        )
+        with span("tile.cache"):
+            cached_entry = await self.cache.get(key)
+        if cached_entry is not None:
+            count("tile.cache_hits")
+            return unpack_entry(cached_entry)
+        count("tile.cache_misses")
+
+        if self.metatile > 1 and z >= self.metatile.bit_length() - 1:
+            zoom_offset = self.metatile.bit_length() - 1
+            meta_key = self.tile_cache_key(
+                x >> zoom_offset,
+                y >> zoom_offset,
+                z - zoom_offset,
+                start_date,
+                end_date,
+                cloud_cover,
+                band1,
+                band2,
+                formula,
+                colormap_str,
+                latest,
+                operation,
+                output_format,
+                rescale,
+            )
+            # every tile of the block shares the render of the whole block
+            tiles, feature = await self._tile_flights.do(
+                f"meta{self.metatile}-{meta_key}",
+                self._generate_and_cache_metatile,
+                x,
+                y,
+                z,
+                start_date,
+                end_date,
+                cloud_cover,
+                band1,
+                band2,
+                formula,
+                colormap_str,
+                latest,
+                operation,
+                output_format,
+                rescale,
+            )
+            if (x, y) in tiles:
+                return tiles[(x, y)], feature
+
+        # concurrent requests for a tile that is not cached yet share one render
+        return await self._tile_flights.do(
+            key,
+            self._generate_and_cache_tile,
+            key,
+            x,
+            y,
+            z,
+            start_date,
+            end_date,
+            cloud_cover,
+            band1,
+            band2,
+            formula,
+            colormap_str,
+            latest,
+            operation,
+            output_format,
+            rescale,
+        )
+
+    async def _generate_and_cache_metatile(
+        self,
+        x,
+        y,
+        z,
+        start_date,
+        end_date,
+        cloud_cover,
+        band1,
+        band2,
+        formula,
+        colormap_str,
+        latest,
+        operation,
+        output_format,
+        rescale,
+        progressive=True,
+    ):
+        zoom_offset = self.metatile.bit_length() - 1
+        meta_x, meta_y = x >> zoom_offset, y >> zoom_offset
+        selection_args = (start_date, end_date, cloud_cover, latest, progressive)
+        meta_selection = await self.scene_selection(
+            meta_x, meta_y, z - zoom_offset, *selection_args
+        )
+        children = [
+            ((meta_x << zoom_offset) + col, (meta_y << zoom_offset) + row)
+            for row in range(self.metatile)
+            for col in range(self.metatile)
+        ]
+        child_selections = await asyncio.gather(
+            *(
+                self.scene_selection(child_x, child_y, z, *selection_args)
+                for child_x, child_y in children
+            )
+        )
+        # a tile is only served from the block when it would be rendered from
+        # the same scenes on its own, the others are rendered one by one; the
+        # full selections match too, so the refinement of the block covers it
+        shared = {
+            child
+            for child, selection in zip(children, child_selections)
+            if selection == meta_selection
+        }
+        if not meta_selection[0] or not shared:
+            return {}, None
+        max_scenes = meta_selection[2]
+        try:
+            # the block is the ancestor tile rendered at metatile times the resolution
+            image, feature = await self.render_tile(
+                meta_x,
+                meta_y,
+                z - zoom_offset,
+                start_date,
+                end_date,
+                cloud_cover,
+                band1,
+                band2,
+                formula,
+                colormap_str,
+                latest=latest,
+                operation=operation,
+                output_format=output_format,
+                rescale=rescale,
+                tilesize=256 * self.metatile,
+                max_scenes=max_scenes,
+            )
+        except HTTPException as e:
+            if e.status_code != 404:
+                raise
+            # no scene covers the whole block, its tiles are rendered one by one
+            return {}, None
+        feature = self._feature_summary(feature)
+        tiles = await asyncio.to_thread(
+            self._slice_metatile,
+            image,
+            meta_x << zoom_offset,
+            meta_y << zoom_offset,
+            output_format,
+        )
+        tiles = {child: tiles[child] for child in shared}
+        ttl = self.cache_ttl(latest)
+        if max_scenes:
+            feature["partial"] = True
+            ttl = self.partial_cache_time
+        for (tile_x, tile_y), image_bytes in tiles.items():
+            key = self.tile_cache_key(
+                tile_x,
+                tile_y,
+                z,
+                start_date,
+                end_date,
+                cloud_cover,
+                band1,
+                band2,
+                formula,
+                colormap_str,
+                latest,
+                operation,
+                output_format,
+                rescale,
+            )
+            await self.cache.set(key, pack_entry(image_bytes, feature), ttl)
+        if max_scenes:
+            meta_key = self.tile_cache_key(
+                meta_x,
+                meta_y,
+                z - zoom_offset,
+                start_date,
+                end_date,
+                cloud_cover,
+                band1,
+                band2,
+                formula,
+                colormap_str,
+                latest,
+                operation,
+                output_format,
+                rescale,
+            )
+            self._schedule_refinement(
+                ("meta", self.metatile, meta_key),
+                self._generate_and_cache_metatile,
+                x,
+                y,
+                z,
+                start_date,
+                end_date,
+                cloud_cover,
+                band1,
+                band2,
+                formula,
+                colormap_str,
+                latest,
+                operation,
+                output_format,
+                rescale,
+                False,
+            )
+        return tiles, feature
+
+    async def _generate_and_cache_tile(
+        self,
+        key,
+        x,
+        y,
+        z,
+        start_date,
+        end_date,
+        cloud_cover,
+        band1,
+        band2,
+        formula,
+        colormap_str,
+        latest,
+        operation,
+        output_format,
+        rescale,
+        progressive=True,
+    ):
+        max_scenes = (
+            await self._progressive_budget(
+                x, y, z, start_date, end_date, cloud_cover, latest
+            )
+            if progressive
+            else None
+        )
+        image_bytes, feature = await self.generate_tile(
+            x,
+            y,
+            z,
+            start_date,
+            end_date,
+            cloud_cover,
+            band1,
+            band2,
+            formula,
+            colormap_str,
+            latest=latest,
+            operation=operation,
+            output_format=output_format,
+            rescale=rescale,
+            max_scenes=max_scenes,
         )
+        feature = self._feature_summary(feature)
+        ttl = self.cache_ttl(latest)
+        if max_scenes:
+            feature["partial"] = True
+            ttl = self.partial_cache_time
+        await self.cache.set(key, pack_entry(image_bytes, feature), ttl)
+        if max_scenes:
+            self._schedule_refinement(
+                key,
+                self._generate_and_cache_tile,
+                key,
+                x,
+                y,
+                z,
+                start_date,
+                end_date,
+                cloud_cover,
+                band1,
+                band2,
+                formula,
+                colormap_str,
+                latest,
+                operation,
+                output_format,
+                rescale,
+                False,
+            )
+        return image_bytes, feature
+
+    async def scene_selection(
+        self, x, y, z, start_date, end_date, cloud_cover, latest, progressive=True
+    ):
+        """
+        Get the scenes a tile is rendered from when it is rendered on its own.
+
+        Parameters:
+        x (int): X coordinate of the tile.
+        y (int): Y coordinate of the tile.
+        z (int): Zoom level of the tile.
+        start_date (str): Start date for the search (YYYY-MM-DD).
+        end_date (str): End date for the search (YYYY-MM-DD).
+        cloud_cover (int): Maximum allowed cloud cover percentage.
+        latest (bool): Whether the tile uses the latest image.
+        progressive (bool): Whether a timeseries tile is first rendered from a partial scene budget.
+
+        Returns:
+        tuple: IDs of the scenes, empty if no scene covers the tile, IDs of the scenes of the partial render or None, and the partial scene budget or None.
+        """
+        results = await self.find_features(x, y, z, start_date, end_date, cloud_cover)
+        if not results:
+            return (), None, None
+        if latest:
+            return (filter_latest_image_per_grid(results)[0]["id"],), None, None
+        scenes = self.select_scenes(results, start_date, end_date, self.max_scenes)
+        scene_ids = tuple(feature["id"] for feature in scenes)
+        if (
+            not progressive
+            or not self.progressive_scenes
+            or len(scenes) <= self.progressive_scenes
+        ):
+            return scene_ids, None, None
+        partial = self.select_scenes(
+            results, start_date, end_date, self.progressive_scenes
+        )
+        return (
+            scene_ids,
+            tuple(feature["id"] for feature in partial),
+            self.progressive_scenes,
+        )
+
+    async def _progressive_budget(
+        self, x, y, z, start_date, end_date, cloud_cover, latest
+    ):
+        """
+        Get the scene budget of the first, partial render of a timeseries tile.
+
+        Returns:
+        int: Number of scenes to render first, or None if the tile is rendered in one go.
+        """
+        if latest or not self.progressive_scenes:
+            return None
+        scenes = await self.timeseries_scenes(
+            x, y, z, start_date, end_date, cloud_cover
+        )
+        # nothing to refine when no scene covers the tile
+        if not scenes or len(scenes) <= self.progressive_scenes:
+            return None
+        return self.progressive_scenes
+
+    def _schedule_refinement(self, key, func, *args):
+        """
+        Re-render a partial tile with the full scene budget in the background,
+        overwriting its cache entries once done.
+        """
+        task = asyncio.ensure_future(
+            self._tile_flights.do(("refine", key), func, *args)
+        )
+        self._refinements.add(task)
+        task.add_done_callback(self._refinement_done)
+
+    def _refinement_done(self, task):
+        self._refinements.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            exception = task.exception()
+            logger.error(
+                "Tile refinement failed",
+                exc_info=(type(exception), exception, exception.__traceback__),
+            )
+
+    async def generate_tile(
+        self,
+        x: int,
+        y: int,
+        z: int,
+        start_date: str,
+        end_date: str,
+        cloud_cover: int,
+        band1: str,
+        band2: str,
+        formula: str,
+        colormap_str: str = "RdYlGn",
+        latest: bool = True,
+        operation: str = "median",
+        max_scenes: int = None,
+        output_format: str = "png",
+        rescale: tuple = None,
+    ) -> tuple:
+        """
+        Generate a tile without going through the cache.
+
+        Parameters:
+        x (int): X coordinate of the tile.
+        y (int): Y coordinate of the tile.
+        z (int): Zoom level of the tile.
+        start_date (str): Start date for the data extraction (YYYY-MM-DD).
+        end_date (str): End date for the data extraction (YYYY-MM-DD).
+        cloud_cover (int): Maximum allowed cloud cover percentage.
+        band1 (str): First band for the formula.
+        band2 (str): Second band for the formula.
+        formula (str): Formula to apply to the bands.
+        colormap_str (str): Name of the colormap to apply.
+        latest (bool): Whether to use the latest image.
+        operation (str): Operation to apply to the time series.
+        max_scenes (int): Maximum number of timeseries scenes, defaults to the processor scene budget.
+        output_format (str): Encoding of the tile, one of TILE_FORMATS.
+        rescale (tuple): Range mapped to the colormap, defaults to the formula range or the dataset percentiles.
+
+        Returns:
+        tuple: Encoded tile and the feature it was rendered from.
+        """
+        image, feature = await self.render_tile(
+            x,
+            y,
+            z,
+            start_date,
+            end_date,
+            cloud_cover,
+            band1,
+            band2,
+            formula,
+            colormap_str,
+            latest=latest,
+            operation=operation,
+            output_format=output_format,
+            rescale=rescale,
+            max_scenes=max_scenes,
+        )
+        image_bytes = await asyncio.to_thread(self.encode_image, image, output_format)
+        return image_bytes, feature
+
+    async def render_tile(
+        self,
+        x: int,
+        y: int,
+        z: int,
+        start_date: str,
+        end_date: str,
+        cloud_cover: int,
+        band1: str,
+        band2: str,
+        formula: str,
+        colormap_str: str = "RdYlGn",
+        latest: bool = True,
+        operation: str = "median",
+        tilesize: int = 256,
+        max_scenes: int = None,
+        output_format: str = "png",
+        rescale: tuple = None,
+    ) -> tuple:
+        """
+        Render a tile as an image without going through the cache.
+
+        Parameters:
+        x (int): X coordinate of the tile.
+        y (int): Y coordinate of the tile.
+        z (int): Zoom level of the tile.
+        start_date (str): Start date for the data extraction (YYYY-MM-DD).
+        end_date (str): End date for the data extraction (YYYY-MM-DD).
+        cloud_cover (int): Maximum allowed cloud cover percentage.
+        band1 (str): First band for the formula.
+        band2 (str): Second band for the formula.
+        formula (str): Formula to apply to the bands.
+        colormap_str (str): Name of the colormap to apply.
+        latest (bool): Whether to use the latest image.
+        operation (str): Operation to apply to the time series.
+        tilesize (int): Width and height of the rendered tile in pixels.
+        max_scenes (int): Maximum number of timeseries scenes, defaults to the processor scene budget.
+        output_format (str): Encoding the tile is rendered for, npy tiles keep the raw result.
+        rescale (tuple): Range mapped to the colormap, defaults to the formula range or the dataset percentiles.
+
+        Returns:
+        tuple: Rendered image, or result array for npy tiles, and the feature it was rendered from.
+        """
+        # the band names are shadowed by the band arrays below
+        rescale_args = (
+            x,
+            y,
+            z,
+            start_date,
+            end_date,
+            cloud_cover,
+            band1,
+            band2,
+            formula,
+            latest,
+            operation,
+        )
+        results = await self.find_features(x, y, z, start_date, end_date, cloud_cover)
 
         if not results:
             raise HTTPException(
                 status_code=404, detail="No images found for the given parameters"
             )
 
-        results = filter_intersected_features(
-            results, [bbox.west, bbox.south, bbox.east, bbox.north]
-        )
         if latest:
             if len(results) > 0:
                 results = filter_latest_image_per_grid(results)
@@ -136,9 +1132,9 @@ class TileProcessor:
                 band2_url = feature["assets"][band2]["href"] if band2 else None
 
                 try:
-                    tasks = [self.fetch_tile(band1_url, x, y, z)]
+                    tasks = [self.read_tile(band1_url, x, y, z, tilesize)]
                     if band2_url:
-                        tasks.append(self.fetch_tile(band2_url, x, y, z))
+                        tasks.append(self.read_tile(band2_url, x, y, z, tilesize))
 
                     tiles = await asyncio.gather(*tasks)
                     band1 = tiles[0]
@@ -150,16 +1146,13 @@ class TileProcessor:
                     band1 = band1[0].astype(float)
                     band2 = band2[0].astype(float)
                     result = eval(formula)
-                    image = self.apply_colormap(result, colormap_str)
                 else:
                     inner_bands = band1.shape[0]
                     if inner_bands == 1:
                         band1 = band1[0].astype(float)
                         result = eval(formula)
-                        image = self.apply_colormap(result, colormap_str)
                     else:
-                        band1 = band1.transpose(1, 2, 0)
-                        image = Image.fromarray(band1)
+                        return self._bands_image(band1, output_format), feature
             else:
 
                 raise HTTPException(
@@ -167,8 +1160,9 @@ class TileProcessor:
                 )
         else:
 
-            results = remove_overlapping_sentinel2_tiles(results)
-            results = smart_filter_images(results, start_date, end_date)
+            results = self.select_scenes(
+                results, start_date, end_date, max_scenes or self.max_scenes
+            )
             band1_tiles = []
             band2_tiles = []
 
@@ -176,9 +1170,9 @@ class TileProcessor:
             for feature in results:
                 band1_url = feature["assets"][band1]["href"]
                 band2_url = feature["assets"][band2]["href"] if band2 else None
-                tasks.append(self.fetch_tile(band1_url, x, y, z))
+                tasks.append(self.read_tile(band1_url, x, y, z, tilesize))
                 if band2_url:
-                    tasks.append(self.fetch_tile(band2_url, x, y, z))
+                    tasks.append(self.read_tile(band2_url, x, y, z, tilesize))
 
             try:
                 tiles = await asyncio.gather(*tasks)
@@ -189,21 +1183,113 @@ class TileProcessor:
             except Exception as e:
                 raise HTTPException(status_code=500, detail=str(e))
 
-            band1 = aggregate_time_series(
-                [tile[0].astype(float) for tile in band1_tiles], operation
+            # reduce off the event loop, the stacks can hold hundreds of scenes
+            with span("tile.aggregate"):
+                band1 = await asyncio.to_thread(
+                    aggregate_time_series, [tile[0] for tile in band1_tiles], operation
+                )
+                if band2_tiles:
+                    band2 = await asyncio.to_thread(
+                        aggregate_time_series,
+                        [tile[0] for tile in band2_tiles],
+                        operation,
+                    )
+            result = eval(formula)
+
+        if output_format != "npy" and rescale is None:
+            rescale = await self.dataset_rescale(*rescale_args)
+        with span("tile.render"):
+            image = self._result_image(result, colormap_str, output_format, rescale)
+        return image, feature
+
+    def _result_image(self, result, colormap_str, output_format, rescale=None):
+        """
+        Turn a formula result into the rendered tile.
+
+        Returns:
+        PIL.Image.Image: Colored image, or float32 result array with NaN as nodata for npy tiles.
+        """
+        if output_format == "npy":
+            return np.ma.filled(np.ma.asarray(result, dtype=np.float32), np.nan)
+        return self.apply_colormap(result, colormap_str, rescale)
+
+    @staticmethod
+    def _bands_image(bands, output_format):
+        """
+        Turn a multi band tile, e.g. the visual asset, into the rendered tile.
+
+        Returns:
+        PIL.Image.Image: RGBA image transparent where there is no data, or band array for npy tiles.
+        """
+        if output_format == "npy":
+            return np.ma.filled(bands, 0)
+        alpha = np.where(np.ma.getmaskarray(bands).any(axis=0), 0, 255)
+        return Image.fromarray(
+            np.dstack([np.ma.getdata(bands[:3]).transpose(1, 2, 0), alpha]).astype(
+                np.uint8
             )
-            if band2_tiles:
-                band2 = aggregate_time_series(
-                    [tile[0].astype(float) for tile in band2_tiles], operation
+        )
+
+    def encode_image(self, image, output_format="png"):
+        """
+        Encode a tile image.
+
+        Parameters:
+        image (PIL.Image.Image): Tile image, or result array for npy tiles.
+        output_format (str): Encoding of the tile, one of TILE_FORMATS.
+
+        Returns:
+        bytes: Encoded tile.
+        """
+        buffered = BytesIO()
+        with span("tile.encode"):
+            if output_format == "png":
+                image.save(
+                    buffered, format="PNG", compress_level=self.png_compress_level
                 )
-                result = eval(formula)
+            elif output_format == "webp":
+                image.save(buffered, format="WEBP", quality=self.webp_quality)
+            elif output_format == "npy":
+                np.save(buffered, image, allow_pickle=False)
             else:
-                result = eval(formula)
+                raise ValueError(f"Unsupported tile format: {output_format}")
+        return buffered.getvalue()
 
-            image = self.apply_colormap(result, colormap_str)
+    def _slice_metatile(
+        self, image, origin_x, origin_y, output_format="png", tilesize=256
+    ):
+        """
+        Slice a metatile image into encoded tiles.
 
-        buffered = BytesIO()
-        image.save(buffered, format="PNG")
-        image_bytes = buffered.getvalue()
+        Parameters:
+        image (PIL.Image.Image): Metatile image, or result array for npy tiles.
+        origin_x (int): X coordinate of the top left tile.
+        origin_y (int): Y coordinate of the top left tile.
+        output_format (str): Encoding of the tiles, one of TILE_FORMATS.
+        tilesize (int): Width and height of a tile in pixels.
 
-        return image_bytes, feature
+        Returns:
+        dict: Encoded tile bytes keyed by tile (x, y).
+        """
+        tiles = {}
+        for row in range(self.metatile):
+            for col in range(self.metatile):
+                if isinstance(image, np.ndarray):
+                    crop = image[
+                        ...,
+                        row * tilesize : (row + 1) * tilesize,
+                        col * tilesize : (col + 1) * tilesize,
+                    ]
+                else:
+                    crop = image.crop(
+                        (
+                            col * tilesize,
+                            row * tilesize,
+                            (col + 1) * tilesize,
+                            (row + 1) * tilesize,
+                        )
+                    )
+                tiles[(origin_x + col, origin_y + row)] = self.encode_image(
+                    crop, output_format
+                )
+        return tiles
@@ -1,117 +1,291 @@
 import os
-import zipfile
 from datetime import datetime, timedelta
 
 import httpx
-import numpy as np
 import requests
 from shapely.geometry import box, shape
 
+from .archive import ZipArchive
+from .metrics import get_recorder
+from .progress import get_channel
+from .reducers import reduce
+
 STAC_API_URL = "https://earth-search.aws.element84.com/v1/search"
+STAC_COLLECTION = "sentinel-2-l2a"
+STAC_PAGE_SIZE = 100
 
 
-def search_stac_api(bbox, start_date, end_date, cloud_cover):
+def parse_href_rewrites(value):
     """
-    Search the STAC API for satellite images.
+    Parse asset href rewrites written as comma separated prefix=replacement pairs.
 
     Parameters:
-    bbox (list): Bounding box coordinates [min_lon, min_lat, max_lon, max_lat].
-    start_date (str): Start date for the search (YYYY-MM-DD).
-    end_date (str): End date for the search (YYYY-MM-DD).
-    cloud_cover (int): Maximum allowed cloud cover percentage.
+    value (str): Rewrites, e.g. "s3://sentinel-cogs/=http://mirror:8080/sentinel-cogs/".
 
     Returns:
-    list: List of features found in the search.
+    list: (prefix, replacement) tuples.
     """
-    search_params = {
-        "collections": ["sentinel-2-l2a"],
-        "datetime": f"{start_date}T00:00:00Z/{end_date}T23:59:59Z",
-        "query": {"eo:cloud_cover": {"lt": cloud_cover}},
-        "bbox": bbox,
-        "limit": 100,
-        "sortby": [{"field": "properties.datetime", "direction": "desc"}],
-    }
+    rewrites = []
+    for rule in (value or "").split(","):
+        if not rule.strip():
+            continue
+        prefix, separator, replacement = rule.strip().partition("=")
+        if not separator or not prefix:
+            raise ValueError(
+                f"Invalid href rewrite {rule}, expected prefix=replacement"
+            )
+        rewrites.append((prefix, replacement))
+    return rewrites
 
-    all_features = []
-    next_link = None
 
-    while True:
-        response = requests.post(
-            STAC_API_URL,
-            json=search_params if not next_link else next_link["body"],
-        )
-        response.raise_for_status()
-        response_json = response.json()
+class StacEndpoint:
+    """
+    STAC API searched for scenes, and where the assets of its items are read from.
 
-        all_features.extend(response_json["features"])
+    Asset hrefs starting with a rewrite prefix are pointed to the replacement,
+    e.g. from the public bucket to a mirror in the same datacenter, or to a
+    local copy on disk.
+    """
 
-        next_link = next(
-            (link for link in response_json["links"] if link["rel"] == "next"), None
+    def __init__(
+        self,
+        url=STAC_API_URL,
+        collection=STAC_COLLECTION,
+        page_size=STAC_PAGE_SIZE,
+        href_rewrites=None,
+    ):
+        """
+        Initialize the StacEndpoint.
+
+        Parameters:
+        url (str): URL of the item search of the STAC API.
+        collection (str): Collection of the scenes.
+        page_size (int): Number of items requested per page.
+        href_rewrites (list): (prefix, replacement) tuples applied to the asset hrefs, the first matching prefix wins.
+        """
+        self.url = url
+        self.collection = collection
+        self.page_size = page_size
+        self.href_rewrites = list(href_rewrites or [])
+
+    @property
+    def key(self):
+        """
+        Identify the scenes of the endpoint in cache keys; hrefs rewrites are
+        left out as they point to copies of the same assets.
+        """
+        return f"{self.collection}@{self.url}"
+
+    @classmethod
+    def from_env(cls):
+        """
+        Build the endpoint from the environment: STAC_API_URL, STAC_COLLECTION,
+        STAC_PAGE_SIZE and STAC_HREF_REWRITES, comma separated prefix=replacement pairs.
+
+        Returns:
+        StacEndpoint: Configured endpoint.
+        """
+        return cls(
+            url=os.getenv("STAC_API_URL", STAC_API_URL),
+            collection=os.getenv("STAC_COLLECTION", STAC_COLLECTION),
+            page_size=int(os.getenv("STAC_PAGE_SIZE", STAC_PAGE_SIZE)),
+            href_rewrites=parse_href_rewrites(os.getenv("STAC_HREF_REWRITES")),
         )
-        if not next_link:
-            break
-    return all_features
 
+    def search_params(self, start_date, end_date, cloud_cover, **area):
+        """
+        Build the body of an item search.
+
+        Parameters:
+        start_date (str): Start date for the search (YYYY-MM-DD).
+        end_date (str): End date for the search (YYYY-MM-DD).
+        cloud_cover (int): Maximum allowed cloud cover percentage.
+        **area: bbox or intersects of the search.
+
+        Returns:
+        dict: Search parameters.
+        """
+        return {
+            "collections": [self.collection],
+            "datetime": f"{start_date}T00:00:00Z/{end_date}T23:59:59Z",
+            "query": {"eo:cloud_cover": {"lt": cloud_cover}},
+            **area,
+            "limit": self.page_size,
+            "sortby": [{"field": "properties.datetime", "direction": "desc"}],
+        }
+
+    def rewrite_href(self, href):
+        """
+        Rewrite an asset href with the first matching rewrite.
+
+        Parameters:
+        href (str): Asset href.
+
+        Returns:
+        str: Rewritten href, or href if no prefix matches.
+        """
+        for prefix, replacement in self.href_rewrites:
+            if href.startswith(prefix):
+                return replacement + href[len(prefix) :]
+        return href
+
+    def rewrite_features(self, features):
+        """
+        Rewrite the asset hrefs of features in place.
+
+        Parameters:
+        features (list): STAC features.
+
+        Returns:
+        list: The features.
+        """
+        if self.href_rewrites:
+            for feature in features:
+                for asset in feature.get("assets", {}).values():
+                    if "href" in asset:
+                        asset["href"] = self.rewrite_href(asset["href"])
+        return features
+
+
+_stac_endpoint = StacEndpoint.from_env()
+
+
+def get_stac_endpoint():
+    """
+    Get the STAC endpoint the searches go to.
 
-async def search_stac_api_async(bbox_geojson, start_date, end_date, cloud_cover):
+    Returns:
+    StacEndpoint: Current endpoint.
     """
-    Asynchronously search the STAC API for satellite images.
+    return _stac_endpoint
+
+
+def configure_stac(endpoint=None, **settings):
+    """
+    Change the STAC endpoint the searches go to, at runtime.
 
     Parameters:
-    bbox_geojson (dict): Bounding box in GeoJSON format.
+    endpoint (StacEndpoint): Endpoint to use, defaults to the current one updated with settings.
+    **settings: url, collection, page_size or href_rewrites to change.
+
+    Returns:
+    StacEndpoint: New endpoint.
+    """
+    global _stac_endpoint
+    current = endpoint or _stac_endpoint
+    _stac_endpoint = StacEndpoint(
+        url=settings.get("url", current.url),
+        collection=settings.get("collection", current.collection),
+        page_size=settings.get("page_size", current.page_size),
+        href_rewrites=settings.get("href_rewrites", current.href_rewrites),
+    )
+    return _stac_endpoint
+
+
+def search_stac_api(bbox, start_date, end_date, cloud_cover):
+    """
+    Search the STAC API for satellite images.
+
+    Parameters:
+    bbox (list): Bounding box coordinates [min_lon, min_lat, max_lon, max_lat].
     start_date (str): Start date for the search (YYYY-MM-DD).
     end_date (str): End date for the search (YYYY-MM-DD).
     cloud_cover (int): Maximum allowed cloud cover percentage.
 
     Returns:
-    list: List of features found in the search.
+    list: List of features found in the search, with the asset hrefs of the endpoint rewrites.
     """
-    search_params = {
-        "collections": ["sentinel-2-l2a"],
-        "datetime": f"{start_date}T00:00:00Z/{end_date}T23:59:59Z",
-        "query": {"eo:cloud_cover": {"lt": cloud_cover}},
-        "intersects": bbox_geojson,
-        "limit": 100,
-        "sortby": [{"field": "properties.datetime", "direction": "desc"}],
-    }
+    endpoint = get_stac_endpoint()
+    search_params = endpoint.search_params(start_date, end_date, cloud_cover, bbox=bbox)
 
     all_features = []
     next_link = None
+    recorder = get_recorder()
 
-    async with httpx.AsyncClient() as client:
+    with recorder.span("stac.search"):
         while True:
-            response = await client.post(
-                STAC_API_URL,
+            response = requests.post(
+                next_link.get("href", endpoint.url) if next_link else endpoint.url,
                 json=search_params if not next_link else next_link["body"],
             )
             response.raise_for_status()
             response_json = response.json()
+            recorder.count("stac.requests")
 
             all_features.extend(response_json["features"])
 
             next_link = next(
-                (link for link in response_json["links"] if link["rel"] == "next"), None
+                (link for link in response_json["links"] if link["rel"] == "next"),
+                None,
             )
             if not next_link:
                 break
+    recorder.count("stac.features", len(all_features))
+    return endpoint.rewrite_features(all_features)
 
-    return all_features
+
+async def search_stac_api_async(bbox_geojson, start_date, end_date, cloud_cover):
+    """
+    Asynchronously search the STAC API for satellite images.
+
+    Parameters:
+    bbox_geojson (dict): Bounding box in GeoJSON format.
+    start_date (str): Start date for the search (YYYY-MM-DD).
+    end_date (str): End date for the search (YYYY-MM-DD).
+    cloud_cover (int): Maximum allowed cloud cover percentage.
+
+    Returns:
+    list: List of features found in the search, with the asset hrefs of the endpoint rewrites.
+    """
+    endpoint = get_stac_endpoint()
+    search_params = endpoint.search_params(
+        start_date, end_date, cloud_cover, intersects=bbox_geojson
+    )
+
+    all_features = []
+    next_link = None
+    recorder = get_recorder()
+
+    with recorder.span("stac.search"):
+        async with httpx.AsyncClient() as client:
+            while True:
+                response = await client.post(
+                    next_link.get("href", endpoint.url) if next_link else endpoint.url,
+                    json=search_params if not next_link else next_link["body"],
+                )
+                response.raise_for_status()
+                response_json = response.json()
+                recorder.count("stac.requests")
+
+                all_features.extend(response_json["features"])
+
+                next_link = next(
+                    (link for link in response_json["links"] if link["rel"] == "next"),
+                    None,
+                )
+                if not next_link:
+                    break
+
+    recorder.count("stac.features", len(all_features))
+    return endpoint.rewrite_features(all_features)
 
 
 def zip_files(file_list, zip_path):
     """
-    Zip a list of files.
+    Zip a list of files, deleting each one once it is archived.
+
+    Already compressed files, such as COGs and PNGs, are stored as is.
 
     Parameters:
     file_list (list): List of file paths to zip.
     zip_path (str): Path to the output zip file.
     """
-    with zipfile.ZipFile(zip_path, "w", compression=zipfile.ZIP_DEFLATED) as zipf:
+    with ZipArchive(zip_path) as archive:
         for file in file_list:
-            zipf.write(file, os.path.basename(file))
-    print(f"Saved intermediate images ZIP to {zip_path}")
-    for file in file_list:
-        os.remove(file)
+            archive.add_file(file, remove=True)
+    channel = get_channel()
+    channel.log(f"Saved intermediate images ZIP to {zip_path}")
+    channel.emit("file_written", file=os.path.basename(zip_path))
 
 
 def filter_latest_image_per_grid(features):
@@ -190,30 +364,19 @@ def remove_overlapping_sentinel2_tiles(features):
     return list(filtered_features.values())
 
 
-def aggregate_time_series(data, operation):
+def aggregate_time_series(data, operation, workers=1):
     """
     Aggregate a time series of data.
 
     Parameters:
-    data (list): List of data arrays to aggregate.
-    operation (str): Operation to apply to the data (mean, median, max, min, std, sum, var).
+    data (list): List of data arrays to aggregate, masked values and NaN are ignored.
+    operation (str): Operation to apply to the data, one of reducers.REDUCERS.
+    workers (int): Number of threads aggregating at once.
 
     Returns:
-    numpy.ndarray: Aggregated result.
+    numpy.ndarray: Aggregated result, NaN where no array has data.
     """
-    result_stack = np.ma.stack(data)
-
-    operations = {
-        "mean": np.ma.mean,
-        "median": np.ma.median,
-        "max": np.ma.max,
-        "min": np.ma.min,
-        "std": np.ma.std,
-        "sum": np.ma.sum,
-        "var": np.ma.var,
-    }
-
-    return operations[operation](result_stack, axis=0)
+    return reduce(data, operation, workers=workers)
 
 
 def smart_filter_images(features, start_date: str, end_date: str):
@@ -228,6 +391,8 @@ def smart_filter_images(features, start_date: str, end_date: str):
     Returns:
     list: List of filtered features.
     """
+    if not features:
+        return []
     start = datetime.fromisoformat(start_date)
     end = datetime.fromisoformat(end_date)
     total_days = (end - start).days
@@ -251,10 +416,11 @@ def smart_filter_images(features, start_date: str, end_date: str):
     filtered_features = []
     last_selected_date = None
     best_feature = None
-    print(
+    channel = get_channel()
+    channel.log(
         f"""Filter from : {features[-1]["properties"]["datetime"].split("T")[0]} to : {features[0]["properties"]["datetime"].split("T")[0]}"""
     )
-    print(f"Selecting 1 image per {frequency.days} days")
+    channel.log(f"Selecting 1 image per {frequency.days} days")
 
     for feature in sorted(features, key=lambda x: x["properties"]["datetime"]):
         date = datetime.fromisoformat(feature["properties"]["datetime"].split("T")[0])
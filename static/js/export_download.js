@@ -116,6 +116,7 @@ downloading = false;
           // Store the UID in localStorage
           if (data.uid) {
             localStorage.setItem('UID', data.uid);
+            watchProcessingStatus(data.uid);
           }
 
         })
@@ -132,6 +133,32 @@ downloading = false;
 
         //show the progress to the user
         
+        function handleLogData(data) {
+          const uid = localStorage.getItem('UID');
+          updateProgress(data);
+          if (data.includes('Processing completed.') || data.includes('100%')) {
+            stopWatchingStatus();
+            console.log('Processing completed. Stopped checking.');
+            if(completed_log){}
+            else{
+              if(data.includes('Filtered 0 items') || data.includes('Scenes covering input area: 0')){}
+              else{
+                if(analyzeChecked){
+                  document.getElementById("layerSwitcherBox").classList.remove("hidden");
+                  if(document.getElementById("operation").checked){
+                    plotGeoTIFF('static/export/'+uid+'/custom_band_output_aggregate.tif');
+                    completed_log = true;
+                  }
+                }
+                else{
+                  document.getElementById("download-complete").classList.remove("hidden");
+                }
+            
+              }  
+            }  
+          }
+        }
+
         function checkProcessingStatus() {
           const uid = localStorage.getItem('UID');
           // console.log("UID: ", uid)
@@ -142,42 +169,48 @@ downloading = false;
             method: 'GET' 
           })
             .then(response => response.text())
-            .then(data => {
-              // console.log('Success log:', data);
-              updateProgress(data);
-              if (data.includes('Processing completed.') || data.includes('100%')) {
-                clearInterval(intervalId);
-                console.log('Processing completed. Stopped checking.');
-                if(completed_log){}
-                else{
-                  if(data.includes('Filtered 0 items') || data.includes('Scenes covering input area: 0')){}
-                  else{
-                    if(analyzeChecked){
-                      document.getElementById("layerSwitcherBox").classList.remove("hidden");
-                      if(document.getElementById("operation").checked){
-                        plotGeoTIFF('static/export/'+uid+'/custom_band_output_aggregate.tif');
-                        completed_log = true;
-                      }
-                    }
-                    else{
-                      document.getElementById("download-complete").classList.remove("hidden");
-                    }
-                
-                  }  
-                }  
-              }
-            })
+            .then(handleLogData)
             .catch((error) => {
               console.error('Error:', error);
             });
         }
 
+        var intervalId = null;
+        var eventSource = null;
+
+        function stopWatchingStatus() {
+          if (intervalId) {
+            clearInterval(intervalId);
+          }
+          if (eventSource) {
+            eventSource.close();
+          }
+        }
+
+        // Follow the job through server sent events, falling back to polling the logs every 5 seconds
+        function watchProcessingStatus(uid) {
+          if (!window.EventSource) {
+            intervalId = setInterval(checkProcessingStatus, 5000);
+            return;
+          }
+          const logLines = [];
+          eventSource = new EventSource('/jobs/' + uid + '/events');
+          eventSource.addEventListener('log', (event) => {
+            logLines.push(JSON.parse(event.data).message);
+            if (logLines.length > 30) {
+              logLines.shift();
+            }
+            updateProgress(logLines.join('\n'));
+          });
+          eventSource.addEventListener('job_finished', () => {
+            stopWatchingStatus();
+            handleLogData(logLines.join('\n'));
+          });
+        }
+
         // Initial call to set progress to 0%
         startProgressComputation('compute', 0);
         
-        // Start checking the processing status every 5 seconds
-        const intervalId = setInterval(checkProcessingStatus, 5000);
-
         function updateProgress(logData) {
           if (logData.includes('No images found') || logData.includes('Filtered 0 items') || logData.includes('Scenes covering input area: 0')) {
               displayNoImageFoundMessage();
@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from virtughan.animation import (
+    AnimationLayoutError,
+    colormap_palette,
+    ffmpeg_path,
+    write_animation,
+)
+from virtughan.render import FrameRenderer
+
+
+@pytest.fixture
+def frames():
+    rng = np.random.default_rng(0)
+    renderer = FrameRenderer("RdYlGn", 0, 1)
+    return [
+        renderer.render(rng.random((1, 60, 40)).astype(np.float32), f"frame {index}")
+        for index in range(4)
+    ]
+
+
+@pytest.mark.parametrize("palette", [None, colormap_palette("RdYlGn")])
+def test_gif_shares_palette(tmp_path, frames, palette):
+    path = tmp_path / "output.gif"
+    assert write_animation(iter(frames), str(path), duration=0.5, palette=palette) == 4
+    with Image.open(path) as animation:
+        assert animation.n_frames == 4
+        assert animation.size == frames[0].size
+        assert animation.info["duration"] == 500
+        animation.seek(2)
+        decoded = np.asarray(animation.convert("RGB"), dtype=float)
+    assert np.abs(decoded - np.asarray(frames[2], dtype=float)).mean() < 4
+
+
+def test_webp_is_downscaled(tmp_path, frames):
+    path = tmp_path / "output.webp"
+    write_animation(frames, str(path), max_size=35)
+    with Image.open(path) as animation:
+        assert animation.n_frames == 4
+        assert max(animation.size) == 35
+        animation.seek(3)
+        animation.load()
+        assert animation.info["duration"] == 1000
+
+
+@pytest.mark.parametrize("output_format", ["gif", "webp"])
+def test_frames_and_durations_decode(tmp_path, frames, output_format):
+    path = tmp_path / f"output.{output_format}"
+    write_animation(frames, str(path), duration=0.25)
+    durations = []
+    with Image.open(path) as animation:
+        assert animation.n_frames == len(frames)
+        for index in range(animation.n_frames):
+            animation.seek(index)
+            animation.load()
+            durations.append(animation.info["duration"])
+    assert durations == [250] * len(frames)
+
+
+@pytest.mark.parametrize("output_format", ["gif", "webp"])
+def test_unexpected_pillow_output(tmp_path, frames, monkeypatch, output_format):
+    # e.g. a Pillow release changing the layout of the frames it encodes
+    monkeypatch.setattr(
+        Image.Image, "save", lambda self, buffer, **kwargs: buffer.write(b"RIFF;")
+    )
+    with pytest.raises(AnimationLayoutError, match=output_format.upper()):
+        write_animation(frames, str(tmp_path / f"output.{output_format}"))
+
+
+def test_invalid_format(tmp_path, frames):
+    with pytest.raises(ValueError):
+        write_animation(frames, str(tmp_path / "output.avi"))
+
+
+@pytest.mark.skipif(not ffmpeg_path(), reason="ffmpeg is not installed")
+def test_mp4(tmp_path, frames):
+    path = tmp_path / "output.mp4"
+    write_animation(frames, str(path))
+    assert path.stat().st_size > 0
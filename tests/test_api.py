@@ -0,0 +1,29 @@
+import importlib
+
+import pytest
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture
+def api(tmp_path, monkeypatch):
+    monkeypatch.setenv("JOBS_DB_PATH", str(tmp_path / "jobs.db"))
+    api = importlib.import_module("API")
+    monkeypatch.setattr(api, "STATIC_EXPORT_DIR", str(tmp_path / "export"))
+    monkeypatch.setattr(api, "job_queue", api.JobQueue(str(tmp_path / "jobs.db")))
+    return api
+
+
+def test_export_accepts_bands_of_different_resolutions(api):
+    # without the lifespan the job is queued but never run
+    client = TestClient(api.app)
+    response = client.get(
+        "/export",
+        params={"bbox": "83.8,28.2,83.9,28.3", "band1": "red", "band2": "swir16"},
+    )
+    assert response.status_code == 201
+    content = response.json()
+    assert (
+        content["note"] == "Band 'red' (10m) is resampled to the 20m grid of 'swir16'"
+    )
+    params = api.job_queue.store.get(content["uid"])["params"]
+    assert (params["band1"], params["band2"]) == ("red", "swir16")
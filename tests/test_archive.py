@@ -0,0 +1,73 @@
+import io
+import os
+import zipfile
+
+import pytest
+
+from virtughan import archive
+from virtughan.archive import ZipArchive, directory_files, stream_zip
+from virtughan.utils import zip_files
+
+
+@pytest.fixture
+def job_dir(tmp_path):
+    (tmp_path / "pyramids").mkdir()
+    (tmp_path / "result.tif").write_bytes(b"GeoTIFF " * 20000)
+    (tmp_path / "frame.png").write_bytes(b"PNG " * 1000)
+    (tmp_path / "pyramids" / "scene.mbtiles").write_bytes(os.urandom(50000))
+    (tmp_path / "runtime.log").write_text("log")
+    (tmp_path / "events.jsonl").write_text("{}")
+    return tmp_path
+
+
+def test_members_are_deflated_in_parallel(tmp_path):
+    path = tmp_path / "out.zip"
+    random = os.urandom(10000)
+    with ZipArchive(str(path), workers=3) as zipped:
+        for index in range(8):
+            zipped.add(f"scene_{index}.tif", b"%d" % index * 10000)
+        zipped.add("random.bin", random)
+        zipped.add("cog.tif", b"tiles" * 1000, compress=False)
+        with pytest.raises(ValueError):
+            zipped.add("cog.tif", b"")
+    with zipfile.ZipFile(path) as result:
+        assert result.testzip() is None
+        assert len(result.namelist()) == 10
+        assert result.read("scene_3.tif") == b"3" * 10000
+        assert result.getinfo("scene_3.tif").compress_type == zipfile.ZIP_DEFLATED
+        assert result.getinfo("random.bin").compress_type == zipfile.ZIP_STORED
+        assert result.getinfo("cog.tif").compress_type == zipfile.ZIP_STORED
+
+
+def test_stream_zip_of_job_directory(job_dir):
+    files = directory_files(str(job_dir))
+    assert [name for _, name in files] == [
+        "frame.png",
+        "pyramids/scene.mbtiles",
+        "result.tif",
+    ]
+    chunks = list(stream_zip(files, chunk_size=1000))
+    assert len(chunks) > 1
+    with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as result:
+        assert result.testzip() is None
+        assert result.read("result.tif") == (job_dir / "result.tif").read_bytes()
+        assert result.getinfo("result.tif").compress_type == zipfile.ZIP_DEFLATED
+        assert result.getinfo("frame.png").compress_type == zipfile.ZIP_STORED
+        assert (
+            result.getinfo("pyramids/scene.mbtiles").compress_type == zipfile.ZIP_STORED
+        )
+
+
+def test_zip64_data_descriptors(job_dir, monkeypatch):
+    monkeypatch.setattr(archive, "ZIP64_SAFE_SIZE", 0)
+    data = b"".join(stream_zip(directory_files(str(job_dir))))
+    with zipfile.ZipFile(io.BytesIO(data)) as result:
+        assert result.testzip() is None
+        assert result.read("frame.png") == (job_dir / "frame.png").read_bytes()
+
+
+def test_zip_files_removes_originals(job_dir):
+    zip_files([str(job_dir / "result.tif")], str(job_dir / "tiff_files.zip"))
+    assert not (job_dir / "result.tif").exists()
+    with zipfile.ZipFile(job_dir / "tiff_files.zip") as result:
+        assert result.namelist() == ["result.tif"]
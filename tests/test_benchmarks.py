@@ -0,0 +1,89 @@
+import os
+
+import pytest
+import requests
+
+from benchmarks import fixtures
+from benchmarks.server import BenchmarkServer
+from virtughan import utils
+
+
+@pytest.fixture(scope="module")
+def server(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("fixtures")
+    fixtures.PROFILES["test"] = {"origin": (779400, 3134460), "size": 480}
+    try:
+        items = fixtures.generate_fixtures(
+            str(directory), "test", scenes=3, log=lambda message: None
+        )
+    finally:
+        del fixtures.PROFILES["test"]
+    with BenchmarkServer(str(directory), items) as server:
+        yield server
+
+
+def test_search_pages_like_earth_search(server):
+    body = {
+        "collections": ["sentinel-2-l2a"],
+        "datetime": "2024-12-01T00:00:00Z/2024-12-31T23:59:59Z",
+        "bbox": fixtures.BENCHMARK_BBOX,
+        "limit": 2,
+    }
+    page = requests.post(server.stac_url, json=body).json()
+    assert page["numberMatched"] == 3
+    assert [item["id"] for item in page["features"]] == [
+        "S2A_44RPR_20241211_0_L2A",
+        "S2B_44RPR_20241206_0_L2A",
+    ]
+    next_link = page["links"][0]
+    last = requests.post(next_link["href"], json=next_link["body"]).json()
+    assert [item["id"] for item in last["features"]] == ["S2A_44RPR_20241201_0_L2A"]
+    assert last["links"] == []
+    assert last["features"][0]["assets"]["red"]["href"].startswith(server.url)
+
+
+def test_range_requests_are_counted(server):
+    server.reset()
+    href = server.items[0]["assets"]["red"]["href"]
+    full = requests.get(href).content
+    part = requests.get(href, headers={"Range": "bytes=4-11"})
+    assert part.status_code == 206 and part.content == full[4:12]
+    multipart = requests.get(href, headers={"Range": "bytes=0-3,-4"})
+    assert full[:4] in multipart.content and full[-4:] in multipart.content
+    assert requests.get(f"{server.url}/cogs/").status_code == 404
+    counters = server.snapshot()
+    assert counters["requests"] == 4 and counters["not_found"] == 1
+    assert counters["bytes_read"] == len(full) + 8 + len(multipart.content)
+
+
+def test_configured_stac_endpoint(server):
+    previous = utils.get_stac_endpoint()
+    utils.configure_stac(
+        url=server.stac_url,
+        page_size=2,
+        href_rewrites=utils.parse_href_rewrites(
+            f"{server.url}/cogs/={server.directory}/"
+        ),
+    )
+    try:
+        server.reset()
+        features = utils.search_stac_api(
+            fixtures.BENCHMARK_BBOX, "2024-12-01", "2024-12-31", 100
+        )
+        assert server.snapshot()["stac_requests"] == 2
+        assert len(features) == 3
+        href = features[0]["assets"]["red"]["href"]
+        assert href.startswith(server.directory) and os.path.isfile(href)
+
+        utils.configure_stac(collection="landsat-c2-l2")
+        assert utils.get_stac_endpoint().page_size == 2
+        assert (
+            utils.search_stac_api(
+                fixtures.BENCHMARK_BBOX, "2024-12-01", "2024-12-31", 100
+            )
+            == []
+        )
+    finally:
+        utils.configure_stac(previous)
+    with pytest.raises(ValueError):
+        utils.parse_href_rewrites("s3://bucket/")
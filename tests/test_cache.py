@@ -0,0 +1,48 @@
+import pytest
+
+from virtughan.cache import (
+    DiskCache,
+    MemoryCache,
+    TileCache,
+    make_cache_key,
+    pack_entry,
+    unpack_entry,
+)
+
+
+def test_cache_key_and_entry():
+    assert make_cache_key("tile", x=1, y=2) == make_cache_key("tile", y=2, x=1)
+    assert make_cache_key("tile", x=1, y=2) != make_cache_key("tile", x=2, y=1)
+    payload, meta = unpack_entry(pack_entry(b"png", {"id": "scene"}))
+    assert payload == b"png"
+    assert meta == {"id": "scene"}
+
+
+@pytest.mark.asyncio
+async def test_memory_cache_lru_by_size():
+    cache = MemoryCache(max_bytes=10)
+    await cache.set("a", b"12345", 60)
+    await cache.set("b", b"12345", 60)
+    await cache.get("a")
+    await cache.set("c", b"12345", 60)
+    assert await cache.get("b") is None
+    assert (await cache.get("a"))[0] == b"12345"
+    assert cache.size == 10
+
+    await cache.set("expired", b"1", -1)
+    assert await cache.get("expired") is None
+
+
+@pytest.mark.asyncio
+async def test_tiered_cache_backfills(tmp_path):
+    memory = MemoryCache()
+    disk = DiskCache(str(tmp_path))
+    await disk.set("key", b"tile", 60)
+
+    cache = TileCache([memory, disk])
+    assert await cache.get("key") == b"tile"
+    assert (await memory.get("key"))[0] == b"tile"
+    assert await cache.get("missing") is None
+
+    # a second process sharing the directory sees the same tile
+    assert await TileCache([DiskCache(str(tmp_path))]).get("key") == b"tile"
@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+from matplotlib import colormaps
+
+from virtughan.colormap import apply_lut, formula_rescale, get_lut, parse_rescale
+
+
+def test_lut_matches_matplotlib():
+    lut = get_lut("RdYlGn")
+    assert lut.shape == (256, 4)
+    expected = np.round(np.array(colormaps["RdYlGn"](0.5)) * 255)
+    assert np.abs(lut[128].astype(int) - expected).max() <= 2
+    assert get_lut("RdYlGn") is lut
+
+
+def test_nodata_is_transparent():
+    result = np.ma.masked_array(
+        [[0.0, 0.5], [1.0, np.nan]], mask=[[False, True], [False, False]]
+    )
+    rgba = apply_lut(result, "viridis")
+    assert rgba[..., 3].tolist() == [[255, 0], [255, 0]]
+    assert rgba[0, 0].tolist() == get_lut("viridis")[0].tolist()
+    assert rgba[1, 0].tolist() == get_lut("viridis")[255].tolist()
+
+
+def test_rescale_ranges():
+    assert formula_rescale("(band2 - band1) / (band2 + band1)") == (-1.0, 1.0)
+    assert formula_rescale("band2 - band1 / band2 + band1") is None
+    assert formula_rescale("band1 * 2") is None
+    assert parse_rescale("0,3000") == (0.0, 3000.0)
+    assert parse_rescale(None) is None
+    with pytest.raises(ValueError):
+        parse_rescale("1,0")
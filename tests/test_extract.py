@@ -0,0 +1,162 @@
+import zipfile
+
+import numpy as np
+import pytest
+import rasterio
+from affine import Affine
+from rasterio.crs import CRS
+
+from virtughan import extract
+from virtughan.extract import ExtractProcessor
+
+CRS_UTM = CRS.from_epsg(32644)
+
+
+def _write_band(path, data, resolution):
+    with rasterio.open(
+        path,
+        "w",
+        driver="GTiff",
+        width=data.shape[1],
+        height=data.shape[0],
+        count=1,
+        dtype=data.dtype,
+        crs=CRS_UTM,
+        transform=Affine(resolution, 0, 500000, 0, -resolution, 3100000),
+        nodata=0,
+        tiled=True,
+    ) as dst:
+        dst.write(data, 1)
+
+
+@pytest.fixture
+def scenes(tmp_path, monkeypatch):
+    rng = np.random.default_rng(2)
+    features = []
+    # newest scene first, as returned by the STAC API
+    for day in (20, 10, 1):
+        scene = f"S2A_44RPR_202401{day:02d}"
+        red = rng.integers(1, 5000, (256, 256), dtype=np.uint16)
+        swir = rng.integers(1, 5000, (128, 128), dtype=np.uint16)
+        _write_band(tmp_path / f"{scene}_red.tif", red, 10)
+        _write_band(tmp_path / f"{scene}_swir16.tif", swir, 20)
+        features.append(
+            {
+                "id": scene,
+                "properties": {"datetime": f"2024-01-{day:02d}T05:00:00Z"},
+                "assets": {
+                    "red": {"href": str(tmp_path / f"{scene}_red.tif")},
+                    "swir16": {"href": str(tmp_path / f"{scene}_swir16.tif")},
+                },
+                "data": (red, swir),
+            }
+        )
+    monkeypatch.setattr(extract, "search_stac_api", lambda *args: features)
+    monkeypatch.setattr(
+        extract, "filter_intersected_features", lambda features, bbox: features
+    )
+    monkeypatch.setattr(
+        extract, "remove_overlapping_sentinel2_tiles", lambda features: features
+    )
+    return features
+
+
+def _extract(tmp_path, output_format, zip_output=False, workers=1):
+    processor = ExtractProcessor(
+        [0, 0, 1, 1],
+        "2024-01-01",
+        "2024-02-01",
+        30,
+        ["red", "swir16"],
+        str(tmp_path / "out"),
+        workers=workers,
+        zip_output=zip_output,
+        smart_filter=False,
+        output_format=output_format,
+    )
+    # the 20 m pixels 16 to 80 of both axes
+    processor._transform_bbox = lambda crs: (500320, 3098400, 501600, 3099680)
+    processor.extract()
+    return tmp_path / "out"
+
+
+def _expected(feature):
+    red, swir = feature["data"]
+    return (
+        red[32:160, 32:160].reshape(64, 2, 64, 2).mean(axis=(1, 3)),
+        swir[16:80, 16:80],
+    )
+
+
+def test_invalid_output_format(tmp_path):
+    with pytest.raises(ValueError):
+        ExtractProcessor(
+            [0, 0, 1, 1],
+            "2024-01-01",
+            "2024-02-01",
+            30,
+            ["red"],
+            str(tmp_path),
+            output_format="png",
+        )
+
+
+def test_cog_output_keeps_data_type(tmp_path, scenes):
+    out = _extract(tmp_path, "cog")
+    with rasterio.open(out / f"{scenes[0]['id']}_bands_export.tif") as src:
+        assert src.dtypes == ("uint16", "uint16")
+        assert src.descriptions == (
+            f"{scenes[0]['id']}_red",
+            f"{scenes[0]['id']}_swir16",
+        )
+        assert src.nodata == 0
+        assert src.transform == Affine(20, 0, 500320, 0, -20, 3099680)
+        red, swir = _expected(scenes[0])
+        np.testing.assert_allclose(src.read(1), red, atol=1)
+        np.testing.assert_array_equal(src.read(2), swir)
+
+
+def test_zipped_scenes_are_streamed_to_the_archive(tmp_path, scenes):
+    out = _extract(tmp_path, "cog", zip_output=True, workers=2)
+    assert sorted(path.name for path in out.iterdir()) == ["tiff_files.zip"]
+    with zipfile.ZipFile(out / "tiff_files.zip") as archive:
+        names = archive.namelist()
+        assert sorted(names) == sorted(f"{f['id']}_bands_export.tif" for f in scenes)
+        assert archive.getinfo(names[0]).compress_type == zipfile.ZIP_STORED
+    with rasterio.open(f"/vsizip/{out / 'tiff_files.zip'}/{names[0]}") as src:
+        assert src.count == 2 and src.dtypes[0] == "uint16"
+
+
+def test_stack_output_is_ordered_in_time(tmp_path, scenes):
+    out = _extract(tmp_path, "stack", workers=2)
+    with rasterio.open(out / "bands_stack.tif") as src:
+        assert src.count == 6 and src.dtypes[0] == "uint16"
+        oldest = scenes[-1]
+        assert src.descriptions[:2] == (f"{oldest['id']}:red", f"{oldest['id']}:swir16")
+        assert src.tags(1)["datetime"] == oldest["properties"]["datetime"]
+        red, swir = _expected(oldest)
+        np.testing.assert_allclose(src.read(1), red, atol=1)
+        np.testing.assert_array_equal(src.read(6), _expected(scenes[0])[1])
+
+
+def test_zipped_stack_is_streamed_to_the_archive(tmp_path, scenes):
+    out = _extract(tmp_path, "stack", zip_output=True, workers=2)
+    assert sorted(path.name for path in out.iterdir()) == ["tiff_files.zip"]
+    with zipfile.ZipFile(out / "tiff_files.zip") as archive:
+        assert archive.namelist() == ["bands_stack.tif"]
+    with rasterio.open(f"/vsizip/{out / 'tiff_files.zip'}/bands_stack.tif") as src:
+        assert src.count == 6
+        np.testing.assert_array_equal(src.read(6), _expected(scenes[0])[1])
+
+
+def test_zarr_output(tmp_path, scenes):
+    zarr = pytest.importorskip("zarr")
+    out = _extract(tmp_path, "zarr", zip_output=True)
+    assert sorted(path.name for path in out.iterdir()) == ["tiff_files.zip"]
+    store = zarr.storage.ZipStore(str(out / "tiff_files.zip"), mode="r")
+    cube = zarr.open_array(store=store, path="bands_cube.zarr", mode="r")
+    assert cube.shape == (3, 2, 64, 64)
+    assert cube.attrs["band"] == ["red", "swir16"]
+    assert cube.attrs["time"][0] == scenes[-1]["properties"]["datetime"]
+    np.testing.assert_array_equal(cube[2, 1], _expected(scenes[0])[1])
+    store.close()
@@ -0,0 +1,29 @@
+import pytest
+from rasterio.env import get_gdal_config
+
+from virtughan.gdal_env import IOProfile, configure_io, get_io_profile, io_env
+
+
+def test_profile_options_apply_around_reads():
+    previous = get_io_profile()
+    configure_io("cog", GDAL_HTTP_MAX_RETRY=5, VSI_CACHE=None)
+    try:
+        with io_env():
+            assert get_gdal_config("GDAL_DISABLE_READDIR_ON_OPEN") == "EMPTY_DIR"
+            assert get_gdal_config("GDAL_HTTP_MAX_RETRY", normalize=False) == "5"
+            assert get_gdal_config("VSI_CACHE") is None
+        assert get_gdal_config("GDAL_DISABLE_READDIR_ON_OPEN") is None
+        assert get_gdal_config("GDAL_CACHEMAX") == 512 * 1024 * 1024
+    finally:
+        configure_io(previous)
+
+
+def test_profile_from_env(monkeypatch):
+    monkeypatch.setenv("GDAL_IO_PROFILE", "local")
+    monkeypatch.setenv("GDAL_DISABLE_READDIR_ON_OPEN", "FALSE")
+    profile = IOProfile.from_env()
+    assert profile.name == "local"
+    assert "GDAL_DISABLE_READDIR_ON_OPEN" not in profile.options
+    assert profile.describe()["options"]["VSI_CACHE"] == "FALSE"
+    with pytest.raises(ValueError):
+        IOProfile("fast")
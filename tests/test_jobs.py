@@ -0,0 +1,62 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from virtughan.jobs import (
+    JOB_CANCELLED,
+    JOB_FAILED,
+    JOB_QUEUED,
+    JOB_RUNNING,
+    JobLimitError,
+    JobQueue,
+)
+
+
+@pytest.fixture
+def job_queue(tmp_path):
+    return JobQueue(str(tmp_path / "jobs.db"), workers=1, max_jobs_per_client=2)
+
+
+def test_client_limit(job_queue):
+    job_queue.submit("export", {}, "out", client="a")
+    job_queue.submit("export", {}, "out", client="a")
+    with pytest.raises(JobLimitError):
+        job_queue.submit("export", {}, "out", client="a")
+    # other clients are not affected
+    job_queue.submit("export", {}, "out", client="b")
+
+
+def test_priority_and_slots(job_queue):
+    low = job_queue.submit("export", {}, "out", client="a")
+    high = job_queue.submit("image-download", {}, "out", client="b", priority=5)
+    assert job_queue.status(low)["queue_position"] == 1
+
+    claimed = job_queue.store.claim_next(job_queue.workers)
+    assert claimed["uid"] == high
+    assert job_queue.status(high)["status"] == JOB_RUNNING
+    # the only slot is taken
+    assert job_queue.store.claim_next(job_queue.workers) is None
+
+
+def test_cancel(job_queue):
+    uid = job_queue.submit("export", {}, "out", client="a")
+    assert job_queue.status(uid)["status"] == JOB_QUEUED
+    assert job_queue.cancel(uid)
+    assert job_queue.status(uid)["status"] == JOB_CANCELLED
+    assert not job_queue.cancel(uid)
+
+
+def test_orphaned_jobs_free_their_slot(job_queue):
+    exited = subprocess.Popen([sys.executable, "-c", ""])
+    exited.wait()
+    orphan = job_queue.submit("export", {}, "out", client="a")
+    # the server claiming the job stopped before starting its worker
+    job_queue.store.claim_next(2, pid=exited.pid)
+    # claimed by a live server sharing the database, its worker is starting
+    claimed = job_queue.submit("export", {}, "out", client="b")
+    job_queue.store.claim_next(2, pid=os.getppid())
+    job_queue._fail_orphaned_jobs()
+    assert job_queue.status(orphan)["status"] == JOB_FAILED
+    assert job_queue.status(claimed)["status"] == JOB_RUNNING
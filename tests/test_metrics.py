@@ -0,0 +1,73 @@
+import asyncio
+
+from virtughan.metrics import (
+    Recorder,
+    count,
+    get_recorder,
+    read_summary,
+    recording,
+    span,
+    write_summary,
+)
+
+
+def test_recording_forwards_to_parent(tmp_path):
+    parent = Recorder()
+    with recording() as outer:
+        outer.parent = parent
+        with recording() as recorder:
+            with span("engine.read"):
+                pass
+            with span("engine.read"):
+                pass
+            count("engine.bytes_read", 10)
+        assert get_recorder() is outer
+    summary = recorder.summary()
+    assert summary["spans"]["engine.read"]["count"] == 2
+    assert parent.summary()["counters"] == {"engine.bytes_read": 10}
+
+    write_summary(recorder, str(tmp_path))
+    merged = Recorder()
+    merged.merge(read_summary(str(tmp_path)))
+    merged.merge(read_summary(str(tmp_path)))
+    assert merged.summary()["spans"]["engine.read"]["count"] == 4
+    assert read_summary(str(tmp_path / "missing")) is None
+
+
+def test_spans_of_concurrent_requests_stay_apart():
+    def read(name):
+        with span("tile.read"):
+            count(name)
+
+    async def request(name):
+        with recording() as recorder:
+            # asyncio.to_thread runs the read with the recorder of its request
+            await asyncio.to_thread(read, name)
+            with span("tile.encode"):
+                await asyncio.sleep(0.01)
+            return recorder.summary()
+
+    async def main():
+        return await asyncio.gather(request("tile.a"), request("tile.b"))
+
+    first, second = asyncio.run(main())
+    assert first["counters"] == {"tile.a": 1}
+    assert second["counters"] == {"tile.b": 1}
+    assert set(first["spans"]) == {"tile.read", "tile.encode"}
+
+
+def test_export_formats():
+    recorder = Recorder()
+    recorder.observe("tile.read", 0.25)
+    recorder.observe("tile.read", 0.5)
+    recorder.observe("tile.encode", 0.002)
+    recorder.count("tile.cache_hits", 3)
+    assert recorder.server_timing() == (
+        'tile.encode;dur=2.0, tile.read;dur=750.0;desc="2x"'
+    )
+    text = recorder.prometheus()
+    assert 'virtughan_span_seconds_total{span="tile.read"} 0.75' in text
+    assert 'virtughan_span_count_total{span="tile.read"} 2' in text
+    assert 'virtughan_span_max_seconds{span="tile.read"} 0.5' in text
+    assert 'virtughan_events_total{event="tile.cache_hits"} 3' in text
+    assert "# TYPE virtughan_span_seconds_total counter" in text
@@ -0,0 +1,64 @@
+import json
+import pstats
+import threading
+import time
+
+import pytest
+
+from virtughan.profiling import (
+    MEMORY_FILE_NAME,
+    PSTATS_FILE_NAME,
+    PSTATS_TEXT_FILE_NAME,
+    SPEEDSCOPE_FILE_NAME,
+    profiled,
+)
+
+
+def busy(seconds=0.2):
+    data = []
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        data.append(sum(range(1000)))
+    return data
+
+
+def test_sampling_profile_covers_threads(tmp_path):
+    with profiled(str(tmp_path), "sample", interval=0.002) as written:
+        worker = threading.Thread(target=busy, name="reader")
+        worker.start()
+        busy()
+        worker.join()
+    assert written == [SPEEDSCOPE_FILE_NAME, MEMORY_FILE_NAME]
+
+    with open(tmp_path / SPEEDSCOPE_FILE_NAME) as file:
+        document = json.load(file)
+    names = {profile["name"] for profile in document["profiles"]}
+    assert {"MainThread", "reader"} <= names
+    frames = [frame["name"] for frame in document["shared"]["frames"]]
+    assert "busy" in frames
+    profile = document["profiles"][0]
+    assert len(profile["samples"]) == len(profile["weights"])
+
+    with open(tmp_path / MEMORY_FILE_NAME) as file:
+        memory = json.load(file)
+    assert memory["traced_peak_mb"] >= memory["traced_current_mb"]
+    assert memory["process_peak_rss_mb"] > 0
+
+
+def test_cprofile_profile(tmp_path):
+    with profiled(str(tmp_path), "cprofile"):
+        busy(0.05)
+    stats = pstats.Stats(str(tmp_path / PSTATS_FILE_NAME))
+    assert any(function == "busy" for _, _, function in stats.stats)
+    assert "busy" in (tmp_path / PSTATS_TEXT_FILE_NAME).read_text()
+    assert (tmp_path / MEMORY_FILE_NAME).exists()
+
+
+def test_profiling_disabled(tmp_path):
+    with profiled(str(tmp_path / "job")) as written:
+        busy(0.01)
+    assert written == []
+    assert not (tmp_path / "job").exists()
+    with pytest.raises(ValueError):
+        with profiled(str(tmp_path), "perf"):
+            pass
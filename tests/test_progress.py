@@ -0,0 +1,35 @@
+import json
+
+from tqdm import tqdm
+
+from virtughan.progress import ConsoleChannel, ProgressChannel, get_channel, tail_log
+
+
+def test_channel_scoping_and_files(tmp_path):
+    events = []
+    channel = ProgressChannel(str(tmp_path), flush_interval=0.05)
+    channel.add_listener(events.append)
+
+    assert isinstance(get_channel(), ConsoleChannel)
+    with channel:
+        assert get_channel() is channel
+        channel.log("Starting processing...")
+        for _ in tqdm(range(3), desc="Computing Band Calculation", file=channel.stream):
+            pass
+        channel.emit("scene_processed", done=3, total=3)
+    assert isinstance(get_channel(), ConsoleChannel)
+
+    lines = tail_log(str(tmp_path), lines=2)
+    assert len(lines) == 2
+    assert "Computing Band Calculation" in lines[-1] and "3/3" in lines[-1]
+
+    with open(tmp_path / "events.jsonl") as f:
+        records = [json.loads(line) for line in f]
+    assert records[0]["type"] == "log"
+    assert records[0]["message"] == "Starting processing..."
+    assert records[-1]["type"] == "scene_processed"
+    assert events == records
+
+
+def test_tail_log_missing(tmp_path):
+    assert tail_log(str(tmp_path)) is None
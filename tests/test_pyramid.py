@@ -0,0 +1,79 @@
+import pytest
+from fastapi import HTTPException
+
+from virtughan.pyramid import MBTilesStore
+from virtughan.seed import seed_tiles
+from virtughan.tile import TileProcessor
+
+
+def test_mbtiles_roundtrip(tmp_path):
+    path = str(tmp_path / "tiles.mbtiles")
+    with MBTilesStore(path) as store:
+        store.put(12, 3002, 1712, b"png")
+        store.set_metadata(format="png", bounds=[83.8, 28.2, 83.9, 28.3])
+    with MBTilesStore(path, readonly=True) as store:
+        assert store.get(12, 3002, 1712) == b"png"
+        assert store.get(12, 3002, 1713) is None
+        assert store.metadata()["bounds"] == "83.8,28.2,83.9,28.3"
+        # rows are stored in TMS order
+        row = store._conn.execute("SELECT tile_row FROM tiles").fetchone()[0]
+        assert row == (1 << 12) - 1 - 1712
+
+
+@pytest.mark.asyncio
+async def test_seed_tiles(tmp_path):
+    tile_processor = TileProcessor(metatile=2)
+
+    async def cached_generate_tile(x, y, z, *args, **kwargs):
+        if x % 2:
+            raise HTTPException(status_code=404)
+        return f"{z}/{x}/{y}".encode(), None
+
+    tile_processor.cached_generate_tile = cached_generate_tile
+    with MBTilesStore(str(tmp_path / "tiles.mbtiles")) as store:
+        counts = await seed_tiles(
+            tile_processor,
+            [83.84, 28.22, 83.93, 28.30],
+            12,
+            13,
+            "2024-01-01",
+            "2025-01-01",
+            30,
+            "red",
+            "nir",
+            "(band2-band1)/(band2+band1)",
+            store=store,
+            concurrency=3,
+        )
+        assert counts["failed"] == 0
+        assert counts["rendered"] and counts["empty"]
+        assert store.get(12, 3002, 1712) == b"12/3002/1712"
+        assert store.metadata()["minzoom"] == "12"
+
+
+def test_write_pyramid(tmp_path):
+    import mercantile
+    import numpy as np
+    from rasterio.transform import from_origin
+
+    from virtughan.pyramid import write_pyramid
+
+    data = np.ones((1, 500, 600), dtype=np.float32)
+    transform = from_origin(300000, 3150000, 20, 20)
+    with MBTilesStore(str(tmp_path / "tiles.mbtiles")) as store:
+        minzoom, maxzoom = write_pyramid(
+            store, data, "EPSG:32644", transform, lambda tile: tile.tobytes()
+        )
+        assert maxzoom == 13
+        assert minzoom < maxzoom
+
+        # a point inside the raster has data at every zoom level
+        lon, lat = 79.0, 28.42
+        for zoom in range(minzoom, maxzoom + 1):
+            tile = mercantile.tile(lon, lat, zoom)
+            left, bottom, right, top = mercantile.xy_bounds(tile)
+            x, y = mercantile.xy(lon, lat)
+            column = int((x - left) / (right - left) * 256)
+            row = int((top - y) / (top - bottom) * 256)
+            pixels = np.frombuffer(store.get(zoom, tile.x, tile.y), np.float32)
+            assert pixels.reshape(256, 256)[row, column] == 1
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+from virtughan.reducers import reduce, stack_frames
+from virtughan.utils import aggregate_time_series
+
+
+@pytest.fixture
+def stack():
+    rng = np.random.default_rng(0)
+    data = rng.normal(size=(7, 40, 30)).astype(np.float32)
+    data[rng.random(data.shape) < 0.3] = np.nan
+    # pixels without any valid value
+    data[:, 0, :5] = np.nan
+    return data
+
+
+@pytest.mark.parametrize(
+    "operation, expected",
+    [
+        ("mean", np.nanmean),
+        ("median", np.nanmedian),
+        ("max", np.nanmax),
+        ("min", np.nanmin),
+        ("std", np.nanstd),
+        ("var", np.nanvar),
+        ("p10", lambda data, axis: np.nanpercentile(data, 10, axis=axis)),
+        ("p90", lambda data, axis: np.nanpercentile(data, 90, axis=axis)),
+    ],
+)
+def test_reducers_match_numpy(stack, operation, expected):
+    with np.errstate(all="ignore"), pytest.warns(RuntimeWarning):
+        reference = expected(stack, axis=0)
+    result = reduce(stack, operation, workers=2, chunk_pixels=128)
+    np.testing.assert_allclose(result, reference, rtol=1e-5, atol=1e-6)
+    assert np.isnan(result[0, :5]).all()
+
+
+def test_sum_and_count(stack):
+    np.testing.assert_allclose(
+        reduce(stack, "sum")[1:], np.nansum(stack, axis=0)[1:], rtol=1e-5
+    )
+    assert np.isnan(reduce(stack, "sum")[0, :5]).all()
+    np.testing.assert_array_equal(
+        reduce(stack, "count"), np.isfinite(stack).sum(axis=0)
+    )
+
+
+@pytest.mark.parametrize("operation", ["median", "max", "min", "p10", "p90"])
+def test_reducers_ignore_infinities(stack, operation):
+    with_infinities = stack.copy()
+    with_infinities[0, 1:, :] = np.inf
+    with_infinities[1, 1:, :] = -np.inf
+    without = stack.copy()
+    without[:2, 1:, :] = np.nan
+    np.testing.assert_array_equal(
+        reduce(with_infinities, operation), reduce(without, operation)
+    )
+
+
+def test_masked_frames():
+    frames = [
+        np.ma.masked_array([[1, 2], [3, 4]], mask=[[0, 1], [0, 0]]),
+        np.ma.masked_array([[3, 5], [5, 8]], mask=[[0, 1], [1, 0]]),
+    ]
+    stacked = stack_frames(frames)
+    assert np.issubdtype(stacked.dtype, np.floating)
+    assert np.isnan(stacked[0, 0, 1])
+    result = aggregate_time_series(frames, "mean")
+    np.testing.assert_allclose(result, [[2, np.nan], [3, 6]])
+
+
+def test_unknown_operation(stack):
+    with pytest.raises(ValueError):
+        reduce(stack, "mode")
@@ -0,0 +1,40 @@
+import numpy as np
+
+from virtughan.render import FrameRenderer, annotate, colorize
+
+
+def test_colorize_marks_nodata_transparent():
+    data = np.linspace(0, 1, 16, dtype=np.float32).reshape(1, 4, 4)
+    data[0, 0, 0] = np.nan
+    rgba = colorize(data, "viridis", 0, 1)
+    assert rgba.shape == (4, 4, 4)
+    assert rgba[0, 0, 3] == 0
+    assert (rgba[..., 3].ravel()[1:] == 255).all()
+
+    bands = np.random.default_rng(0).random((3, 4, 4))
+    assert colorize(bands).shape == (4, 4, 4)
+
+
+def test_annotate_downscales_and_adds_title():
+    image = np.zeros((400, 200, 4), dtype=np.uint8)
+    frame = annotate(image, "S2B_44RKQ_20241215_0_L2A", max_size=100)
+    assert frame.mode == "RGB"
+    assert frame.width == 50
+    assert frame.height > 100
+
+
+def test_render_all_keeps_order(tmp_path):
+    frames = [
+        (
+            np.full((1, 8, 8), value, np.float32),
+            f"frame {value}",
+            tmp_path / f"{value}.png",
+        )
+        for value in range(6)
+    ]
+    renderer = FrameRenderer("gray", vmin=0, vmax=5, workers=3)
+    rendered = list(renderer.render_all(frames))
+    assert [frame.getpixel((4, frame.height - 1))[0] for frame in rendered] == sorted(
+        frame.getpixel((4, frame.height - 1))[0] for frame in rendered
+    )
+    assert all(path.exists() for _, _, path in frames)
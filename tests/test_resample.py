@@ -0,0 +1,103 @@
+import numpy as np
+import pytest
+import rasterio
+from affine import Affine
+from rasterio.crs import CRS
+from rasterio.enums import Resampling
+
+from virtughan.engine import VirtughanProcessor
+from virtughan.resample import resample, resampling_plan
+
+CRS_UTM = CRS.from_epsg(32644)
+GRID_10M = Affine(10, 0, 500000, 0, -10, 3100000)
+GRID_20M = Affine(20, 0, 500000, 0, -20, 3100000)
+
+
+@pytest.fixture
+def fine():
+    data = np.random.default_rng(0).random((1, 100, 100))
+    data[0, 0, 0] = np.nan
+    return data
+
+
+def test_block_average_to_coarser_grid(fine):
+    plan = resampling_plan(CRS_UTM, GRID_10M, (100, 100), CRS_UTM, GRID_20M, (50, 50))
+    assert plan.kind == "average" and plan.factor == 2
+    coarse = resample(fine, CRS_UTM, GRID_10M, CRS_UTM, GRID_20M, (50, 50))
+    assert coarse.shape == (1, 50, 50)
+    assert coarse[0, 0, 0] == pytest.approx(np.nanmean(fine[0, :2, :2]))
+    assert coarse[0, 3, 4] == pytest.approx(fine[0, 6:8, 8:10].mean())
+
+    shifted = Affine(20, 0, 500040, 0, -20, 3099960)
+    coarse = resample(fine, CRS_UTM, GRID_10M, CRS_UTM, shifted, (50, 50))
+    assert coarse[0, 0, 0] == pytest.approx(fine[0, 4:6, 4:6].mean())
+    # outside of the source
+    assert np.isnan(coarse[0, -1]).all()
+
+
+def test_repeat_to_finer_grid(fine):
+    coarse = fine[:, ::2, ::2]
+    shifted = Affine(10, 0, 499990, 0, -10, 3100010)
+    plan = resampling_plan(CRS_UTM, GRID_20M, (50, 50), CRS_UTM, shifted, (102, 102))
+    assert plan.kind == "repeat"
+    result = resample(coarse, CRS_UTM, GRID_20M, CRS_UTM, shifted, (102, 102))
+    assert np.isnan(result[0, 0]).all()
+    assert result[0, 1, 1] == coarse[0, 0, 0] or np.isnan(coarse[0, 0, 0])
+    assert result[0, 3, 4] == result[0, 4, 3] == coarse[0, 1, 1]
+
+
+def test_plans_are_cached_and_fall_back_to_warp(fine):
+    grid_15m = Affine(15, 0, 500000, 0, -15, 3100000)
+    resampling_plan.cache_clear()
+    for _ in range(3):
+        result = resample(fine, CRS_UTM, GRID_10M, CRS_UTM, grid_15m, (60, 60))
+    assert result.shape == (1, 60, 60)
+    assert resampling_plan.cache_info().hits == 2
+    plan = resampling_plan(CRS_UTM, GRID_10M, (100, 100), CRS_UTM, grid_15m, (60, 60))
+    assert plan.kind == "warp"
+
+
+def _write_band(path, data, resolution):
+    with rasterio.open(
+        path,
+        "w",
+        driver="GTiff",
+        width=data.shape[1],
+        height=data.shape[0],
+        count=1,
+        dtype=data.dtype,
+        crs=CRS_UTM,
+        transform=Affine(resolution, 0, 500000, 0, -resolution, 3100000),
+        tiled=True,
+    ) as dst:
+        dst.write(data, 1)
+        dst.build_overviews([2, 4], Resampling.average)
+
+
+def test_finer_band_is_read_on_coarser_grid(tmp_path):
+    rng = np.random.default_rng(1)
+    red = rng.integers(1000, 5000, (512, 512), dtype=np.uint16)
+    swir = rng.integers(1000, 5000, (256, 256), dtype=np.uint16)
+    _write_band(tmp_path / "red.tif", red, 10)
+    _write_band(tmp_path / "swir16.tif", swir, 20)
+    processor = VirtughanProcessor(
+        [0, 0, 1, 1],
+        "2024-01-01",
+        "2024-02-01",
+        30,
+        "band1",
+        "red",
+        "swir16",
+        None,
+        False,
+        str(tmp_path),
+    )
+    # the 20 m pixels 16 to 80 of both axes
+    processor._transform_bbox = lambda crs: (500320, 3098400, 501600, 3099680)
+    result, _, transform, _ = processor.fetch_process_custom_band(
+        str(tmp_path / "red.tif"), str(tmp_path / "swir16.tif")
+    )
+    assert transform == Affine(20, 0, 500320, 0, -20, 3099680)
+    assert result.shape == (1, 64, 64)
+    expected = red[32:160, 32:160].reshape(64, 2, 64, 2).mean(axis=(1, 3))
+    np.testing.assert_allclose(result[0], expected, atol=0.5)
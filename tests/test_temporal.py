@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+
+from virtughan.temporal import parse_baseline, parse_temporal_stats, temporal_stats
+
+DATES = ["20230115", "20230301", "20230610", "20231001", "20240120", "20240501"]
+
+
+@pytest.fixture
+def series():
+    rng = np.random.default_rng(0)
+    days = np.array(
+        [
+            (
+                np.datetime64(f"{d[:4]}-{d[4:6]}-{d[6:]}") - np.datetime64("2023-01-15")
+            ).astype(int)
+            for d in DATES
+        ]
+    )
+    times = days / 365.25
+    stack = (0.3 * times[:, None, None] + rng.normal(0, 0.05, (6, 8, 9))).astype(
+        np.float32
+    )
+    stack[rng.random(stack.shape) < 0.2] = np.nan
+    stack[:, 0, 0] = np.nan
+    return times, stack
+
+
+def test_linear_trend_matches_polyfit(series):
+    times, stack = series
+    stats = temporal_stats(stack, DATES, ("slope", "intercept"), chunk_pixels=10)
+    for row, column in [(3, 4), (7, 8)]:
+        values = stack[:, row, column]
+        valid = np.isfinite(values)
+        slope, intercept = np.polyfit(times[valid], values[valid], 1)
+        assert stats["slope"][row, column] == pytest.approx(slope, rel=1e-4)
+        assert stats["intercept"][row, column] == pytest.approx(intercept, abs=1e-5)
+    assert np.isnan(stats["slope"][0, 0])
+
+
+def test_theil_sen(series):
+    times, stack = series
+    stats = temporal_stats(stack, DATES, ("theil_sen_slope", "theil_sen_intercept"))
+    values = stack[:, 2, 5]
+    slopes = [
+        (values[j] - values[i]) / (times[j] - times[i])
+        for i in range(len(DATES))
+        for j in range(i + 1, len(DATES))
+        if np.isfinite(values[i] + values[j])
+    ]
+    slope = np.median(slopes)
+    assert stats["theil_sen_slope"][2, 5] == pytest.approx(slope, rel=1e-4)
+    assert stats["theil_sen_intercept"][2, 5] == pytest.approx(
+        np.nanmedian(values - slope * times), abs=1e-5
+    )
+
+
+def test_extremes_and_anomaly(series):
+    _, stack = series
+    stats = temporal_stats(
+        stack,
+        DATES,
+        ("time_of_max", "time_of_min", "amplitude", "anomaly"),
+        baseline=("2023-01-01", "2023-12-31"),
+    )
+    values = stack[:, 4, 4]
+    day_of_year = [15, 60, 161, 274, 20, 122]
+    assert stats["time_of_max"][4, 4] == day_of_year[np.nanargmax(values)]
+    assert stats["time_of_min"][4, 4] == day_of_year[np.nanargmin(values)]
+    assert stats["amplitude"][4, 4] == pytest.approx(
+        np.nanmax(values) - np.nanmin(values)
+    )
+    assert stats["anomaly"][4, 4] == pytest.approx(
+        np.nanmean(values[4:]) - np.nanmean(values[:4]), abs=1e-6
+    )
+    assert all(np.isnan(result[0, 0]) for result in stats.values())
+
+
+def test_parse_options():
+    assert parse_temporal_stats("slope, anomaly") == ("slope", "anomaly")
+    assert parse_baseline("2023-01-01,2023-12-31") == ("2023-01-01", "2023-12-31")
+    with pytest.raises(ValueError):
+        parse_temporal_stats("slope,trend")
+    with pytest.raises(ValueError):
+        parse_baseline("2023-12-31,2023-01-01")
+    with pytest.raises(ValueError):
+        temporal_stats(np.zeros((2, 3, 3)), DATES[:2], ("anomaly",))
@@ -0,0 +1,249 @@
+import asyncio
+from io import BytesIO
+
+import pytest
+
+from virtughan.tile import TileProcessor
+
+
+@pytest.mark.asyncio
+async def test_concurrent_identical_tiles_render_once():
+    tile_processor = TileProcessor()
+    calls = []
+
+    async def generate_tile(*args, **kwargs):
+        calls.append(args)
+        await asyncio.sleep(0.01)
+        feature = {
+            "id": "S2B_44RPR_20241230_0_L2A",
+            "properties": {"datetime": "2024-12-30T05:14:39Z", "eo:cloud_cover": 2.1},
+        }
+        return b"png", feature
+
+    tile_processor.generate_tile = generate_tile
+    params = dict(
+        x=3002,
+        y=1712,
+        z=12,
+        start_date="2024-01-01",
+        end_date="2025-01-01",
+        cloud_cover=30,
+        band1="red",
+        band2="nir",
+        formula="(band2-band1)/(band2+band1)",
+    )
+    results = await asyncio.gather(
+        *[tile_processor.cached_generate_tile(**params) for _ in range(5)]
+    )
+    assert len(calls) == 1
+    assert all(result == results[0] for result in results)
+
+    # later requests are served from the cache
+    await tile_processor.cached_generate_tile(**params)
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_child_tiles_share_parent_search():
+    tile_processor = TileProcessor()
+    searches = []
+
+    def feature(feature_id, west, south, east, north, date):
+        return {
+            "id": feature_id,
+            "geometry": {
+                "type": "Polygon",
+                "coordinates": [
+                    [
+                        [west, south],
+                        [east, south],
+                        [east, north],
+                        [west, north],
+                        [west, south],
+                    ]
+                ],
+            },
+            "properties": {"datetime": date},
+        }
+
+    async def search(bbox_geojson, start_date, end_date, cloud_cover):
+        searches.append(bbox_geojson)
+        return [
+            feature("S2B_44RPR_20241230_0_L2A", 83.0, 27.0, 85.0, 29.0, "2024-12-30"),
+            feature("S2A_44RQR_20241225_0_L2A", 83.95, 27.0, 85.0, 29.0, "2024-12-25"),
+        ]
+
+    tile_processor.search = search
+    args = ("2024-12-01", "2025-01-01", 30)
+    # two neighbouring z14 tiles, only the eastern one is inside the second footprint
+    west = await tile_processor.find_features(12011, 6851, 14, *args)
+    east = await tile_processor.find_features(12014, 6851, 14, *args)
+
+    assert len(searches) == 1
+    assert [f["id"] for f in west] == ["S2B_44RPR_20241230_0_L2A"]
+    assert [f["id"] for f in east] == [
+        "S2B_44RPR_20241230_0_L2A",
+        "S2A_44RQR_20241225_0_L2A",
+    ]
+
+
+def test_slice_metatile():
+    from PIL import Image
+
+    tile_processor = TileProcessor(metatile=2)
+    image = Image.new("RGB", (512, 512))
+    image.paste((255, 0, 0), (256, 0, 512, 256))
+    tiles = tile_processor._slice_metatile(image, 10, 20)
+    assert sorted(tiles) == [(10, 20), (10, 21), (11, 20), (11, 21)]
+    assert Image.open(BytesIO(tiles[(11, 20)])).getpixel((0, 0)) == (255, 0, 0)
+    assert Image.open(BytesIO(tiles[(10, 21)])).getpixel((0, 0)) == (0, 0, 0)
+
+
+@pytest.mark.asyncio
+async def test_progressive_timeseries_tile_is_refined():
+    tile_processor = TileProcessor(progressive_scenes=3)
+    budgets = []
+
+    async def timeseries_scenes(*args, **kwargs):
+        return [{"id": f"scene-{i}"} for i in range(10)]
+
+    async def generate_tile(*args, max_scenes=None, **kwargs):
+        budgets.append(max_scenes)
+        feature = {
+            "id": "S2B_44RPR_20241230_0_L2A",
+            "properties": {"datetime": "2024-12-30T05:14:39Z", "eo:cloud_cover": 2.1},
+        }
+        return f"png-{max_scenes}".encode(), feature
+
+    tile_processor.timeseries_scenes = timeseries_scenes
+    tile_processor.generate_tile = generate_tile
+    params = dict(
+        x=3002,
+        y=1712,
+        z=12,
+        start_date="2024-01-01",
+        end_date="2025-01-01",
+        cloud_cover=30,
+        band1="red",
+        band2="nir",
+        formula="(band2-band1)/(band2+band1)",
+        latest=False,
+    )
+    image_bytes, feature = await tile_processor.cached_generate_tile(**params)
+    assert image_bytes == b"png-3"
+    assert feature["partial"]
+
+    await asyncio.gather(*tile_processor._refinements)
+    image_bytes, feature = await tile_processor.cached_generate_tile(**params)
+    assert image_bytes == b"png-None"
+    assert "partial" not in feature
+    assert budgets == [3, None]
+
+
+def test_negotiate_tile_format():
+    from virtughan.tile import negotiate_tile_format
+
+    browser = "image/avif,image/webp,image/apng,image/svg+xml,image/*,*/*;q=0.8"
+    assert negotiate_tile_format(browser) == "webp"
+    assert negotiate_tile_format("image/webp;q=0.5, image/png") == "png"
+    assert negotiate_tile_format("application/x-npy") == "npy"
+    assert negotiate_tile_format(None) == "png"
+
+
+@pytest.mark.asyncio
+async def test_dataset_rescale_is_shared_by_child_tiles():
+    import numpy as np
+
+    tile_processor = TileProcessor()
+    renders = []
+
+    async def render_tile(x, y, z, *args, **kwargs):
+        renders.append((x, y, z))
+        return np.linspace(0, 100, 101, dtype=np.float32).reshape(1, 101), None
+
+    tile_processor.render_tile = render_tile
+    args = ("2024-01-01", "2025-01-01", 30, "red", None, "band1")
+    first = await tile_processor.dataset_rescale(12011, 6851, 14, *args)
+    second = await tile_processor.dataset_rescale(12014, 6851, 14, *args)
+    assert first == second == pytest.approx((2.0, 98.0))
+    assert renders == [(750, 428, 10)]
+
+    ndvi = ("2024-01-01", "2025-01-01", 30, "red", "nir", "(band2-band1)/(band2+band1)")
+    assert await tile_processor.dataset_rescale(12011, 6851, 14, *ndvi) == (-1, 1)
+    assert len(renders) == 1
+
+
+@pytest.mark.asyncio
+async def test_timeseries_metatile_without_covering_scene_falls_back():
+    tile_processor = TileProcessor(metatile=2, progressive_scenes=6)
+    generated = []
+
+    async def find_features(*args, **kwargs):
+        # the block straddles a scene edge, no scene covers all of it
+        return []
+
+    async def generate_tile(x, y, z, *args, max_scenes=None, **kwargs):
+        generated.append((x, y, z, max_scenes))
+        feature = {
+            "id": "S2B_44RPR_20241230_0_L2A",
+            "properties": {"datetime": "2024-12-30T05:14:39Z", "eo:cloud_cover": 2.1},
+        }
+        return b"png", feature
+
+    tile_processor.find_features = find_features
+    tile_processor.generate_tile = generate_tile
+    image_bytes, _ = await tile_processor.cached_generate_tile(
+        3002,
+        1712,
+        12,
+        "2024-01-01",
+        "2025-01-01",
+        30,
+        "red",
+        "nir",
+        "(band2-band1)/(band2+band1)",
+        latest=False,
+    )
+    assert image_bytes == b"png"
+    assert generated == [(3002, 1712, 12, None)]
+
+
+@pytest.mark.asyncio
+async def test_metatile_only_serves_tiles_with_the_same_scenes():
+    from PIL import Image
+
+    tile_processor = TileProcessor(metatile=2)
+    old = {
+        "id": "S2A_44RPR_20241220_0_L2A",
+        "properties": {"datetime": "2024-12-20T05:14:39Z", "eo:cloud_cover": 2.1},
+    }
+    new = {
+        "id": "S2B_44RQR_20241230_0_L2A",
+        "properties": {"datetime": "2024-12-30T05:14:39Z", "eo:cloud_cover": 5.0},
+    }
+    rendered = []
+
+    async def find_features(x, y, z, *args):
+        # the newer scene only covers the top left tile of the block
+        return [new, old] if (x, y, z) == (3002, 1712, 12) else [old]
+
+    async def render_tile(x, y, z, *args, **kwargs):
+        rendered.append((x, y, z))
+        return Image.new("RGB", (512, 512)), old
+
+    async def generate_tile(x, y, z, *args, **kwargs):
+        rendered.append((x, y, z))
+        return b"alone", new
+
+    tile_processor.find_features = find_features
+    tile_processor.render_tile = render_tile
+    tile_processor.generate_tile = generate_tile
+    args = ("2024-12-01", "2025-01-01", 30, "red", "nir", "band1")
+
+    image_bytes, feature = await tile_processor.cached_generate_tile(
+        3002, 1712, 12, *args
+    )
+    assert (image_bytes, feature["id"]) == (b"alone", new["id"])
+    _, feature = await tile_processor.cached_generate_tile(3003, 1713, 12, *args)
+    assert feature["id"] == old["id"]
+    assert rendered == [(1501, 856, 11), (3002, 1712, 12)]